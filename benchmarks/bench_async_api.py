@@ -0,0 +1,157 @@
+"""Concurrent polling readers: async read API vs a thread per client.
+
+Generate a database first, then run against it:
+
+    python -m benchmarks.datagen --db /tmp/pantry-bench.db --scale small
+    python -m benchmarks.bench_async_api --db /tmp/pantry-bench.db --clients 100 1000 5000
+
+Each client issues ``--requests`` reads, alternating products (one page of
+100), shopping list and history. The async API is driven in-process on one
+event loop. The baseline runs the same statements (``products_stmt``,
+``grouped_stmt``, ``history_stmts``) on blocking sessions, one thread per
+client up to ``--max-threads``, as a threaded WSGI server would; its latency
+starts once a thread picks the client up. One JSON
+line per mode and client count reports throughput, p50/p99 latency and the
+peak thread count; ``rejected`` counts 503s from the async API's pool
+timeout.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.run import percentile
+
+PATHS = [("/api/products", b"limit=100"), ("/api/shopping", b""), ("/api/history", b"")]
+
+
+def report(server, clients, timings, elapsed, threads, rejected=0):
+    print(json.dumps({
+        "server": server,
+        "clients": clients,
+        "requests": len(timings),
+        "rejected": rejected,
+        "throughput_per_s": round(len(timings) / elapsed, 1),
+        "p50_ms": round(percentile(timings, 50) * 1000, 2),
+        "p99_ms": round(percentile(timings, 99) * 1000, 2),
+        "peak_threads": threads,
+    }))
+
+
+async def run_async(application, cookie: str, clients: int, requests: int):
+    headers = [(b"cookie", f"session={cookie}".encode())]
+    timings, peak, rejected = [], threading.active_count(), 0
+
+    async def request(path, query):
+        status = {}
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": query, "headers": headers}
+        await application(scope, receive, send)
+        assert status["code"] in (200, 503), status
+        return status["code"]
+
+    async def client(index):
+        nonlocal peak, rejected
+        for i in range(requests):
+            path, query = PATHS[(index + i) % len(PATHS)]
+            started = time.perf_counter()
+            if await request(path, query) == 503:
+                rejected += 1
+            timings.append(time.perf_counter() - started)
+            peak = max(peak, threading.active_count())
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(index) for index in range(clients)))
+    return timings, time.perf_counter() - started, peak, rejected
+
+
+def run_threads(user_id: int, clients: int, requests: int, max_threads: int):
+    from pantry_app.models import Product, SessionLocal
+    from pantry_app.read_models import ShoppingRow, stream
+    from pantry_app.services.history import history_stmts
+    from pantry_app.services.inventory import products_stmt
+    from pantry_app.services.shopping import group_items, grouped_stmt
+
+    def products(db):
+        stmt = products_stmt(user_id).order_by(Product.id).limit(100)
+        return json.dumps([dict(row) for row in db.execute(stmt).mappings()])
+
+    def shopping(db):
+        groups = group_items(stream(db, grouped_stmt(user_id), ShoppingRow))
+        return json.dumps([[name, [item.name for item in items]] for name, items in groups])
+
+    def history(db):
+        count, items = history_stmts(user_id, 1, 25)
+        return json.dumps([db.execute(count).scalar(), [entry.name for entry in db.execute(items)]])
+
+    reads = [products, shopping, history]
+    timings, peak = [], threading.active_count()
+    lock = threading.Lock()
+
+    def client(index):
+        nonlocal peak
+        for i in range(requests):
+            started = time.perf_counter()
+            db = SessionLocal()
+            try:
+                reads[(index + i) % len(reads)](db)
+            finally:
+                db.close()
+            with lock:
+                timings.append(time.perf_counter() - started)
+                peak = max(peak, threading.active_count())
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(clients, max_threads)) as pool:
+        list(pool.map(client, range(clients)))
+    return timings, time.perf_counter() - started, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--user", default="bench1")
+    parser.add_argument("--clients", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--max-threads", type=int, default=200)
+    parser.add_argument("--skip-threads", action="store_true")
+    args = parser.parse_args()
+
+    os.environ["PANTRY_DB_PATH"] = os.path.abspath(args.db)
+    from pantry_app.app import app
+    from pantry_app.asgi import application
+    from pantry_app.async_api import engines
+    from pantry_app.models import SessionLocal, User
+
+    app.config["JOBS_AUTOSTART"] = False
+    # the threaded run trips the slow-query log constantly
+    logging.getLogger("pantry_app.metrics").setLevel(logging.ERROR)
+    user = SessionLocal().query(User).filter_by(username=args.user).first()
+    if user is None:
+        raise SystemExit(f"user {args.user!r} not found; run benchmarks.datagen first")
+    cookie = app.session_interface.get_signing_serializer(app).dumps({"user_id": user.id})
+
+    async def run_all():
+        for clients in args.clients:
+            report("asgi", clients, *await run_async(application, cookie, clients, args.requests))
+        await engines.dispose()
+
+    asyncio.run(run_all())
+    if not args.skip_threads:
+        for clients in args.clients:
+            report("threads", clients, *run_threads(user.id, clients, args.requests, args.max_threads))
+
+
+if __name__ == "__main__":
+    main()
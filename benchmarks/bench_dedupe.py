@@ -0,0 +1,81 @@
+"""Duplicate product detection at scale.
+
+Run from the project root:
+
+    python -m benchmarks.bench_dedupe --products 1000 10000 100000
+
+For each size, fills a fresh user's pantry with distinct synthetic names plus
+a share of near-duplicates (plurals, case changes, packaging suffixes) and
+times ``DuplicateService.find``. Reports candidate pairs against the
+all-pairs count, clusters found and how many planted duplicates were
+recovered. One JSON line per size.
+"""
+import argparse
+import json
+import os
+import random
+import string
+import tempfile
+import time
+
+SUFFIXES = [" (can)", " pack", " jar", " fresh"]
+
+
+def synthetic_names(count: int, duplicate_share: float, rng: random.Random):
+    def word():
+        return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 8)))
+
+    names, planted = [], 0
+    while len(names) < count:
+        base = f"{word()} {word()}"
+        names.append(base)
+        if rng.random() < duplicate_share and len(names) < count:
+            variant = rng.choice([base + "s", base.title(), base + rng.choice(SUFFIXES)])
+            names.append(variant)
+            planted += 1
+    return names, planted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--duplicates", type=float, default=0.1, help="share of names given a variant")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    os.environ.setdefault("PANTRY_DB_PATH", os.path.join(tempfile.mkdtemp(), "dedupe-bench.db"))
+    from pantry_app.models import Product, SessionLocal, User, engine, init_db
+    from pantry_app.services.dedupe import DuplicateService
+
+    init_db()
+    rng = random.Random(args.seed)
+    for count in args.products:
+        db = SessionLocal()
+        user = User(username=f"dedupe{count}", password_hash="-")
+        db.add(user)
+        db.commit()
+        names, planted = synthetic_names(count, args.duplicates, rng)
+        with engine.begin() as conn:
+            conn.execute(
+                Product.__table__.insert(),
+                [{"name": name, "quantity": 1, "unit": "g", "user_id": user.id} for name in names],
+            )
+        started = time.perf_counter()
+        found = DuplicateService(user.id).find(max_clusters=count)
+        elapsed = time.perf_counter() - started
+        keys = found["distinct_keys"]
+        print(json.dumps({
+            "products": count,
+            "distinct_keys": keys,
+            "find_ms": round(elapsed * 1000, 2),
+            "us_per_product": round(elapsed / count * 1e6, 2),
+            "candidate_pairs": found["candidate_pairs"],
+            "all_pairs": keys * (keys - 1) // 2,
+            "clusters": found["cluster_count"],
+            "planted": planted,
+        }))
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
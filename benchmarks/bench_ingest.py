@@ -0,0 +1,78 @@
+"""CSV ingest benchmark against a scratch database.
+
+Run from the project root:
+
+    python -m benchmarks.bench_ingest --db /tmp/pantry-ingest.db --rows 10000 100000
+
+For each size it imports a synthetic stocktake twice (all inserts, then all
+updates) and prints one JSON object per run with wall time, rows per second
+and, with ``--trace-memory``, peak traced memory (tracing slows the run
+several times over, so timings from such runs are not comparable).
+"""
+import argparse
+import io
+import json
+import os
+import random
+import time
+import tracemalloc
+
+from benchmarks.datagen import LOCATIONS, UNITS, WORDS
+
+
+def stocktake_csv(rows: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    lines = ["name,quantity,unit,category,location,barcode"]
+    for i in range(rows):
+        lines.append(
+            f"{rng.choice(WORDS)} {i},{rng.randint(0, 500)},{rng.choice(UNITS)},"
+            f"Stock {i % 25},{rng.choice(LOCATIONS)},{7_000_000_000 + i}"
+        )
+    return ("\n".join(lines) + "\n").encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True, help="scratch SQLite file (recreated)")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    # The app binds its engine at import time, so point it at the target first.
+    os.environ["PANTRY_DB_PATH"] = os.path.abspath(args.db)
+    from pantry_app.models import SessionLocal, ensure_default_user, init_db
+    from pantry_app.services.ingest import IngestService
+
+    init_db()
+    db = SessionLocal()
+    user_id = ensure_default_user(db).id
+    db.close()
+
+    for rows in args.rows:
+        payload = stocktake_csv(rows, args.seed + rows)
+        for phase in ("insert", "update"):
+            if args.trace_memory:
+                tracemalloc.start()
+            started = time.perf_counter()
+            report = IngestService(user_id).ingest_csv(io.BytesIO(payload))
+            elapsed = time.perf_counter() - started
+            result = {
+                "rows": rows,
+                "phase": phase,
+                "seconds": round(elapsed, 3),
+                "rows_per_s": round(rows / elapsed),
+                "inserted": report["inserted"],
+                "updated": report["updated"],
+                "errors": report["error_count"],
+            }
+            if args.trace_memory:
+                result["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+                tracemalloc.stop()
+            print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
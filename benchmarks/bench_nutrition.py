@@ -0,0 +1,66 @@
+"""Batch macro computation throughput.
+
+Run from the project root:
+
+    python -m benchmarks.bench_nutrition --recipes 1000 10000 100000
+
+Builds synthetic recipes from the nutrition dataset's names (with some
+decorated and unknown names mixed in) and times ``recipe_macros`` on a fresh
+index and on a warm one. One JSON line per batch size.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+
+def synthetic_recipes(names, count: int, seed: int):
+    rng = random.Random(seed)
+    decorations = ["", "", "chopped ", "fresh ", "large "]
+    units = [("g", 50, 400), ("ml", 20, 250), ("units", 1, 4), ("cup", 1, 2)]
+    recipes = []
+    for i in range(count):
+        ingredients = []
+        for _ in range(rng.randint(4, 9)):
+            unit, low, high = rng.choice(units)
+            name = rng.choice(decorations) + rng.choice(names) if rng.random() > 0.05 else f"mystery {i}"
+            ingredients.append({"name": name, "quantity": rng.randint(low, high), "unit": unit})
+        recipes.append({"name": f"Recipe {i}", "ingredients": ingredients, "servings": rng.randint(1, 6)})
+    return recipes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    os.environ.setdefault("PANTRY_DB_PATH", os.path.join(tempfile.mkdtemp(), "nutrition-bench.db"))
+    from pantry_app.models import init_db
+    from pantry_app.services.nutrition import csv_rows, nutrition_index, recipe_macros, seed_nutrition
+
+    init_db()
+    seed_nutrition()
+    names = [row["name"] for row in csv_rows()]
+    for count in args.recipes:
+        recipes = synthetic_recipes(names, count, args.seed)
+        nutrition_index.reset()
+        started = time.perf_counter()
+        results = recipe_macros(recipes)
+        cold = time.perf_counter() - started
+        started = time.perf_counter()
+        recipe_macros(recipes)
+        warm = time.perf_counter() - started
+        print(json.dumps({
+            "recipes": count,
+            "cold_ms": round(cold * 1000, 2),
+            "warm_ms": round(warm * 1000, 2),
+            "us_per_recipe": round(warm / count * 1e6, 2),
+            "mean_coverage": round(sum(r.coverage for r in results) / count, 3),
+        }))
+
+
+if __name__ == "__main__":
+    main()
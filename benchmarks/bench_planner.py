@@ -0,0 +1,88 @@
+"""Meal-planner benchmark on synthetic data.
+
+Run from the project root:
+
+    python -m benchmarks.bench_planner --candidates 100 300 --pantry 200 2000
+
+Prints one JSON object per scenario with greedy and exact timings.
+"""
+import argparse
+import json
+import random
+import time
+
+from pantry_app.services.planner import PlanProblem, plan_exact, plan_greedy
+
+LOCATIONS = {"fridge": 1.0, "pantry": 0.4, "freezer": 0.2}
+
+
+def synthetic_problem(candidates: int, pantry: int, vocabulary: int, seed: int) -> PlanProblem:
+    rng = random.Random(seed)
+    names = [f"ingredient {i}" for i in range(vocabulary)]
+    recipes = [
+        {
+            "name": f"Recipe {i}",
+            "ingredients": [
+                {"name": rng.choice(names), "quantity": rng.randint(50, 400), "unit": "g"}
+                for _ in range(rng.randint(4, 9))
+            ],
+            "servings": 2,
+        }
+        for i in range(candidates)
+    ]
+    stock = []
+    for i in range(pantry):
+        location = rng.choice(list(LOCATIONS))
+        stock.append(
+            {
+                "product_id": i,
+                "name": rng.choice(names),
+                "quantity": rng.randint(0, 1000),
+                "unit": "g",
+                "urgency": LOCATIONS[location],
+            }
+        )
+    return PlanProblem(recipes, stock)
+
+
+def run(candidates: int, pantry: int, horizon: int, budget: float, seed: int) -> dict:
+    started = time.perf_counter()
+    problem = synthetic_problem(candidates, pantry, vocabulary=max(50, pantry // 4), seed=seed)
+    setup = time.perf_counter() - started
+
+    started = time.perf_counter()
+    greedy = plan_greedy(problem, horizon)
+    greedy_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    exact, optimal = plan_exact(problem, horizon, budget)
+    exact_time = time.perf_counter() - started
+
+    return {
+        "candidates": candidates,
+        "pantry": pantry,
+        "horizon": horizon,
+        "setup_ms": round(setup * 1000, 2),
+        "greedy_ms": round(greedy_time * 1000, 2),
+        "greedy_objective": round(problem.objective(greedy), 4),
+        "exact_ms": round(exact_time * 1000, 2),
+        "exact_objective": round(problem.objective(exact), 4),
+        "exact_optimal": optimal,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--pantry", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--horizon", type=int, default=7)
+    parser.add_argument("--budget-ms", type=float, default=500)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    for candidates in args.candidates:
+        for pantry in args.pantry:
+            print(json.dumps(run(candidates, pantry, args.horizon, args.budget_ms / 1000, args.seed)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Prompt inventory context: size and build time as the pantry grows.
+
+Run from the project root:
+
+    python -m benchmarks.bench_prompt_context --products 1000 10000 100000 1000000
+
+For each size it fills a scratch database with products (a few percent with
+lots expiring this week) and ingredient cooking stats, then builds the
+recipe-prompt inventory both ways: every product, as before, and the
+budgeted context. One JSON line per size reports estimated prompt tokens
+and milliseconds for each.
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.datagen import UNITS, WORDS, batched, product_name
+from pantry_app.models import Base, Category, CookingStat, Product, ProductLot, User
+from pantry_app.services.prompt_context import DEFAULT_TOKEN_BUDGET, PromptContextBuilder, estimate_tokens
+from pantry_app.utils import serialize_json
+
+
+def populate(session, products: int, seed: int):
+    rng = random.Random(seed)
+    session.execute(insert(User.__table__), [{"id": 1, "username": "bench1", "password_hash": "x"}])
+    categories = [f"Category {i}" for i in range(25)]
+    session.execute(insert(Category.__table__), [{"id": i + 1, "name": name} for i, name in enumerate(categories)])
+    today = dt.date.today()
+    rows = (
+        {
+            "id": i + 1,
+            "name": product_name(rng, i),
+            "quantity": rng.randint(0, 500),
+            "unit": rng.choice(UNITS),
+            "low_stock_threshold": rng.randint(0, 10),
+            "category_id": rng.randint(1, len(categories)),
+            "location": "pantry",
+            "user_id": 1,
+        }
+        for i in range(products)
+    )
+    for batch in batched(rows):
+        session.execute(insert(Product.__table__), batch)
+    lots = (
+        {"product_id": rng.randint(1, products), "user_id": 1, "quantity": 1, "expires_on": today + dt.timedelta(days=rng.randint(-1, 10))}
+        for _ in range(max(1, products // 50))
+    )
+    for batch in batched(lots):
+        session.execute(insert(ProductLot.__table__), batch)
+    session.execute(
+        insert(CookingStat.__table__),
+        [{"user_id": 1, "kind": "ingredient", "key": word, "cook_count": rng.randint(1, 200)} for word in WORDS],
+    )
+    session.commit()
+
+
+def full_inventory(session):
+    # What suggest_recipes sent before the context builder.
+    return [
+        {
+            "name": item.name,
+            "quantity": item.quantity,
+            "unit": item.unit,
+            "category": item.category.name if item.category else "Other",
+        }
+        for item in session.query(Product).filter_by(user_id=1).all()
+    ]
+
+
+def timed(func, repeat):
+    samples, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return result, round(statistics.median(samples), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--budget", type=int, default=DEFAULT_TOKEN_BUDGET)
+    parser.add_argument("--keyword", default="tomato")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--full-limit", type=int, default=100_000, help="skip the full-inventory baseline above this")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pantry-prompt-")
+    for products in args.products:
+        path = os.path.join(workdir, f"bench-{products}.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        populate(session, products, args.seed + products)
+
+        builder = PromptContextBuilder(session, 1, args.budget)
+        context, context_ms = timed(lambda: builder.build(args.keyword), args.repeat)
+        result = {
+            "products": products,
+            "budget": args.budget,
+            "context_items": len(context.items),
+            "context_tokens": estimate_tokens(serialize_json(context.items)),
+            "context_ms": context_ms,
+        }
+        if products <= args.full_limit:
+            inventory, full_ms = timed(lambda: full_inventory(session), 1)
+            result.update(
+                full_items=len(inventory),
+                full_tokens=estimate_tokens(serialize_json(inventory)),
+                full_ms=full_ms,
+            )
+        print(json.dumps(result))
+        session.close()
+        engine.dispose()
+        os.remove(path)
+    os.rmdir(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Read models against ORM entities for listing and export reads.
+
+Generate a database first, then run against it:
+
+    python -m benchmarks.datagen --db /tmp/pantry-bench.db --scale medium
+    python -m benchmarks.bench_read_models --db /tmp/pantry-bench.db
+
+For each read (the inventory listing, the grouped shopping list, the full
+cooking history and the export's largest tables), runs the entity-based query the app used
+before (including the lazy ``Product.category`` and ``CookedRecipe.version``
+loads its callers triggered) and the read-model query that replaced it. It
+reports median time, peak traced memory and SQL statements. One JSON line
+per read and path.
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import time
+import tracemalloc
+
+
+def measure(func, repeat: int, counter):
+    samples = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    gc.collect()
+    before = counter.count
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(samples), peak, counter.count - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--user", default="bench1")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ["PANTRY_DB_PATH"] = os.path.abspath(args.db)
+    from sqlalchemy import select
+
+    from benchmarks.run import QueryCounter
+    from pantry_app import read_models
+    from pantry_app.models import (
+        Category,
+        CookedRecipe,
+        Product,
+        SessionLocal,
+        ShoppingItem,
+        User,
+        engine,
+    )
+    from pantry_app.services.inventory import products_stmt
+    from pantry_app.services.shopping import grouped_stmt
+    from pantry_app.sharding import tenant_session
+
+    user = SessionLocal().query(User).filter_by(username=args.user).first()
+    if user is None:
+        raise SystemExit(f"user {args.user!r} not found; run benchmarks.datagen first")
+    counter = QueryCounter(engine)
+
+    def fresh(func):
+        # a new session per run, as each request gets, so nothing is served
+        # from a warm identity map
+        def run():
+            db = tenant_session(user.id)
+            try:
+                return func(db)
+            finally:
+                db.close()
+
+        return run
+
+    def orm_products(db):
+        products = db.execute(select(Product).where(Product.user_id == user.id)).scalars().all()
+        return [(p.name, p.category.name if p.category else None) for p in products]
+
+    def orm_shopping(db):
+        stmt = (
+            select(ShoppingItem, Category.name)
+            .outerjoin(Product, Product.id == ShoppingItem.linked_product_id)
+            .outerjoin(Category, Category.id == Product.category_id)
+            .where(ShoppingItem.user_id == user.id)
+            .order_by(ShoppingItem.status.desc(), ShoppingItem.name)
+        )
+        return [(item.name, section) for item, section in db.execute(stmt)]
+
+    def orm_history(db):
+        cooked = db.execute(select(CookedRecipe).where(CookedRecipe.user_id == user.id)).scalars().all()
+        return [(c.name, c.version.content_hash if c.version else None) for c in cooked]
+
+    def model_history(db):
+        stmt = select(*read_models.COOKED_COLUMNS).where(CookedRecipe.user_id == user.id)
+        return read_models.read(db, stmt, read_models.CookedRow)
+
+    def orm_export(db):
+        shopping = [(i.name, i.status) for i in db.query(ShoppingItem).filter_by(user_id=user.id)]
+        return orm_products(db) + orm_history(db) + shopping
+
+    def model_export(db):
+        reader = read_models.ExportReader(db, user.id)
+        return [*reader.products(), *reader.cooked(), *reader.shopping()]
+
+    def model_products(db):
+        return read_models.read(db, products_stmt(user.id), read_models.ProductRow)
+
+    def model_shopping(db):
+        return read_models.read(db, grouped_stmt(user.id), read_models.ShoppingRow)
+
+    reads = {
+        "inventory": (orm_products, model_products),
+        "shopping": (orm_shopping, model_shopping),
+        "history": (orm_history, model_history),
+        "export": (orm_export, model_export),
+    }
+    for name, (orm, model) in reads.items():
+        for path, func in (("orm", orm), ("read_model", model)):
+            rows = fresh(func)()
+            seconds, peak, statements = measure(fresh(func), args.repeat, counter)
+            print(json.dumps({
+                "read": name,
+                "path": path,
+                "rows": len(rows),
+                "ms": round(seconds * 1000, 2),
+                "peak_mb": round(peak / 2**20, 2),
+                "statements": statements,
+            }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""JSON export vs compact binary snapshot: size and round-trip time.
+
+Run from the project root:
+
+    python -m benchmarks.bench_snapshot --products 100000 1000000
+
+For each size it builds a synthetic export payload (products plus a
+proportional amount of history, recipes and shopping items), then writes
+and reads it back in both formats. One JSON line per format and size
+reports bytes, encode and decode seconds; the binary decode includes
+checksum verification.
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.datagen import LOCATIONS, TAGS, UNITS, ingredient_list, product_name
+from pantry_app.snapshot import read_snapshot, write_snapshot
+from pantry_app.utils import serialize_json
+
+
+def payload(products: int, seed: int):
+    rng = random.Random(seed)
+    categories = [f"Category {i}" for i in range(25)]
+    recipes = [
+        {
+            "hash": f"{i:064x}",
+            "name": f"Recipe {i}",
+            "ingredients": ingredient_list(rng, categories),
+            "instructions": "Mix everything and cook until done.",
+            "tags": rng.sample(TAGS, 2),
+            "servings": rng.randint(1, 6),
+        }
+        for i in range(max(1, products // 100))
+    ]
+    start = dt.datetime(2020, 1, 1)
+    return {
+        "products": [
+            {
+                "name": product_name(rng, i),
+                "quantity": rng.randint(0, 500),
+                "unit": rng.choice(UNITS),
+                "low_stock_threshold": rng.randint(0, 10),
+                "location": rng.choice(LOCATIONS),
+                "category": rng.choice(categories),
+                "notes": "",
+            }
+            for i in range(products)
+        ],
+        "categories": [{"name": name} for name in categories],
+        "saved_recipes": [],
+        "recipes": recipes,
+        "cooked_recipes": [
+            {
+                "name": recipe["name"],
+                "recipe": recipe["hash"],
+                "servings": recipe["servings"],
+                "cooked_at": (start + dt.timedelta(hours=i)).isoformat(),
+                "rating": rng.choice([None, 3, 4, 5]),
+            }
+            for i, recipe in enumerate(rng.choices(recipes, k=max(1, products // 10)))
+        ],
+        "shopping_items": [
+            {"name": product_name(rng, i), "quantity": 1.0, "unit": "units", "status": "to_buy"}
+            for i in range(max(1, products // 100))
+        ],
+        "barcode_memory": [
+            {"barcode": str(7_000_000_000 + i), "name": product_name(rng, i), "category_name": None}
+            for i in range(max(1, products // 10))
+        ],
+    }
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, round(time.perf_counter() - started, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pantry-snapshot-")
+    for products in args.products:
+        data = payload(products, args.seed + products)
+
+        json_path = os.path.join(workdir, "export.json")
+
+        def write_json():
+            with open(json_path, "w", encoding="utf-8") as out:
+                out.write(serialize_json(data))
+
+        def read_json():
+            with open(json_path, encoding="utf-8") as source:
+                return json.load(source)
+
+        _, encode = timed(write_json)
+        decoded, decode = timed(read_json)
+        assert len(decoded["products"]) == products
+        print(json.dumps({
+            "products": products,
+            "format": "json",
+            "bytes": os.path.getsize(json_path),
+            "encode_s": encode,
+            "decode_s": decode,
+        }))
+        os.remove(json_path)
+
+        binary_path = os.path.join(workdir, "export.pantry")
+        meta, encode = timed(write_snapshot, data, binary_path)
+        decoded, decode = timed(read_snapshot, binary_path)
+        assert decoded["products"][-1]["name"] == data["products"][-1]["name"]
+        print(json.dumps({
+            "products": products,
+            "format": "binary",
+            "bytes": meta["bytes"],
+            "encode_s": encode,
+            "decode_s": decode,
+        }))
+        os.remove(binary_path)
+    os.rmdir(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Taste profile: refresh cost and per-candidate ranking time.
+
+Generate a database with a long cooking history first, then run against it:
+
+    python -m benchmarks.datagen --db /tmp/pantry-bench.db --scale small --cooked 20000 --years 10
+    python -m benchmarks.bench_taste --db /tmp/pantry-bench.db
+
+Reports, as one JSON line: rebuilding the rollups from the full history
+(what a from-scratch profile would cost), loading the profile from the
+rollups, refreshing it incrementally after one cook and one rating, and the
+mean microseconds to score one candidate, both from recipe dicts (LLM
+suggestions) and over the match engine's ingredient matrix. The cook and
+rating are written to the database.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+
+def timed(func, repeat: int = 1):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--user", default="bench1")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ["PANTRY_DB_PATH"] = os.path.abspath(args.db)
+    from pantry_app.models import CookedRecipe, SessionLocal, User
+    from pantry_app.services.history import HistoryService
+    from pantry_app.services.matching import MatchEngine, load_recipe_library
+    from pantry_app.services.recipes import RecipeService
+    from pantry_app.services.taste import TasteProfile
+    from pantry_app.sharding import tenant_session
+
+    user = SessionLocal().query(User).filter_by(username=args.user).first()
+    if user is None:
+        raise SystemExit(f"user {args.user!r} not found; run benchmarks.datagen first")
+    db = tenant_session(user.id)
+    history_rows = db.query(CookedRecipe).filter_by(user_id=user.id).count()
+
+    rebuild = timed(lambda: HistoryService(user.id, db=db).rebuild())
+    load = timed(lambda: TasteProfile(user.id).refresh(db), args.repeat)
+
+    profile = TasteProfile(user.id).refresh(db)
+    library = load_recipe_library(db, user.id)
+    service = RecipeService(user.id)
+    cooked = service.cook_recipe(library[0], 1)
+    service.rate_cooked(cooked.id, 9)
+    incremental = timed(lambda: profile.refresh(db))
+
+    candidates = [
+        ([ing.get("name", "") for ing in recipe["ingredients"] if isinstance(ing, dict)], recipe["tags"])
+        for recipe in library
+    ]
+    per_dict = timed(lambda: [profile.score(names, tags) for names, tags in candidates], args.repeat)
+    engine = MatchEngine(user.id)
+    engine.matches(limit=1)
+    per_row = timed(lambda: engine._taste_scores(profile), args.repeat)
+
+    print(json.dumps({
+        "cooked_history": history_rows,
+        "candidates": len(library),
+        "profile_keys": len(profile.ingredients) + len(profile.tags),
+        "rollup_rebuild_ms": round(rebuild * 1000, 2),
+        "profile_load_ms": round(load * 1000, 2),
+        "incremental_refresh_ms": round(incremental * 1000, 2),
+        "score_us_per_candidate": round(per_dict / max(len(candidates), 1) * 1e6, 2),
+        "matrix_score_us_per_candidate": round(per_row / max(len(library), 1) * 1e6, 2),
+    }))
+
+
+if __name__ == "__main__":
+    main()
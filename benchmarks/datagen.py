@@ -0,0 +1,258 @@
+"""Synthetic pantry data generator.
+
+Builds a standalone SQLite database with users, categories, products,
+barcodes, shopping items and years of saved/cooked recipes (cooked entries
+reference shared recipe versions, as the app writes them):
+
+    python -m benchmarks.datagen --db /tmp/pantry-bench.db --scale medium
+
+Every generated user logs in with password ``bench``; user 1 is ``bench1``.
+Row counts are per user and can be overridden individually. Generation is
+deterministic for a given ``--seed``.
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import random
+import sys
+import time
+
+SCALES = {
+    # users, products, cooked, saved, shopping (per user)
+    "tiny": (1, 200, 200, 20, 20),
+    "small": (2, 1_000, 1_000, 100, 50),
+    "medium": (5, 20_000, 20_000, 500, 200),
+    "large": (10, 100_000, 100_000, 2_000, 1_000),
+}
+BATCH = 5_000
+PASSWORD = "bench"
+
+WORDS = (
+    "tomato onion garlic rice pasta spinach cheese chicken beef pork salmon tuna "
+    "milk butter yogurt egg flour sugar oats lentil bean pepper carrot potato apple "
+    "banana lemon lime basil parsley cumin paprika honey vinegar mustard ketchup "
+    "bread tortilla noodle tofu mushroom zucchini broccoli cabbage corn pea"
+).split()
+ADJECTIVES = "fresh dried smoked organic frozen canned whole sliced ground spicy".split()
+UNITS = ["g", "kg", "ml", "L", "units", "packs"]
+LOCATIONS = ["pantry", "fridge", "freezer"]
+TAGS = ["vegan", "vegetarian", "quick-meal", "budget", "spicy", "high-protein", "low-carb"]
+
+
+def product_name(rng: random.Random, i: int) -> str:
+    return f"{rng.choice(ADJECTIVES)} {rng.choice(WORDS)} {i}"
+
+
+def ingredient_list(rng: random.Random, categories):
+    return [
+        {
+            "name": rng.choice(WORDS),
+            "quantity": rng.randint(20, 400),
+            "unit": rng.choice(["g", "ml", "units"]),
+            "category": rng.choice(categories),
+        }
+        for _ in range(rng.randint(3, 9))
+    ]
+
+
+def batched(rows, size=BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(users: int, products: int, cooked: int, saved: int, shopping: int, years: int, seed: int):
+    from werkzeug.security import generate_password_hash
+
+    from pantry_app import models
+    from pantry_app.services.history import HistoryService
+
+    models.init_db()
+    rng = random.Random(seed)
+    engine = models.engine
+    password_hash = generate_password_hash(PASSWORD)
+    now = dt.datetime.utcnow()
+    categories = models.get_default_categories()
+    counts = {}
+    with engine.begin() as conn:
+        conn.exec_driver_sql("PRAGMA synchronous=OFF")
+        start_user = conn.exec_driver_sql("SELECT COALESCE(MAX(id), 0) FROM users").scalar() + 1
+        user_ids = list(range(start_user, start_user + users))
+        conn.execute(
+            models.User.__table__.insert(),
+            [
+                {
+                    "id": uid,
+                    "username": f"bench{uid}",
+                    "password_hash": password_hash,
+                    "default_units": "metric",
+                    "theme": "light",
+                    "llm_config": "{}",
+                    "created_at": now,
+                }
+                for uid in user_ids
+            ],
+        )
+        barcode_seq = conn.exec_driver_sql("SELECT COUNT(*) FROM barcode_memory").scalar()
+        for uid in user_ids:
+            conn.execute(
+                models.Category.__table__.insert(),
+                [{"name": name, "user_id": uid} for name in categories],
+            )
+            cat_ids = [
+                row[0]
+                for row in conn.exec_driver_sql(
+                    "SELECT id FROM categories WHERE user_id = ?", (uid,)
+                )
+            ]
+
+            def product_rows():
+                for i in range(products):
+                    threshold = rng.choice([0, 0, 1, 2, 5])
+                    yield {
+                        "name": product_name(rng, i),
+                        "quantity": round(rng.uniform(0, 10) * rng.choice([1, 100]), 1),
+                        "unit": rng.choice(UNITS),
+                        "low_stock_threshold": threshold,
+                        "category_id": rng.choice(cat_ids),
+                        "location": rng.choice(LOCATIONS),
+                        "notes": "",
+                        "barcode": f"{uid:04d}{i:09d}" if i % 3 == 0 else None,
+                        "user_id": uid,
+                    }
+
+            for batch in batched(product_rows()):
+                conn.execute(models.Product.__table__.insert(), batch)
+                barcodes = [
+                    {
+                        "barcode": row["barcode"],
+                        "name": row["name"],
+                        "category_name": rng.choice(categories),
+                        "user_id": uid,
+                    }
+                    for row in batch
+                    if row["barcode"]
+                ]
+                if barcodes:
+                    conn.execute(models.BarcodeMemory.__table__.insert(), barcodes)
+                    barcode_seq += len(barcodes)
+
+            recipe_pool = [
+                {
+                    "name": f"{rng.choice(ADJECTIVES).title()} {rng.choice(WORDS)} dish {i}",
+                    "ingredients": json.dumps(ingredient_list(rng, categories)),
+                    "instructions": "Combine and cook.",
+                    "tags": json.dumps(rng.sample(TAGS, k=rng.randint(1, 3))),
+                    "servings": rng.randint(1, 6),
+                }
+                for i in range(max(saved, 50))
+            ]
+            version_ids = [
+                models.store_recipe_version(
+                    conn,
+                    uid,
+                    recipe["name"],
+                    recipe["ingredients"],
+                    recipe["instructions"],
+                    recipe["tags"],
+                    recipe["servings"],
+                )
+                for recipe in recipe_pool
+            ]
+            for batch in batched(
+                dict(
+                    recipe,
+                    user_id=uid,
+                    recipe_version_id=version_ids[i],
+                    ingredients=None,
+                    instructions=None,
+                    tags=None,
+                )
+                for i, recipe in enumerate(recipe_pool[:saved])
+            ):
+                conn.execute(models.SavedRecipe.__table__.insert(), batch)
+
+            span_seconds = years * 365 * 24 * 3600
+
+            def cooked_rows():
+                for _ in range(cooked):
+                    i = rng.randrange(len(recipe_pool))
+                    yield dict(
+                        name=recipe_pool[i]["name"],
+                        recipe_version_id=version_ids[i],
+                        servings=rng.randint(1, 6),
+                        cooked_at=now - dt.timedelta(seconds=rng.randint(0, span_seconds)),
+                        rating=rng.choice([None, None, 3, 4, 5, 6, 7, 8, 9, 10]),
+                        user_id=uid,
+                    )
+
+            for batch in batched(cooked_rows()):
+                conn.execute(models.CookedRecipe.__table__.insert(), batch)
+
+            if shopping:
+                conn.execute(
+                    models.ShoppingItem.__table__.insert(),
+                    [
+                        {
+                            "name": rng.choice(WORDS),
+                            "quantity": rng.randint(1, 5),
+                            "unit": "units",
+                            "status": rng.choice(["to_buy", "bought"]),
+                            "user_id": uid,
+                        }
+                        for _ in range(shopping)
+                    ],
+                )
+        counts = {
+            "users": users,
+            "products": users * products,
+            "cooked_recipes": users * cooked,
+            "saved_recipes": users * saved,
+            "shopping_items": users * shopping,
+            "barcodes": barcode_seq,
+        }
+    for uid in user_ids:
+        HistoryService(uid).rebuild()
+    return user_ids, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True, help="SQLite file to create or extend")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--products", type=int, help="products per user")
+    parser.add_argument("--cooked", type=int, help="cooked recipes per user")
+    parser.add_argument("--saved", type=int, help="saved recipes per user")
+    parser.add_argument("--shopping", type=int, help="shopping items per user")
+    parser.add_argument("--years", type=int, default=3, help="span of cooking history")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # The app binds its engine at import time, so point it at the target first.
+    os.environ["PANTRY_DB_PATH"] = os.path.abspath(args.db)
+    users, products, cooked, saved, shopping = SCALES[args.scale]
+    started = time.perf_counter()
+    user_ids, counts = generate(
+        users=args.users or users,
+        products=args.products if args.products is not None else products,
+        cooked=args.cooked if args.cooked is not None else cooked,
+        saved=args.saved if args.saved is not None else saved,
+        shopping=args.shopping if args.shopping is not None else shopping,
+        years=args.years,
+        seed=args.seed,
+    )
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    counts["usernames"] = [f"bench{uid}" for uid in user_ids]
+    json.dump(counts, sys.stdout)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
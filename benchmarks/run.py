@@ -0,0 +1,238 @@
+"""Benchmark harness for the main routes and service calls.
+
+Generate a database first, then run the suite against it:
+
+    python -m benchmarks.datagen --db /tmp/pantry-bench.db --scale small
+    python -m benchmarks.run --db /tmp/pantry-bench.db --output results.json
+    python -m benchmarks.run --db /tmp/pantry-bench.db --compare results.json
+
+Each scenario reports throughput, p50/p99/mean latency and SQL statements per
+operation. Results are JSON so two runs can be diffed with ``--compare``.
+The suite writes to the database (cooking, shopping sync, import), so run it
+against a scratch copy.
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(name: str, func: Callable, iterations: int, warmup: int, counter: QueryCounter) -> Dict:
+    for _ in range(warmup):
+        func()
+    timings = []
+    queries = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        before = counter.count
+        op_start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - op_start)
+        queries += counter.count - before
+    total = time.perf_counter() - started
+    return {
+        "name": name,
+        "iterations": iterations,
+        "throughput_per_s": round(iterations / total, 2) if total else None,
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 3),
+        "queries_per_op": round(queries / iterations, 2),
+    }
+
+
+def scenarios(username: str, password: str):
+    from pantry_app.app import app
+    from pantry_app.models import Product, SessionLocal, User
+    from pantry_app.services.export_import import ExportImportService
+    from pantry_app.services.inventory import InventoryService
+    from pantry_app.services.recipes import RecipeService
+    from pantry_app.services.shopping import ShoppingService
+
+    db = SessionLocal()
+    user = db.query(User).filter_by(username=username).first()
+    if user is None:
+        raise SystemExit(f"user {username!r} not found; run benchmarks.datagen first")
+    user_id = user.id
+    sample_names = [
+        row.name for row in db.query(Product.name).filter_by(user_id=user_id).limit(200)
+    ]
+    db.close()
+
+    client = app.test_client()
+    response = client.post("/login", data={"username": username, "password": password})
+    if response.status_code != 302:
+        raise SystemExit("login failed")
+
+    recipe = {
+        "name": "Benchmark stew",
+        "ingredients": [
+            {"name": name, "quantity": 1, "unit": "g", "category": "Other"}
+            for name in sample_names[:6]
+        ],
+        "instructions": "Stir.",
+        "tags": ["budget"],
+        "servings": 2,
+    }
+    import_payload = json.dumps(
+        {"products": [{"name": name, "quantity": 5, "unit": "g"} for name in sample_names]}
+    ).encode()
+
+    def get(path):
+        def run():
+            resp = client.get(path)
+            assert resp.status_code == 200, (path, resp.status_code)
+
+        return run
+
+    def post(path, data, status):
+        def run():
+            resp = client.post(path, data=data)
+            assert resp.status_code == status, (path, resp.status_code)
+
+        return run
+
+    def post_import():
+        import io
+
+        resp = client.post(
+            "/import",
+            data={"file": (io.BytesIO(import_payload), "import.json")},
+            content_type="multipart/form-data",
+        )
+        assert resp.status_code == 302
+
+    return {
+        "route.inventory": get("/inventory"),
+        "route.inventory_low_stock": get("/inventory?low_stock=1"),
+        "route.recipes_page": get("/recipes"),
+        "route.recipes_suggest": post("/recipes", {"keyword": "", "servings": 2}, 200),
+        "route.recipes_cook": post("/recipes/cook", {"recipe": json.dumps(recipe), "servings": 2}, 302),
+        "route.history": get("/history"),
+        "route.history_stats": get("/history/stats"),
+        "route.shopping": get("/shopping"),
+        "route.export": get("/export"),
+        "route.import": post_import,
+        "service.inventory_products": lambda: InventoryService(user_id).get_products(),
+        "service.recipes_suggest": lambda: RecipeService(user_id).suggest_recipes(
+            servings=2, preferences={"tags": []}
+        ),
+        "service.shopping_sync": lambda: ShoppingService(user_id).auto_low_stock_items(),
+        "service.export_all": lambda: ExportImportService(user_id).export_all(),
+    }
+
+
+def compare(current: Dict, baseline: Dict) -> List[Dict]:
+    base = {r["name"]: r for r in baseline.get("results", [])}
+    rows = []
+    for result in current["results"]:
+        old = base.get(result["name"])
+        if not old:
+            continue
+        rows.append(
+            {
+                "name": result["name"],
+                "p50_change_pct": _change(old["p50_ms"], result["p50_ms"]),
+                "p99_change_pct": _change(old["p99_ms"], result["p99_ms"]),
+                "queries_change": round(result["queries_per_op"] - old["queries_per_op"], 2),
+            }
+        )
+    return rows
+
+
+def _change(old: float, new: float):
+    if not old:
+        return None
+    return round((new - old) / old * 100, 1)
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--user", default="bench1")
+    parser.add_argument("--password", default="bench")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--only", nargs="*", help="scenario names or prefixes to run")
+    parser.add_argument("--output", help="write results JSON here instead of stdout")
+    parser.add_argument("--compare", help="baseline results JSON to diff against")
+    args = parser.parse_args()
+
+    # The app binds its engine at import time, so point it at the target first.
+    os.environ["PANTRY_DB_PATH"] = os.path.abspath(args.db)
+    # The harness repeats each route back to back; lift the per-user rate
+    # limits of the admission gates so it measures the work, not the 429s.
+    for gate in ("llm", "export", "import", "plan"):
+        os.environ.setdefault(f"PANTRY_ADMISSION_{gate.upper()}", "rate=1000,burst=1000")
+    from pantry_app.models import engine
+
+    counter = QueryCounter(engine)
+    selected = scenarios(args.user, args.password)
+    if args.only:
+        selected = {
+            name: func
+            for name, func in selected.items()
+            if any(name == want or name.startswith(want) for want in args.only)
+        }
+    results = [
+        measure(name, func, args.iterations, args.warmup, counter)
+        for name, func in selected.items()
+    ]
+    report = {
+        "meta": {
+            "timestamp": dt.datetime.utcnow().isoformat(timespec="seconds"),
+            "db": os.path.abspath(args.db),
+            "db_bytes": os.path.getsize(args.db),
+            "user": args.user,
+            "iterations": args.iterations,
+            "python": platform.python_version(),
+            "revision": _git_revision(),
+        },
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare) as handle:
+            report["comparison"] = compare(report, json.load(handle))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
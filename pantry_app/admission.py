@@ -0,0 +1,205 @@
+"""Admission control for expensive endpoints.
+
+Each :class:`Gate` guards one class of work (LLM suggestions, exports,
+imports, meal planning). A request entering a gate passes three checks:
+
+1. a per-user token bucket (:mod:`pantry_app.ratelimit`), refilling at
+   ``rate`` requests per second up to ``burst``; empty means 429;
+2. at most ``per_user`` of that user's requests in flight; more means 429;
+3. at most ``total`` requests in flight across all users. When the gate is
+   full, up to ``queue`` requests wait, each for at most ``timeout``
+   seconds; a full queue or an expired wait means 503.
+
+Rejections raise :class:`Rejected` with a Retry-After hint: the bucket's
+refill time for rate limits, otherwise the gate's recent mean duration.
+Requests refused at steps 2 or 3 get their token back.
+
+Limits are per gate and can be overridden with an environment variable
+per gate, e.g. ``PANTRY_ADMISSION_LLM="per_user=1,total=4,rate=0.1,burst=3"``.
+Routes opt in with the :func:`admit` decorator:
+
+    @app.route("/export")
+    @login_required
+    @admit("export")
+    def export_data(): ...
+"""
+import functools
+import os
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Optional, Sequence
+
+from flask import request, session
+
+from pantry_app import metrics
+from pantry_app.ratelimit import KeyedLimiter
+
+
+class Limits(NamedTuple):
+    per_user: int
+    total: int
+    rate: float
+    burst: float
+    queue: int
+    timeout: float
+
+
+DEFAULT_LIMITS: Dict[str, Limits] = {
+    # An LLM call takes seconds and may spend external quota.
+    "llm": Limits(per_user=1, total=4, rate=1 / 10, burst=3, queue=8, timeout=10.0),
+    "export": Limits(per_user=1, total=2, rate=1 / 5, burst=3, queue=4, timeout=5.0),
+    "import": Limits(per_user=1, total=2, rate=1 / 10, burst=3, queue=4, timeout=5.0),
+    "plan": Limits(per_user=2, total=4, rate=1 / 2, burst=5, queue=8, timeout=5.0),
+}
+# weight of the newest request in the mean duration used for Retry-After
+DURATION_SMOOTHING = 0.2
+
+ADMITTED = metrics.registry.register(
+    metrics.Counter("pantry_admission_admitted_total", "Requests admitted by gate.", ("gate",))
+)
+REJECTED = metrics.registry.register(
+    metrics.Counter(
+        "pantry_admission_rejected_total",
+        "Requests refused by gate and reason (rate, user, queue_full, timeout).",
+        ("gate", "reason"),
+    )
+)
+IN_FLIGHT = metrics.registry.register(
+    metrics.Gauge("pantry_admission_in_flight", "Admitted requests still running, by gate.", ("gate",))
+)
+QUEUED = metrics.registry.register(
+    metrics.Gauge("pantry_admission_queued", "Requests waiting for a slot, by gate.", ("gate",))
+)
+WAIT_SECONDS = metrics.registry.register(
+    metrics.Histogram("pantry_admission_wait_seconds", "Time admitted requests waited for a slot.", ("gate",))
+)
+
+
+class Rejected(Exception):
+    def __init__(self, gate: str, reason: str, status: int, retry_after: float):
+        super().__init__(f"{gate}: {reason}")
+        self.gate = gate
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+def limits_from_env(name: str, default: Limits) -> Limits:
+    """``default`` with fields overridden by ``PANTRY_ADMISSION_<NAME>``."""
+    spec = os.environ.get(f"PANTRY_ADMISSION_{name.upper()}")
+    if not spec:
+        return default
+    values = default._asdict()
+    for part in spec.split(","):
+        key, _, value = part.partition("=")
+        key = key.strip()
+        if key in values and value.strip():
+            values[key] = type(values[key])(float(value))
+    return Limits(**values)
+
+
+class Gate:
+    def __init__(self, name: str, limits: Limits, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.limits = limits
+        self.clock = clock
+        self.buckets = KeyedLimiter(limits.rate, limits.burst, clock=clock)
+        self.active = 0
+        self.waiting = 0
+        self.by_user: Dict[int, int] = {}
+        self.mean_duration = 1.0
+        self._cond = threading.Condition()
+
+    def enter(self, user_id: int):
+        """Block until admitted or raise :class:`Rejected`."""
+        limits = self.limits
+        bucket = self.buckets.bucket(user_id)
+        allowed, retry_after = bucket.take()
+        if not allowed:
+            self._reject("rate", 429, retry_after)
+        with self._cond:
+            if self.by_user.get(user_id, 0) >= limits.per_user:
+                bucket.give_back()
+                self._reject("user", 429, self.mean_duration)
+            started = self.clock()
+            if self.active >= limits.total:
+                if self.waiting >= limits.queue:
+                    bucket.give_back()
+                    self._reject("queue_full", 503, self.mean_duration)
+                # A queued request already counts against its user's limit.
+                self._add_user(user_id, 1)
+                self.waiting += 1
+                QUEUED.set(self.waiting, gate=self.name)
+                try:
+                    deadline = started + limits.timeout
+                    while self.active >= limits.total:
+                        remaining = deadline - self.clock()
+                        if remaining <= 0:
+                            self._add_user(user_id, -1)
+                            bucket.give_back()
+                            self._reject("timeout", 503, self.mean_duration)
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+                    QUEUED.set(self.waiting, gate=self.name)
+            else:
+                self._add_user(user_id, 1)
+            self.active += 1
+        WAIT_SECONDS.observe(self.clock() - started, gate=self.name)
+        ADMITTED.inc(gate=self.name)
+        IN_FLIGHT.inc(gate=self.name)
+
+    def leave(self, user_id: int, duration: float):
+        with self._cond:
+            self.active -= 1
+            self._add_user(user_id, -1)
+            self.mean_duration += DURATION_SMOOTHING * (duration - self.mean_duration)
+            self._cond.notify()
+        IN_FLIGHT.dec(gate=self.name)
+
+    def _add_user(self, user_id: int, delta: int):
+        count = self.by_user.get(user_id, 0) + delta
+        if count > 0:
+            self.by_user[user_id] = count
+        else:
+            self.by_user.pop(user_id, None)
+
+    def run(self, user_id: int, func, *args, **kwargs):
+        self.enter(user_id)
+        started = self.clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.leave(user_id, self.clock() - started)
+
+    def _reject(self, reason: str, status: int, retry_after: float):
+        REJECTED.inc(gate=self.name, reason=reason)
+        raise Rejected(self.name, reason, status, retry_after)
+
+
+_gates: Dict[str, Gate] = {}
+_gates_lock = threading.Lock()
+
+
+def gate(name: str) -> Gate:
+    with _gates_lock:
+        existing = _gates.get(name)
+        if existing is None:
+            existing = _gates[name] = Gate(name, limits_from_env(name, DEFAULT_LIMITS[name]))
+        return existing
+
+
+def admit(name: str, methods: Optional[Sequence[str]] = None):
+    """Route decorator: run the view inside gate ``name`` for the session
+    user. With ``methods``, other HTTP methods skip the gate."""
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if methods is not None and request.method not in methods:
+                return view(*args, **kwargs)
+            return gate(name).run(session.get("user_id"), view, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
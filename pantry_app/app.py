@@ -1,34 +1,64 @@
 import json
+import math
+import os
+import tempfile
 
 from flask import (
     Flask,
+    Response,
     flash,
     jsonify,
     redirect,
     render_template,
     request,
+    send_file,
+    send_from_directory,
     session,
     url_for,
 )
 
-from pantry_app.models import SavedRecipe, SessionLocal, User, ensure_default_user, init_db
-from pantry_app.services.auth import AuthService
+from pantry_app import events, jobs, maintenance, metrics
+from pantry_app.admission import Rejected, admit
+from pantry_app.backup import backup_manager
+from pantry_app.models import SavedRecipe, SessionLocal, User, engine, ensure_default_user, init_db
+from pantry_app.ratelimit import retry_after_header
+from pantry_app.services.auth import AuthBusy, AuthService, LoginThrottled
+from pantry_app.services.dedupe import DuplicateService
 from pantry_app.services.export_import import ExportImportService
+from pantry_app.services.history import HistoryService
+from pantry_app.services.ingest import COLUMN_ALIASES, IngestService
 from pantry_app.services.inventory import InventoryService
+from pantry_app.services.matching import match_engine
+from pantry_app.services.nutrition import seed_nutrition
+from pantry_app.services.planner import MealPlanner
+from pantry_app.services.prompt_context import DEFAULT_TOKEN_BUDGET, context_budget
 from pantry_app.services.recipes import RecipeService
 from pantry_app.services.settings import SettingsService
 from pantry_app.services.shopping import ShoppingService
-from pantry_app.utils import METRIC_UNITS, IMPERIAL_UNITS
+from pantry_app.services.sync import SyncService
+from pantry_app.sharding import shard_summary, tenant_session
+from pantry_app.snapshot import CONTENT_TYPE as SNAPSHOT_CONTENT_TYPE, SnapshotError
+from pantry_app.utils import METRIC_UNITS, IMPERIAL_UNITS, parse_date, parse_json, serialize_json
 
 init_db()
+seed_nutrition()
+# Once per process; it may hash the demo password on a fresh database.
+ensure_default_user(SessionLocal())
 
 app = Flask(__name__)
 app.secret_key = "app-my-pantry-secret"
+# comma-separated usernames allowed on the /admin pages; none by default
+app.config["ADMIN_USERNAMES"] = [
+    name.strip() for name in (os.environ.get("PANTRY_ADMIN_USERNAMES") or "").split(",") if name.strip()
+]
+metrics.init_app(app, engine)
+jobs.init_app(app)
+
+MAX_BARCODE_BATCH = 500
 
 
 def current_user() -> User:
     db = SessionLocal()
-    ensure_default_user(db)
     user_id = session.get("user_id")
     if not user_id:
         return None
@@ -47,6 +77,33 @@ def login_required(func):
     return wrapper
 
 
+def admin_required(func):
+    from functools import wraps
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        user = current_user()
+        if not user:
+            return redirect(url_for("login"))
+        if user.username not in app.config["ADMIN_USERNAMES"]:
+            return jsonify({"error": "forbidden"}), 403
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+@app.errorhandler(Rejected)
+def admission_rejected(exc: Rejected):
+    headers = {"Retry-After": retry_after_header(exc.retry_after)}
+    if exc.status == 429:
+        message = "Too many requests for this action. Please wait before trying again."
+    else:
+        message = "The server is busy with other requests. Please try again shortly."
+    if request.accept_mimetypes.accept_html and not request.accept_mimetypes.accept_json:
+        return Response(message, exc.status, headers, mimetype="text/plain")
+    return jsonify({"error": message, "reason": exc.reason}), exc.status, headers
+
+
 @app.route("/")
 @login_required
 def home():
@@ -59,9 +116,18 @@ def login():
     if request.method == "POST":
         username = request.form.get("username")
         password = request.form.get("password")
-        user = auth.verify(username, password)
+        try:
+            user = auth.login(username, password, request.remote_addr)
+        except LoginThrottled as exc:
+            retry_after = retry_after_header(exc.retry_after)
+            error = f"Too many login attempts. Try again in {retry_after} seconds."
+            return render_template("login.html", error=error), 429, {"Retry-After": retry_after}
+        except AuthBusy:
+            error = "The server is busy. Please try again in a moment."
+            return render_template("login.html", error=error), 503, {"Retry-After": "1"}
         if user:
             session["user_id"] = user.id
+            jobs.queue_low_stock_sync(user.id)
             flash("Welcome back!", "success")
             return redirect(url_for("inventory"))
         flash("Invalid credentials", "danger")
@@ -85,12 +151,12 @@ def inventory():
     location = request.args.get("location")
     low_stock = request.args.get("low_stock")
     category_filter = int(cat_id) if cat_id else None
-    products = inv.get_products(location=location, category_id=category_filter)
-    if low_stock:
-        products = [p for p in products if p.quantity <= p.low_stock_threshold]
+    products = inv.get_products(location=location, category_id=category_filter, low_stock=bool(low_stock))
     return render_template(
         "inventory.html",
         products=products,
+        next_expiry=inv.next_expiry(),
+        expiring=inv.expiring_within(),
         categories=inv.categories(),
         units=METRIC_UNITS if user.default_units == "metric" else IMPERIAL_UNITS,
         user=user,
@@ -108,6 +174,22 @@ def barcode_lookup(barcode):
     return jsonify({"found": True, "name": memory.name, "category_name": memory.category_name})
 
 
+@app.route("/barcode/batch", methods=["POST"])
+@login_required
+def barcode_batch():
+    user = current_user()
+    inv = InventoryService(user.id)
+    payload = request.get_json(silent=True) or {}
+    barcodes = [str(code) for code in payload.get("barcodes", []) if code][:MAX_BARCODE_BATCH]
+    results = {}
+    for code, memory in inv.barcode_lookup_many(barcodes).items():
+        if memory:
+            results[code] = {"found": True, "name": memory.name, "category_name": memory.category_name}
+        else:
+            results[code] = {"found": False}
+    return jsonify({"results": results})
+
+
 @app.route("/inventory/add", methods=["POST"])
 @login_required
 def add_product():
@@ -125,7 +207,9 @@ def add_product():
         location=request.form.get("location"),
         notes=request.form.get("notes", ""),
         barcode=barcode,
+        expires_on=parse_date(request.form.get("expires_on")),
     )
+    jobs.queue_low_stock_sync(user.id)
     flash("Product added", "success")
     return redirect(url_for("inventory"))
 
@@ -147,23 +231,93 @@ def edit_product(product_id):
         location=request.form.get("location"),
         notes=request.form.get("notes", ""),
         barcode=request.form.get("barcode"),
+        expires_on=parse_date(request.form.get("expires_on")),
     )
+    jobs.queue_low_stock_sync(user.id)
     flash("Product updated", "success")
     return redirect(url_for("inventory"))
 
 
+@app.route("/inventory/<int:product_id>/lots", methods=["POST"])
+@login_required
+def add_product_lot(product_id):
+    user = current_user()
+    inv = InventoryService(user.id)
+    try:
+        inv.add_lot(
+            product_id,
+            float(request.form.get("quantity", 0)),
+            parse_date(request.form.get("expires_on")),
+            unit=request.form.get("unit"),
+        )
+    except ValueError as exc:
+        flash(str(exc), "danger")
+        return redirect(url_for("inventory"))
+    flash("Batch added", "success")
+    return redirect(url_for("inventory"))
+
+
+@app.route("/inventory/expiring")
+@login_required
+def expiring_products():
+    user = current_user()
+    days = min(request.args.get("days", 3, type=int), 365)
+    lots = InventoryService(user.id).expiring_within(days)
+    return jsonify(
+        [dict(lot._asdict(), expires_on=lot.expires_on.isoformat()) for lot in lots]
+    )
+
+
+@app.route("/inventory/duplicates", methods=["POST"])
+@login_required
+def find_duplicates():
+    user = current_user()
+    job_id = jobs.scheduler.enqueue(
+        "products.duplicates", {"user_id": user.id}, dedupe_key=f"duplicates:{user.id}"
+    )
+    return jsonify({"job_id": job_id, "status_url": url_for("duplicates_status", job_id=job_id)}), 202
+
+
+@app.route("/inventory/duplicates/<int:job_id>")
+@login_required
+def duplicates_status(job_id):
+    user = current_user()
+    job = jobs.get_job(job_id)
+    if not job or job["name"] != "products.duplicates" or job["payload"].get("user_id") != user.id:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(job)
+
+
+@app.route("/inventory/merge", methods=["POST"])
+@login_required
+def merge_products():
+    user = current_user()
+    payload = request.get_json(silent=True) or {}
+    clusters = payload.get("clusters")
+    if not isinstance(clusters, list) or not all(isinstance(c, list) and len(c) > 1 for c in clusters):
+        return jsonify({"error": "clusters must be lists of [survivor_id, duplicate_id, ...]"}), 400
+    try:
+        report = DuplicateService(user.id).merge(clusters)
+    except (TypeError, ValueError):
+        return jsonify({"error": "product ids must be integers"}), 400
+    jobs.queue_low_stock_sync(user.id)
+    return jsonify(report)
+
+
 @app.route("/inventory/<int:product_id>/delete")
 @login_required
 def delete_product(product_id):
     user = current_user()
     inv = InventoryService(user.id)
     inv.delete_product(product_id)
+    jobs.queue_low_stock_sync(user.id)
     flash("Product deleted", "info")
     return redirect(url_for("inventory"))
 
 
 @app.route("/recipes", methods=["GET", "POST"])
 @login_required
+@admit("llm", methods=("POST",))
 def recipes():
     user = current_user()
     service = RecipeService(user.id, preferred_units=user.default_units)
@@ -188,13 +342,16 @@ def recipes():
             only_have=options["only_have"],
             minimize_missing=options["minimize_missing"],
             ignore_spices=options["ignore_spices"],
+            context_tokens=context_budget(user),
         )
         results = suggestions[:6]
     return render_template(
         "recipes.html",
         results=results,
         saved=service.saved_recipes(),
-        cooked=service.cooked_recipes(),
+        cook_counts=service.cook_counts(),
+        cooked=service.cooked_recipes(limit=10),
+        ready=match_engine(user.id).matches(max_missing=0, limit=5),
         servings=servings,
         keyword=keyword,
         preferences=preferences,
@@ -204,6 +361,62 @@ def recipes():
     )
 
 
+@app.route("/recipes/matches")
+@login_required
+def recipe_matches():
+    user = current_user()
+    engine = match_engine(user.id, ignore_spices=request.args.get("ignore_spices", "1") != "0")
+    matches = engine.matches(
+        max_missing=request.args.get("max_missing", 0, type=int),
+        limit=min(request.args.get("limit", 20, type=int), 200),
+    )
+    return jsonify({"matches": matches})
+
+
+@app.route("/recipes/saved/macros")
+@login_required
+def saved_recipe_macros():
+    user = current_user()
+    preferences = {
+        "high_protein": request.args.get("high_protein", "0") not in ("0", "false"),
+        "low_carb": request.args.get("low_carb", "0") not in ("0", "false"),
+    }
+    return jsonify({"recipes": RecipeService(user.id).saved_with_macros(preferences)})
+
+
+@app.route("/plan", methods=["POST"])
+@login_required
+@admit("plan")
+def meal_plan():
+    user = current_user()
+    planner = MealPlanner(user.id)
+    payload = request.get_json(silent=True) or {}
+    mode = payload.get("mode", "greedy")
+    try:
+        horizon = int(payload.get("horizon", 7))
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({"error": "invalid horizon"}), 400
+    try:
+        time_budget_ms = float(payload.get("time_budget_ms", 500))
+    except (TypeError, ValueError):
+        return jsonify({"error": "invalid time_budget_ms"}), 400
+    if math.isnan(time_budget_ms):
+        return jsonify({"error": "invalid time_budget_ms"}), 400
+    recipe_ids = payload.get("recipe_ids")
+    if recipe_ids is not None and not (
+        isinstance(recipe_ids, list) and all(isinstance(i, int) and not isinstance(i, bool) for i in recipe_ids)
+    ):
+        return jsonify({"error": "recipe_ids must be a list of integers"}), 400
+    plan = planner.plan(
+        horizon=max(1, min(horizon, 60)),
+        mode=mode if mode in ("greedy", "exact") else "greedy",
+        time_budget=max(0.0, min(time_budget_ms, 5000)) / 1000,
+        saved_ids=recipe_ids,
+        ignore_spices=bool(payload.get("ignore_spices", True)),
+    )
+    return jsonify(plan)
+
+
 @app.route("/recipes/save", methods=["POST"])
 @login_required
 def save_recipe():
@@ -223,6 +436,7 @@ def cook_recipe():
     recipe_data = json.loads(request.form.get("recipe"))
     servings = int(request.form.get("servings", recipe_data.get("servings", 1)))
     service.cook_recipe(recipe_data, servings)
+    jobs.queue_low_stock_sync(user.id)
     flash("Recipe cooked and inventory updated", "success")
     return redirect(url_for("history"))
 
@@ -242,7 +456,7 @@ def rate_recipe(recipe_id):
 @login_required
 def cook_saved(recipe_id):
     user = current_user()
-    db = SessionLocal()
+    db = tenant_session(user.id)
     recipe_entry = db.query(SavedRecipe).filter_by(id=recipe_id, user_id=user.id).first()
     if not recipe_entry:
         flash("Saved recipe not found", "warning")
@@ -250,12 +464,13 @@ def cook_saved(recipe_id):
     service = RecipeService(user.id)
     data = {
         "name": recipe_entry.name,
-        "ingredients": json.loads(recipe_entry.ingredients),
-        "instructions": recipe_entry.instructions,
-        "tags": json.loads(recipe_entry.tags),
+        "ingredients": recipe_entry.ingredient_list(),
+        "instructions": recipe_entry.instruction_text(),
+        "tags": recipe_entry.tag_list(),
         "servings": recipe_entry.servings,
     }
     service.cook_recipe(data, recipe_entry.servings)
+    jobs.queue_low_stock_sync(user.id)
     flash("Saved recipe cooked", "success")
     return redirect(url_for("history"))
 
@@ -264,9 +479,17 @@ def cook_saved(recipe_id):
 @login_required
 def history():
     user = current_user()
-    service = RecipeService(user.id)
-    cooked = service.cooked_recipes()
-    return render_template("history.html", cooked=cooked, user=user)
+    service = HistoryService(user.id)
+    page = service.page(page=request.args.get("page", 1, type=int))
+    return render_template("history.html", cooked=page.items, page=page, user=user)
+
+
+@app.route("/history/stats")
+@login_required
+def history_stats():
+    user = current_user()
+    service = HistoryService(user.id)
+    return jsonify(service.stats(limit=request.args.get("limit", 10, type=int)))
 
 
 @app.route("/shopping", methods=["GET", "POST"])
@@ -282,10 +505,14 @@ def shopping():
         )
         flash("Item added", "success")
         return redirect(url_for("shopping"))
-    items = service.auto_low_stock_items()
+    # Inventory changes queue a debounced low-stock sync; run it now if it
+    # has not fired yet so the list is never stale.
+    jobs.run_pending_low_stock_sync(user.id)
+    group_by = request.args.get("group", "category")
     return render_template(
         "shopping.html",
-        items=items,
+        groups=service.grouped(group_by=group_by),
+        group_by=group_by,
         units=METRIC_UNITS if user.default_units == "metric" else IMPERIAL_UNITS,
         user=user,
     )
@@ -299,6 +526,8 @@ def shopping_status(item_id):
     status = request.form.get("status")
     update_inventory = bool(request.form.get("update_inventory"))
     service.update_status(item_id, status, update_inventory)
+    if update_inventory:
+        jobs.queue_low_stock_sync(user.id)
     flash("Shopping item updated", "success")
     return redirect(url_for("shopping"))
 
@@ -322,10 +551,17 @@ def settings():
     if request.method == "POST":
         units = request.form.get("units")
         theme = request.form.get("theme")
-        settings_service.update(default_units=units, theme=theme)
+        llm_config = None
+        if request.form.get("context_tokens"):
+            config = parse_json(user.llm_config or "{}", {})
+            config["context_tokens"] = request.form.get("context_tokens", type=int) or DEFAULT_TOKEN_BUDGET
+            llm_config = serialize_json(config)
+        settings_service.update(default_units=units, theme=theme, llm_config=llm_config)
         flash("Settings updated", "success")
         return redirect(url_for("settings"))
-    return render_template("settings.html", user=user, categories=inv.categories())
+    return render_template(
+        "settings.html", user=user, categories=inv.categories(), context_tokens=context_budget(user)
+    )
 
 
 @app.route("/settings/category", methods=["POST"])
@@ -346,6 +582,7 @@ def manage_category():
 
 @app.route("/export")
 @login_required
+@admit("export")
 def export_data():
     user = current_user()
     service = ExportImportService(user.id)
@@ -353,8 +590,58 @@ def export_data():
     return jsonify(data)
 
 
+@app.route("/export/snapshot")
+@login_required
+@admit("export")
+def export_snapshot():
+    user = current_user()
+    data = ExportImportService(user.id).export_snapshot()
+    return jsonify(data)
+
+
+@app.route("/export/binary")
+@login_required
+@admit("export")
+def export_binary():
+    user = current_user()
+    fd, path = tempfile.mkstemp(suffix=".pantry")
+    os.close(fd)
+    meta = ExportImportService(user.id).export_binary(path)
+    response = send_file(
+        path,
+        mimetype=SNAPSHOT_CONTENT_TYPE,
+        as_attachment=True,
+        download_name=f"pantry-{meta['created_at'][:10]}.pantry",
+    )
+    response.headers["X-Snapshot-SHA256"] = meta["sha256"]
+    response.call_on_close(lambda: os.remove(path))
+    return response
+
+
+@app.route("/export/jobs", methods=["POST"])
+@login_required
+@admit("export")
+def export_job():
+    user = current_user()
+    job_id = jobs.scheduler.enqueue("export.snapshot", {"user_id": user.id})
+    return jsonify({"job_id": job_id, "status_url": url_for("export_job_status", job_id=job_id)}), 202
+
+
+@app.route("/export/jobs/<int:job_id>")
+@login_required
+def export_job_status(job_id):
+    user = current_user()
+    job = jobs.get_job(job_id)
+    if not job or job["name"] != "export.snapshot" or job["payload"].get("user_id") != user.id:
+        return jsonify({"error": "not found"}), 404
+    if request.args.get("download") and job["status"] == "done":
+        return send_from_directory(jobs.EXPORT_DIR, job["result"]["file"], as_attachment=True)
+    return jsonify(job)
+
+
 @app.route("/import", methods=["POST"])
 @login_required
+@admit("import")
 def import_data():
     user = current_user()
     service = ExportImportService(user.id)
@@ -362,10 +649,140 @@ def import_data():
     if file:
         payload = json.load(file.stream)
         service.import_data(payload)
+        jobs.queue_low_stock_sync(user.id)
         flash("Data imported", "success")
     return redirect(url_for("settings"))
 
 
+@app.route("/import/binary", methods=["POST"])
+@login_required
+@admit("import")
+def import_binary():
+    user = current_user()
+    file = request.files.get("file")
+    if not file:
+        return jsonify({"error": "file is required"}), 400
+    # SQLite needs a real file to open; spool the upload to disk first.
+    fd, path = tempfile.mkstemp(suffix=".pantry")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            file.save(out)
+        ExportImportService(user.id).import_binary(path)
+    except SnapshotError as exc:
+        if request.args.get("format") == "json":
+            return jsonify({"error": str(exc)}), 400
+        flash(f"Snapshot import failed: {exc}", "danger")
+        return redirect(url_for("settings"))
+    finally:
+        os.remove(path)
+    jobs.queue_low_stock_sync(user.id)
+    if request.args.get("format") == "json":
+        return jsonify({"status": "imported"})
+    flash("Snapshot imported", "success")
+    return redirect(url_for("settings"))
+
+
+@app.route("/import/csv", methods=["POST"])
+@login_required
+@admit("import")
+def import_csv():
+    user = current_user()
+    file = request.files.get("file")
+    if not file:
+        return jsonify({"error": "file is required"}), 400
+    mapping = {
+        field: request.form[f"map_{field}"]
+        for field in COLUMN_ALIASES
+        if request.form.get(f"map_{field}")
+    }
+    mode = "add" if request.form.get("mode") == "add" else "set"
+    try:
+        report = IngestService(user.id).ingest_csv(
+            file.stream, mapping=mapping, mode=mode, dry_run=bool(request.form.get("dry_run"))
+        )
+    except (ValueError, UnicodeDecodeError) as exc:
+        if request.args.get("format") == "json":
+            return jsonify({"error": str(exc)}), 400
+        flash(f"CSV import failed: {exc}", "danger")
+        return redirect(url_for("settings"))
+    if not report["dry_run"]:
+        jobs.queue_low_stock_sync(user.id)
+    if request.args.get("format") == "json":
+        return jsonify(report)
+    message = f"Imported {report['inserted']} new and {report['updated']} updated products"
+    if report["error_count"]:
+        first = report["errors"][0]
+        message += f"; skipped {report['error_count']} rows (line {first['line']}: {first['message']})"
+    flash(message, "warning" if report["error_count"] else "success")
+    return redirect(url_for("settings"))
+
+
+@app.route("/events")
+@login_required
+def live_events():
+    user = current_user()
+    return Response(
+        events.hub.stream(user.id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/sync/changes")
+@login_required
+def sync_changes():
+    user = current_user()
+    service = SyncService(user.id)
+    since = request.args.get("since", 0, type=int)
+    limit = min(request.args.get("limit", 1000, type=int), 5000)
+    return jsonify(service.changes(since=since, limit=limit))
+
+
+@app.route("/sync/push", methods=["POST"])
+@login_required
+def sync_push():
+    user = current_user()
+    service = SyncService(user.id)
+    payload = request.get_json(silent=True) or {}
+    mutations = payload.get("mutations", []) if isinstance(payload, dict) else None
+    if not isinstance(mutations, list) or not all(isinstance(m, dict) for m in mutations):
+        return jsonify({"error": "mutations must be a list of objects"}), 400
+    result = service.push(mutations)
+    jobs.queue_low_stock_sync(user.id)
+    return jsonify(result)
+
+
+@app.route("/admin/shards")
+@admin_required
+def admin_shards():
+    return jsonify(shard_summary())
+
+
+@app.route("/admin/backups", methods=["GET", "POST"])
+@admin_required
+def admin_backups():
+    if request.method == "POST":
+        job_id = jobs.scheduler.enqueue("backup.run", priority=1, dedupe_key="backup")
+        return jsonify({"status": "queued", "job_id": job_id}), 202
+    return jsonify(backup_manager.list())
+
+
+@app.route("/admin/db", methods=["GET", "POST"])
+@admin_required
+def admin_db():
+    if request.method == "POST":
+        name = "db.check" if request.args.get("task") == "check" else "db.optimize"
+        job_id = jobs.scheduler.enqueue(name, priority=1, dedupe_key=name)
+        return jsonify({"status": "queued", "job_id": job_id}), 202
+    return jsonify(maintenance.run("stats"))
+
+
+@app.route("/admin/jobs")
+@admin_required
+def admin_jobs():
+    return jsonify(jobs.scheduler.summary(limit=request.args.get("limit", 50, type=int)))
+
+
 @app.context_processor
 def inject_globals():
     user = current_user()
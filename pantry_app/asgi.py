@@ -0,0 +1,22 @@
+"""ASGI entry point for the long-lived and heavily polled endpoints.
+
+Serve the Flask app as usual for pages and writes, and run this next to it
+(for example ``uvicorn pantry_app.asgi:application``) with ``/events`` and
+``/api/`` routed here. Idle live-update connections and polling readers then
+share one event loop instead of each holding a WSGI worker thread. Live
+events reach this process through the shared change log (see
+:mod:`pantry_app.events`), so it needs no link to the Flask workers.
+"""
+from pantry_app.app import app
+from pantry_app.async_api import make_api_app
+from pantry_app.events import make_asgi_app
+
+events_app = make_asgi_app(app)
+api_app = make_api_app(app)
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan" or scope.get("path", "").startswith("/api/"):
+        await api_app(scope, receive, send)
+    else:
+        await events_app(scope, receive, send)
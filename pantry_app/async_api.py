@@ -0,0 +1,280 @@
+"""Read-only JSON API on asyncio.
+
+Dashboards and scanner clients poll these reads heavily. Served from an
+event loop, each waiting client costs a coroutine rather than a worker
+thread; queries run on a small pool of aiosqlite connections per database
+file (``PANTRY_ASYNC_POOL``, default 8). The queries are the services' own
+(``products_stmt``, ``grouped_stmt``, ``history_stmts``), executed on an
+``AsyncSession``:
+
+    GET /api/products?location=fridge&category_id=3&low_stock=1&after=120&limit=200
+    GET /api/barcode/<code>
+    GET /api/barcode?codes=4006381333931,5000112548167
+    GET /api/shopping?group=category|location
+    GET /api/history?page=2&per_page=25
+
+A request that waits ``PANTRY_ASYNC_POOL_TIMEOUT`` seconds (default 10) for a
+connection gets 503 with ``Retry-After``. Clients authenticate with the
+Flask session cookie. Responses carry an
+``ETag``; pollers that send ``If-None-Match`` get an empty 304 when nothing
+changed. Connections are opened with ``PRAGMA query_only`` so nothing here
+can write.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List
+from urllib.parse import parse_qs
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from pantry_app import sharding
+from pantry_app.events import session_user_loader
+from pantry_app.models import DB_PATH, Product
+from pantry_app.read_models import PRODUCT_COLUMNS, CookedRow, ShoppingRow
+from pantry_app.services.barcodes import barcode_index
+from pantry_app.services.history import HistoryPage, history_stmts
+from pantry_app.services.inventory import products_stmt
+from pantry_app.services.shopping import group_items, grouped_stmt
+
+POOL_SIZE = int(os.environ.get("PANTRY_ASYNC_POOL") or 8)
+POOL_TIMEOUT = float(os.environ.get("PANTRY_ASYNC_POOL_TIMEOUT") or 10)
+DEFAULT_PRODUCTS, MAX_PRODUCTS = 500, 5_000
+MAX_BARCODES = 500
+MAX_PER_PAGE = 100
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncEngines:
+    """One async engine per database file, created on first use."""
+
+    def __init__(self, pool_size: int = POOL_SIZE):
+        self.pool_size = pool_size
+        self._engines: Dict[Path, object] = {}
+
+    def for_path(self, path: Path):
+        engine = self._engines.get(path)
+        if engine is None:
+            engine = create_async_engine(
+                f"sqlite+aiosqlite:///{path}",
+                poolclass=AsyncAdaptedQueuePool,
+                pool_size=self.pool_size,
+                max_overflow=0,
+                pool_timeout=POOL_TIMEOUT,
+            )
+
+            @event.listens_for(engine.sync_engine, "connect")
+            def _set_pragmas(dbapi_conn, connection_record):
+                # The Flask side puts files in WAL mode; readers here never
+                # block it and may not write.
+                cursor = dbapi_conn.cursor()
+                cursor.execute("PRAGMA busy_timeout=5000")
+                cursor.execute("PRAGMA query_only=1")
+                cursor.close()
+
+            self._engines[path] = engine
+        return engine
+
+    async def for_user(self, user_id: int):
+        if not sharding.SHARDING_ENABLED:
+            return self.for_path(DB_PATH)
+        key = sharding.router.known_key(user_id)
+        if key is None:
+            # First sight of this user: the lookup (and a possible first
+            # assignment) is blocking, so run it off the loop.
+            key = await asyncio.to_thread(sharding.router.shard_key, user_id)
+        return self.for_path(sharding.router.shard_path(key))
+
+    async def dispose(self):
+        engines, self._engines = list(self._engines.values()), {}
+        for engine in engines:
+            await engine.dispose()
+
+
+engines = AsyncEngines()
+
+
+def _arg(query: Dict[str, List[str]], name: str, default=None, type=str):
+    values = query.get(name)
+    if not values or values[0] == "":
+        return default
+    try:
+        return type(values[0])
+    except ValueError:
+        raise ApiError(400, f"invalid {name}") from None
+
+
+async def products(session: AsyncSession, user_id: int, query, args) -> Dict:
+    limit = max(1, min(_arg(query, "limit", DEFAULT_PRODUCTS, int), MAX_PRODUCTS))
+    after = _arg(query, "after", 0, int)
+    stmt = (
+        products_stmt(
+            user_id,
+            location=_arg(query, "location"),
+            category_id=_arg(query, "category_id", None, int),
+            low_stock=_arg(query, "low_stock", "0") not in ("0", "false"),
+            columns=PRODUCT_COLUMNS,
+        )
+        .where(Product.id > after)
+        .order_by(Product.id)
+        .limit(limit)
+    )
+    # Plain rows rather than entities: no identity map work per product.
+    items = []
+    for row in (await session.execute(stmt)).mappings():
+        item = dict(row)
+        item["low"] = (item["quantity"] or 0) <= (item["low_stock_threshold"] or 0)
+        items.append(item)
+    # keyset paging: pass the last id back as ?after=
+    return {"products": items, "next_after": items[-1]["id"] if len(items) == limit else None}
+
+
+async def barcode(session: AsyncSession, user_id: int, query, args) -> Dict:
+    codes = args[:1] or [code for code in (_arg(query, "codes", "") or "").split(",") if code]
+    if not codes:
+        raise ApiError(400, "no barcodes given")
+    codes = codes[:MAX_BARCODES]
+    if barcode_index.loaded:
+        found = barcode_index.get_many(codes)
+    else:
+        # the first lookup loads the index from the database
+        found = await asyncio.to_thread(barcode_index.get_many, codes)
+    results = {
+        code: {"found": True, "name": entry.name, "category_name": entry.category_name}
+        if entry
+        else {"found": False}
+        for code, entry in found.items()
+    }
+    return results[codes[0]] if args else {"results": results}
+
+
+async def shopping(session: AsyncSession, user_id: int, query, args) -> Dict:
+    group_by = "location" if _arg(query, "group") == "location" else "category"
+    rows = (await session.execute(grouped_stmt(user_id, group_by))).all()
+    groups = group_items(map(ShoppingRow._make, rows))
+    return {
+        "group": group_by,
+        "groups": [
+            {
+                "name": name,
+                "items": [
+                    {
+                        "id": item.id,
+                        "name": item.name,
+                        "quantity": item.quantity,
+                        "unit": item.unit,
+                        "status": item.status,
+                        "linked_product_id": item.linked_product_id,
+                    }
+                    for item in items
+                ],
+            }
+            for name, items in groups
+        ],
+    }
+
+
+async def history(session: AsyncSession, user_id: int, query, args) -> Dict:
+    page = max(_arg(query, "page", 1, int), 1)
+    per_page = max(1, min(_arg(query, "per_page", 25, int), MAX_PER_PAGE))
+    count, items = history_stmts(user_id, page, per_page)
+    total = (await session.execute(count)).scalar()
+    cooked = [CookedRow._make(row) for row in (await session.execute(items)).all()]
+    result = HistoryPage(cooked, page, per_page, total)
+    return {
+        "items": [
+            {
+                "id": entry.id,
+                "name": entry.name,
+                "servings": entry.servings,
+                "cooked_at": entry.cooked_at.isoformat() if entry.cooked_at else None,
+                "rating": entry.rating,
+            }
+            for entry in cooked
+        ],
+        "page": result.page,
+        "pages": result.pages,
+        "total": result.total,
+    }
+
+
+ROUTES = {"products": products, "barcode": barcode, "shopping": shopping, "history": history}
+
+
+def make_api_app(flask_app, prefix: str = "/api"):
+    """ASGI callable for the read API under ``prefix``, authenticated with
+    ``flask_app``'s session cookie."""
+    user_id_for = session_user_loader(flask_app)
+
+    async def respond(send, status: int, body: bytes = b"", headers=()):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"application/json"), *headers],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    async def error(send, status: int, message: str):
+        await respond(send, status, json.dumps({"error": message}).encode())
+
+    async def lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await engines.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            await lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        parts = scope["path"][len(prefix):].strip("/").split("/")
+        handler = ROUTES.get(parts[0]) if scope["path"].startswith(prefix) else None
+        if handler is None:
+            await error(send, 404, "not found")
+            return
+        if scope["method"] not in ("GET", "HEAD"):
+            await error(send, 405, "read-only API")
+            return
+        user_id = user_id_for(scope)
+        if not user_id:
+            await error(send, 401, "login required")
+            return
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        try:
+            engine = await engines.for_user(user_id)
+            async with AsyncSession(engine) as session:
+                payload = await handler(session, user_id, query, parts[1:])
+        except ApiError as exc:
+            await error(send, exc.status, str(exc))
+            return
+        except PoolTimeout:
+            # every connection stayed busy for POOL_TIMEOUT seconds
+            await respond(send, 503, b'{"error":"busy"}', [(b"retry-after", b"1")])
+            return
+        body = json.dumps(payload, separators=(",", ":"), default=str).encode()
+        etag = b'"' + hashlib.blake2b(body, digest_size=12).hexdigest().encode() + b'"'
+        headers = [(b"etag", etag), (b"cache-control", b"private, no-cache")]
+        if dict(scope.get("headers", ())).get(b"if-none-match") == etag:
+            await respond(send, 304, headers=headers)
+        else:
+            await respond(send, 200, b"" if scope["method"] == "HEAD" else body, headers)
+
+    return app
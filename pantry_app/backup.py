@@ -0,0 +1,161 @@
+"""Online backups of the pantry databases.
+
+Copies are taken with SQLite's online backup API a few hundred pages at a
+time, pausing between steps, so the app keeps reading and writing while a
+backup runs. Each backup is a timestamped directory holding the main
+database, every shard and a ``manifest.json``:
+
+    python -m pantry_app.backup run
+    python -m pantry_app.backup list
+    python -m pantry_app.backup prune --keep 7
+    python -m pantry_app.backup restore 20260101-030000
+
+Restore overwrites the live databases; stop the app first.
+"""
+import datetime as dt
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pantry_app.models import DB_PATH, engine
+from pantry_app.sharding import SHARD_DIR, database_files, router
+
+BACKUP_DIR = Path(os.environ.get("PANTRY_BACKUP_DIR") or DB_PATH.parent / "backups")
+NAME_FORMAT = "%Y%m%d-%H%M%S"
+
+
+def copy_database(source: Path, dest: Path, pages: int = 256, sleep: float = 0.005):
+    """Copy ``source`` to ``dest`` through the online backup API.
+
+    The copy is written next to ``dest`` and renamed into place, so a
+    half-written file never looks like a finished backup.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    partial = dest.with_name(dest.name + ".partial")
+    src_conn = sqlite3.connect(str(source), timeout=30)
+    dest_conn = sqlite3.connect(str(partial))
+    try:
+        src_conn.backup(dest_conn, pages=pages, sleep=sleep)
+        dest_conn.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dest_conn.close()
+        src_conn.close()
+    os.replace(partial, dest)
+
+
+class BackupManager:
+    def __init__(
+        self,
+        backup_dir: Path = BACKUP_DIR,
+        keep_last: int = 7,
+        max_age_days: Optional[int] = 30,
+    ):
+        self.backup_dir = Path(backup_dir)
+        self.keep_last = keep_last
+        self.max_age_days = max_age_days
+        self._lock = threading.Lock()
+
+    def databases(self) -> Dict[str, Path]:
+        return database_files()
+
+    def run(self) -> Dict:
+        with self._lock:
+            name = dt.datetime.utcnow().strftime(NAME_FORMAT)
+            target = self.backup_dir / name
+            files = {}
+            for relative, source in self.databases().items():
+                if not source.exists():
+                    continue
+                dest = target / relative
+                copy_database(source, dest)
+                files[relative] = dest.stat().st_size
+            manifest = {
+                "name": name,
+                "created_at": dt.datetime.utcnow().isoformat(timespec="seconds"),
+                "files": files,
+            }
+            (target / "manifest.json").write_text(json.dumps(manifest, indent=2))
+            self.prune()
+            return manifest
+
+    def list(self) -> List[Dict]:
+        if not self.backup_dir.exists():
+            return []
+        manifests = []
+        for manifest in sorted(self.backup_dir.glob("*/manifest.json"), reverse=True):
+            manifests.append(json.loads(manifest.read_text()))
+        return manifests
+
+    def prune(self) -> List[str]:
+        removed = []
+        cutoff = None
+        if self.max_age_days is not None:
+            cutoff = dt.datetime.utcnow() - dt.timedelta(days=self.max_age_days)
+        for index, manifest in enumerate(self.list()):
+            created = dt.datetime.strptime(manifest["name"], NAME_FORMAT)
+            too_many = index >= self.keep_last
+            too_old = cutoff is not None and created < cutoff and index > 0
+            if too_many or too_old:
+                shutil.rmtree(self.backup_dir / manifest["name"], ignore_errors=True)
+                removed.append(manifest["name"])
+        return removed
+
+    def restore(self, name: str) -> List[str]:
+        source_dir = self.backup_dir / name
+        manifest = json.loads((source_dir / "manifest.json").read_text())
+        restored = []
+        for relative in manifest["files"]:
+            live = DB_PATH if relative == "app.db" else SHARD_DIR / Path(relative).name
+            # Copy page-by-page into the live file so open WAL state is handled
+            # by SQLite rather than by swapping files underneath it.
+            src_conn = sqlite3.connect(str(source_dir / relative))
+            live_conn = sqlite3.connect(str(live), timeout=30)
+            try:
+                src_conn.backup(live_conn, pages=256)
+            finally:
+                live_conn.close()
+                src_conn.close()
+            restored.append(relative)
+        engine.dispose()
+        for shard_engine in router._engines.values():
+            shard_engine.dispose()
+        return restored
+
+
+backup_manager = BackupManager()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pantry database backups")
+    parser.add_argument("--dir", default=str(BACKUP_DIR))
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("run", help="take a backup now")
+    sub.add_parser("list", help="list backups, newest first")
+    prune = sub.add_parser("prune", help="apply the retention policy")
+    prune.add_argument("--keep", type=int, default=7)
+    prune.add_argument("--max-age-days", type=int, default=30)
+    restore = sub.add_parser("restore", help="restore a backup over the live databases")
+    restore.add_argument("name")
+    args = parser.parse_args()
+
+    manager = BackupManager(Path(args.dir))
+    if args.command == "run":
+        print(json.dumps(manager.run(), indent=2))
+    elif args.command == "list":
+        print(json.dumps(manager.list(), indent=2))
+    elif args.command == "prune":
+        manager.keep_last = args.keep
+        manager.max_age_days = args.max_age_days
+        print(json.dumps(manager.prune()))
+    else:
+        print(json.dumps(manager.restore(args.name)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""Live change events for open pages, pushed over server-sent events.
+
+Every committed write to a synced table (see ``SYNC_ENTITIES``) is already
+recorded in ``change_log``, whether it came through the ORM or a bulk Core
+statement. The :class:`ChangeFeed` tails that log for the users with an
+open connection and turns new entries into one message per user, e.g. an
+inventory edit, a shopping-list toggle or cooking a recipe:
+
+    event: change
+    data: {"changes": [{"entity": "products", "op": "upsert", "id": 3, "data": {...}}]}
+
+Because the log lives in the database, every process serving ``/events``
+(the Flask workers and the ASGI app alike) sees every change, whichever
+process made it. Each process polls every ``PANTRY_EVENTS_POLL`` seconds
+(default 0.5) while it has subscribers. Commits in the same process wake
+the feed at once, and so do :func:`notify_changes` calls after bulk writes.
+When one poll finds more than ``RESYNC_AFTER`` changed rows of an entity
+for a user, they are replaced by a single ``resync`` change.
+
+The :class:`EventHub` fans messages out to subscribers on asyncio queues.
+Each queue is bounded: a client that falls behind has its backlog dropped
+and gets a single ``resync`` event, telling it to reload instead of being
+fed stale deltas. Subscribers live on whatever loop created them, so the
+ASGI app (:func:`make_asgi_app`) serves thousands of idle connections from
+one event loop, while the Flask ``/events`` route uses the hub's own loop
+thread and holds one worker thread per connection.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from http.cookies import SimpleCookie
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set
+
+from sqlalchemy import event, func
+
+from pantry_app import metrics, sharding
+from pantry_app.models import SYNC_ENTITIES, ChangeLog, Product, SessionLocal, ShoppingItem
+
+logger = logging.getLogger("pantry_app.events")
+
+QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15.0
+POLL_SECONDS = float(os.environ.get("PANTRY_EVENTS_POLL") or 0.5)
+# change_log rows read per database per poll
+POLL_BATCH = 5000
+RESYNC_AFTER = 200
+# Fields pushed with upserts so pages can patch rows in place.
+LIVE_FIELDS = {
+    "products": ("name", "quantity", "unit", "low_stock_threshold", "category_id", "location"),
+    "shopping_items": ("name", "quantity", "unit", "status", "linked_product_id"),
+}
+LIVE_MODELS = {"products": Product, "shopping_items": ShoppingItem}
+
+EVENTS_PUBLISHED = metrics.registry.register(
+    metrics.Counter("pantry_events_published_total", "Change messages delivered to subscribers.")
+)
+EVENTS_DROPPED = metrics.registry.register(
+    metrics.Counter("pantry_events_dropped_total", "Messages dropped for slow subscribers.")
+)
+SUBSCRIBERS = metrics.registry.register(
+    metrics.Gauge("pantry_event_subscribers", "Open live-update connections.")
+)
+
+
+class Subscription:
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop, size: int):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self.dropped = 0
+
+    def offer(self, message: Dict):
+        # Runs on self.loop. A full queue means the client is not keeping
+        # up: replace the backlog with one resync rather than block others.
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            dropped = self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+            self.dropped += dropped + 1
+            EVENTS_DROPPED.inc(dropped + 1)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict]:
+        """Next message, or None after ``timeout`` seconds of silence."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventHub:
+    def __init__(self, queue_size: int = QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        # started on the first subscription; see ChangeFeed
+        self.feed: Optional["ChangeFeed"] = None
+
+    def subscribe(self, user_id: int) -> Subscription:
+        """Subscribe from a coroutine; the queue belongs to the running loop."""
+        subscription = Subscription(user_id, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        SUBSCRIBERS.inc()
+        if self.feed is not None:
+            self.feed.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is None or subscription not in subscribers:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.user_id]
+        SUBSCRIBERS.dec()
+
+    def subscriber_count(self, user_id: Optional[int] = None) -> int:
+        with self._lock:
+            if user_id is not None:
+                return len(self._subscribers.get(user_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def subscribed_users(self) -> List[int]:
+        with self._lock:
+            return list(self._subscribers)
+
+    def publish(self, user_id: int, message: Dict):
+        """Thread-safe; hands ``message`` to each subscriber's loop."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, message)
+            except RuntimeError:
+                # the subscriber's loop has shut down under it
+                self.unsubscribe(subscription)
+        EVENTS_PUBLISHED.inc(len(subscribers))
+
+    # Blocking access for WSGI workers, via the hub's own loop thread.
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is not None:
+            return self._loop
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="pantry-events", daemon=True)
+                thread.start()
+                self._loop, self._thread = loop, thread
+        return self._loop
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop()).result()
+
+    def stream(self, user_id: int, heartbeat: float = HEARTBEAT_SECONDS) -> Iterator[str]:
+        """SSE text for a blocking response body; ends when the client goes."""
+
+        async def subscribe():
+            return self.subscribe(user_id)
+
+        subscription = self._run(subscribe())
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                yield format_sse(self._run(subscription.get(heartbeat)))
+        finally:
+            self.unsubscribe(subscription)
+
+    async def astream(self, user_id: int, heartbeat: float = HEARTBEAT_SECONDS) -> AsyncIterator[str]:
+        subscription = self.subscribe(user_id)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                yield format_sse(await subscription.get(heartbeat))
+        finally:
+            self.unsubscribe(subscription)
+
+
+class ChangeFeed:
+    """Publishes new ``change_log`` entries of subscribed users to a hub.
+
+    Runs on one daemon thread per process. Keeps a cursor (the last log id
+    read) per database file; a file's cursor starts at its newest entry
+    when someone first subscribes there, and is dropped when nobody is.
+    """
+
+    def __init__(self, hub: EventHub, poll: float = POLL_SECONDS):
+        self.hub = hub
+        self.poll = poll
+        self._cursors: Dict[str, int] = {}
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        hub.feed = self
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="pantry-events-feed", daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll)
+            self._wake.clear()
+            try:
+                self.poll_once()
+            except Exception:
+                logger.exception("reading the change log failed")
+
+    def poll_once(self) -> int:
+        """Publish entries logged since the last poll; returns messages sent."""
+        groups: Dict[str, List[int]] = {}
+        for user_id in self.hub.subscribed_users():
+            key = sharding.router.shard_key(user_id) if sharding.SHARDING_ENABLED else "main"
+            groups.setdefault(key, []).append(user_id)
+        for key in set(self._cursors) - set(groups):
+            del self._cursors[key]
+        sent = 0
+        for key, user_ids in groups.items():
+            db = sharding.router.session_for_key(key) if key != "main" else SessionLocal()
+            try:
+                sent += self._poll_database(db, key, user_ids)
+            finally:
+                db.close()
+        return sent
+
+    def _poll_database(self, db, key: str, user_ids: List[int]) -> int:
+        cursor = self._cursors.get(key)
+        if cursor is None:
+            self._cursors[key] = db.query(func.coalesce(func.max(ChangeLog.id), 0)).scalar()
+            return 0
+        entries = (
+            db.query(ChangeLog.id, ChangeLog.user_id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op)
+            .filter(ChangeLog.id > cursor, ChangeLog.user_id.in_(user_ids))
+            .order_by(ChangeLog.id)
+            .limit(POLL_BATCH)
+            .all()
+        )
+        if not entries:
+            return 0
+        self._cursors[key] = entries[-1].id
+        if len(entries) == POLL_BATCH:
+            self.wake()
+        # newest op per row, per user and entity
+        latest: Dict[int, Dict[str, Dict[int, str]]] = {}
+        for entry in entries:
+            latest.setdefault(entry.user_id, {}).setdefault(entry.entity, {})[entry.entity_id] = entry.op
+        for user_id, entities in latest.items():
+            changes = []
+            for entity, ops in entities.items():
+                if len(ops) > RESYNC_AFTER:
+                    changes.append({"entity": entity, "op": "resync"})
+                else:
+                    changes.extend(self._changes(db, entity, ops))
+            self.hub.publish(user_id, {"changes": changes, "at": time.time()})
+        return len(latest)
+
+    @staticmethod
+    def _changes(db, entity: str, ops: Dict[int, str]) -> List[Dict]:
+        fields = LIVE_FIELDS.get(entity)
+        upserts = [entity_id for entity_id, op in ops.items() if op == "upsert"]
+        rows = {}
+        if fields and upserts:
+            model = LIVE_MODELS[entity]
+            columns = [getattr(model, field) for field in fields]
+            rows = {row[0]: row[1:] for row in db.query(model.id, *columns).filter(model.id.in_(upserts))}
+        changes = []
+        for entity_id, op in ops.items():
+            change = {"entity": entity, "op": op, "id": entity_id}
+            if fields and op == "upsert":
+                values = rows.get(entity_id)
+                if values is None:
+                    # deleted since it was logged
+                    change["op"] = "delete"
+                else:
+                    change["data"] = dict(zip(fields, values))
+            changes.append(change)
+        return changes
+
+
+hub = EventHub()
+feed = ChangeFeed(hub)
+
+
+def format_sse(message: Optional[Dict]) -> str:
+    if message is None:
+        return ": keepalive\n\n"
+    if message.get("type") == "resync":
+        return "event: resync\ndata: {}\n\n"
+    return f"event: change\ndata: {json.dumps(message, separators=(',', ':'), default=str)}\n\n"
+
+
+def notify_changes():
+    """Deliver newly logged changes now rather than at the next poll; call
+    after committing bulk writes that went through ``record_changes``."""
+    feed.wake()
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _note_changes(session, flush_context):
+    if any(type(obj) in SYNC_ENTITIES for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["live_events"] = True
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _wake_feed(session):
+    if session.info.pop("live_events", None):
+        feed.wake()
+
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def _drop_changes(session, previous_transaction):
+    session.info.pop("live_events", None)
+
+
+def session_user_loader(flask_app):
+    """``user_id_for(scope)`` for ASGI apps: reads the logged-in user from
+    ``flask_app``'s signed session cookie."""
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    cookie_name = flask_app.config.get("SESSION_COOKIE_NAME", "session")
+
+    def user_id_for(scope) -> Optional[int]:
+        cookies = SimpleCookie()
+        for name, value in scope.get("headers", ()):
+            if name == b"cookie":
+                cookies.load(value.decode("latin-1"))
+        morsel = cookies.get(cookie_name)
+        if morsel is None or serializer is None:
+            return None
+        try:
+            return serializer.loads(morsel.value).get("user_id")
+        except Exception:
+            return None
+
+    return user_id_for
+
+
+def make_asgi_app(flask_app, path: str = "/events"):
+    """ASGI callable serving ``path`` for logged-in users of ``flask_app``
+    (the Flask session cookie is read directly). Other paths get a 404, so
+    put it behind the same host and route ``/events`` to it."""
+    user_id_for = session_user_loader(flask_app)
+
+    async def respond(send, status: int, body: bytes):
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        if scope["path"] != path:
+            await respond(send, 404, b"not found")
+            return
+        user_id = user_id_for(scope)
+        if not user_id:
+            await respond(send, 401, b"login required")
+            return
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+
+        async def wait_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        disconnected = asyncio.ensure_future(wait_disconnect())
+        messages = hub.astream(user_id).__aiter__()
+        try:
+            while True:
+                next_message = asyncio.ensure_future(messages.__anext__())
+                await asyncio.wait({next_message, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    next_message.cancel()
+                    await asyncio.gather(next_message, return_exceptions=True)
+                    break
+                await send({"type": "http.response.body", "body": next_message.result().encode(), "more_body": True})
+        finally:
+            disconnected.cancel()
+            await messages.aclose()
+
+    return app
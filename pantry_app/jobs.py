@@ -0,0 +1,471 @@
+"""In-process background jobs.
+
+Jobs are rows in the ``jobs`` table, so queued work survives a restart. A
+small pool of worker threads claims ready jobs in priority order, retries
+failures with exponential backoff and respects per-job concurrency limits.
+Request handlers enqueue work and return immediately:
+
+    scheduler.enqueue("export.snapshot", {"user_id": 1})
+
+Passing ``dedupe_key`` debounces a trigger: while a job with that key is
+still queued, further enqueues push its start time back instead of adding
+another row, so a burst of inventory edits becomes one shopping-list sync.
+Periodic jobs are registered with :meth:`JobScheduler.every`. The scheduler
+starts lazily on the first enqueue (or from :func:`init_app`).
+"""
+import datetime as dt
+import logging
+import os
+import threading
+import time
+import traceback
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import func
+
+from pantry_app import metrics
+from pantry_app.models import DB_PATH, Job, SessionLocal
+from pantry_app.utils import parse_json, serialize_json
+
+logger = logging.getLogger("pantry_app.jobs")
+
+EXPORT_DIR = Path(os.environ.get("PANTRY_EXPORT_DIR") or DB_PATH.parent / "exports")
+BACKUP_INTERVAL_HOURS = float(os.environ.get("PANTRY_BACKUP_INTERVAL_HOURS") or 24)
+MAINTENANCE_INTERVAL_HOURS = float(os.environ.get("PANTRY_MAINTENANCE_INTERVAL_HOURS") or 6)
+CHECK_INTERVAL_HOURS = float(os.environ.get("PANTRY_CHECK_INTERVAL_HOURS") or 24)
+COMPACT_INTERVAL_HOURS = float(os.environ.get("PANTRY_COMPACT_INTERVAL_HOURS") or 24)
+
+JOB_RUNS = metrics.registry.register(
+    metrics.Counter("pantry_jobs_total", "Finished job attempts by outcome.", ("job", "status"))
+)
+
+
+class ClaimedJob(NamedTuple):
+    id: int
+    name: str
+    payload: Dict
+    attempts: int
+    max_attempts: int
+
+
+class PeriodicJob(NamedTuple):
+    name: str
+    interval: float
+    payload: Dict
+    priority: int
+
+
+class JobScheduler:
+    def __init__(
+        self,
+        workers: int = 2,
+        poll_interval: float = 1.0,
+        retry_base: float = 5.0,
+        stale_after: float = 3600.0,
+    ):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retry_base = retry_base
+        self.stale_after = stale_after
+        self.handlers: Dict[str, Callable[[Dict], Optional[Dict]]] = {}
+        self.periodic: List[PeriodicJob] = []
+        self._limits: Dict[str, int] = {}
+        self._running: Dict[str, int] = defaultdict(int)
+        self._next_due: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def register(self, name: str, concurrency: Optional[int] = None):
+        def decorator(func):
+            self.handlers[name] = func
+            if concurrency:
+                self._limits[name] = concurrency
+            return func
+
+        return decorator
+
+    def every(self, name: str, seconds: float, payload: Optional[Dict] = None, priority: int = 0):
+        self.periodic.append(PeriodicJob(name, seconds, payload or {}, priority))
+
+    def enqueue(
+        self,
+        name: str,
+        payload: Optional[Dict] = None,
+        priority: int = 0,
+        delay: float = 0.0,
+        dedupe_key: Optional[str] = None,
+        max_attempts: int = 3,
+    ) -> int:
+        now = dt.datetime.utcnow()
+        run_at = now + dt.timedelta(seconds=delay)
+        db = SessionLocal()
+        try:
+            job = None
+            if dedupe_key:
+                job = db.query(Job).filter_by(dedupe_key=dedupe_key, status="queued").first()
+            if job:
+                # Keep pushing the start back while triggers arrive, but never
+                # more than ten delays past the first one.
+                job.run_at = min(run_at, job.created_at + dt.timedelta(seconds=delay * 10))
+                job.payload = serialize_json(payload or {})
+                job.priority = max(job.priority, priority)
+            else:
+                job = Job(
+                    name=name,
+                    payload=serialize_json(payload or {}),
+                    priority=priority,
+                    run_at=run_at,
+                    created_at=now,
+                    dedupe_key=dedupe_key,
+                    max_attempts=max_attempts,
+                )
+                db.add(job)
+            db.commit()
+            job_id = job.id
+        finally:
+            db.close()
+        self._wake.set()
+        return job_id
+
+    def flush(self, dedupe_key: str) -> bool:
+        """Run the queued job for ``dedupe_key`` now, in the calling thread."""
+        job = self._claim(dedupe_key=dedupe_key)
+        if job is None:
+            return False
+        self._execute(job)
+        return True
+
+    def start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            self._recover()
+            now = time.time()
+            for periodic in self.periodic:
+                self._next_due[periodic.name] = self._last_finished(periodic.name, now) + periodic.interval
+            threads = [
+                threading.Thread(target=self._work, name=f"pantry-jobs-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            if self.periodic:
+                threads.append(threading.Thread(target=self._tick, name="pantry-jobs-timer", daemon=True))
+            for thread in threads:
+                thread.start()
+            self._threads = threads
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def summary(self, limit: int = 50) -> Dict:
+        db = SessionLocal()
+        try:
+            counts = dict(
+                db.query(Job.status, func.count(Job.id)).group_by(Job.status).all()
+            )
+            recent = db.query(Job).order_by(Job.id.desc()).limit(limit).all()
+            return {
+                "running": self.is_running(),
+                "workers": self.workers,
+                "counts": counts,
+                "periodic": [
+                    {"name": p.name, "interval_seconds": p.interval} for p in self.periodic
+                ],
+                "jobs": [job_dict(job) for job in recent],
+            }
+        finally:
+            db.close()
+
+    def is_running(self) -> bool:
+        return any(thread.is_alive() for thread in self._threads)
+
+    def purge(self, older_than_days: int = 7) -> int:
+        cutoff = dt.datetime.utcnow() - dt.timedelta(days=older_than_days)
+        db = SessionLocal()
+        try:
+            expired = db.query(Job).filter(Job.status.in_(("done", "failed")), Job.finished_at < cutoff)
+            # a finished export's file is only reachable through its job
+            exports = expired.filter(Job.name == "export.snapshot", Job.status == "done")
+            for (result,) in exports.with_entities(Job.result):
+                name = parse_json(result, {}).get("file") if result else None
+                if name:
+                    (EXPORT_DIR / Path(name).name).unlink(missing_ok=True)
+            removed = expired.delete(synchronize_session=False)
+            db.commit()
+            return removed
+        finally:
+            db.close()
+
+    def _recover(self):
+        # Jobs left "running" by a process that died are queued again once
+        # they are old enough not to belong to another live worker process.
+        cutoff = dt.datetime.utcnow() - dt.timedelta(seconds=self.stale_after)
+        db = SessionLocal()
+        try:
+            db.query(Job).filter(Job.status == "running", Job.started_at < cutoff).update(
+                {"status": "queued"}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _last_finished(self, name: str, default: float) -> float:
+        db = SessionLocal()
+        try:
+            finished = db.query(func.max(Job.finished_at)).filter(Job.name == name).scalar()
+        finally:
+            db.close()
+        if finished is None:
+            return default
+        return finished.replace(tzinfo=dt.timezone.utc).timestamp()
+
+    def _claim(self, dedupe_key: Optional[str] = None) -> Optional[ClaimedJob]:
+        with self._lock:
+            now = dt.datetime.utcnow()
+            db = SessionLocal()
+            try:
+                query = db.query(Job).filter(Job.status == "queued")
+                if dedupe_key:
+                    query = query.filter(Job.dedupe_key == dedupe_key)
+                else:
+                    query = query.filter(Job.run_at <= now)
+                busy = [name for name, limit in self._limits.items() if self._running[name] >= limit]
+                if busy:
+                    query = query.filter(Job.name.notin_(busy))
+                candidates = [
+                    ClaimedJob(job.id, job.name, parse_json(job.payload, {}), job.attempts + 1, job.max_attempts)
+                    for job in query.order_by(Job.priority.desc(), Job.run_at).limit(5)
+                ]
+                for job in candidates:
+                    claimed = (
+                        db.query(Job)
+                        .filter(Job.id == job.id, Job.status == "queued")
+                        .update(
+                            {"status": "running", "started_at": now, "attempts": job.attempts},
+                            synchronize_session=False,
+                        )
+                    )
+                    db.commit()
+                    if claimed:
+                        self._running[job.name] += 1
+                        return job
+                return None
+            finally:
+                db.close()
+
+    def _execute(self, job: ClaimedJob):
+        try:
+            handler = self.handlers.get(job.name)
+            if handler is None:
+                self._finish(job, error=f"no handler registered for {job.name!r}", retry=False)
+                return
+            with metrics.span(f"job.{job.name}"):
+                result = handler(job.payload)
+        except Exception:
+            logger.exception("job %s (%s) failed", job.id, job.name)
+            self._finish(job, error=traceback.format_exc(limit=5))
+        else:
+            self._finish(job, result=result)
+        finally:
+            with self._lock:
+                self._running[job.name] -= 1
+
+    def _finish(self, job: ClaimedJob, result=None, error: Optional[str] = None, retry: bool = True):
+        now = dt.datetime.utcnow()
+        values = {"finished_at": now}
+        if error is None:
+            values.update(status="done", result=serialize_json(result) if result is not None else None)
+            outcome = "done"
+        elif retry and job.attempts < job.max_attempts:
+            backoff = self.retry_base * 2 ** (job.attempts - 1)
+            values.update(status="queued", last_error=error, run_at=now + dt.timedelta(seconds=backoff))
+            outcome = "retry"
+        else:
+            values.update(status="failed", last_error=error)
+            outcome = "failed"
+        db = SessionLocal()
+        try:
+            db.query(Job).filter(Job.id == job.id).update(values, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        JOB_RUNS.inc(job=job.name, status=outcome)
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except Exception:
+                logger.exception("could not claim a job")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self._execute(job)
+
+    def _tick(self):
+        while not self._stop.wait(self.poll_interval):
+            now = time.time()
+            for periodic in self.periodic:
+                if now < self._next_due.get(periodic.name, now):
+                    continue
+                self._next_due[periodic.name] = now + periodic.interval
+                try:
+                    self.enqueue(
+                        periodic.name,
+                        periodic.payload,
+                        priority=periodic.priority,
+                        dedupe_key=f"periodic:{periodic.name}",
+                    )
+                except Exception:
+                    logger.exception("could not enqueue periodic job %s", periodic.name)
+
+
+def job_dict(job: Job) -> Dict:
+    return {
+        "id": job.id,
+        "name": job.name,
+        "payload": parse_json(job.payload, {}),
+        "priority": job.priority,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "dedupe_key": job.dedupe_key,
+        "run_at": job.run_at.isoformat() if job.run_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "last_error": job.last_error,
+        "result": parse_json(job.result, None) if job.result else None,
+    }
+
+
+def get_job(job_id: int) -> Optional[Dict]:
+    db = SessionLocal()
+    try:
+        job = db.query(Job).get(job_id)
+        return job_dict(job) if job else None
+    finally:
+        db.close()
+
+
+scheduler = JobScheduler(workers=int(os.environ.get("PANTRY_JOB_WORKERS") or 2))
+
+
+@scheduler.register("shopping.low_stock_sync", concurrency=2)
+def _low_stock_sync(payload: Dict):
+    from pantry_app.services.shopping import ShoppingService
+
+    service = ShoppingService(payload["user_id"])
+    try:
+        return service.refresh()
+    finally:
+        service.db.close()
+
+
+@scheduler.register("export.snapshot", concurrency=1)
+def _export_snapshot(payload: Dict):
+    from pantry_app.services.export_import import ExportImportService
+
+    service = ExportImportService(payload["user_id"])
+    try:
+        data = service.export_snapshot()
+    finally:
+        service.db.close()
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = dt.datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    path = EXPORT_DIR / f"user-{payload['user_id']}-{stamp}.json"
+    path.write_text(serialize_json(data))
+    return {"file": path.name, "bytes": path.stat().st_size}
+
+
+@scheduler.register("products.duplicates", concurrency=1)
+def _find_duplicates(payload: Dict):
+    from pantry_app.services.dedupe import DuplicateService
+
+    service = DuplicateService(payload["user_id"])
+    try:
+        return service.find()
+    finally:
+        service.db.close()
+
+
+@scheduler.register("backup.run", concurrency=1)
+def _backup(payload: Dict):
+    from pantry_app.backup import backup_manager
+
+    return backup_manager.run()
+
+
+@scheduler.register("jobs.purge", concurrency=1)
+def _purge(payload: Dict):
+    return {"removed": scheduler.purge(payload.get("older_than_days", 7))}
+
+
+@scheduler.register("db.optimize", concurrency=1)
+def _db_optimize(payload: Dict):
+    from pantry_app import maintenance
+
+    return maintenance.routine(payload.get("max_vacuum_pages"))
+
+
+@scheduler.register("db.check", concurrency=1)
+def _db_check(payload: Dict):
+    from pantry_app import maintenance
+
+    return maintenance.run("check", full=bool(payload.get("full")))
+
+
+@scheduler.register("sync.compact", concurrency=1)
+def _compact_change_log(payload: Dict):
+    from pantry_app.services.sync import compact_change_log
+    from pantry_app.sharding import for_each_shard
+
+    return {"removed": for_each_shard(compact_change_log)}
+
+
+if BACKUP_INTERVAL_HOURS > 0:
+    scheduler.every("backup.run", BACKUP_INTERVAL_HOURS * 3600)
+if MAINTENANCE_INTERVAL_HOURS > 0:
+    scheduler.every("db.optimize", MAINTENANCE_INTERVAL_HOURS * 3600)
+if CHECK_INTERVAL_HOURS > 0:
+    scheduler.every("db.check", CHECK_INTERVAL_HOURS * 3600)
+if COMPACT_INTERVAL_HOURS > 0:
+    scheduler.every("sync.compact", COMPACT_INTERVAL_HOURS * 3600)
+scheduler.every("jobs.purge", 24 * 3600)
+
+
+def queue_low_stock_sync(user_id: int, delay: float = 2.0) -> int:
+    return scheduler.enqueue(
+        "shopping.low_stock_sync",
+        {"user_id": user_id},
+        priority=5,
+        delay=delay,
+        dedupe_key=f"shopping:{user_id}",
+    )
+
+
+def run_pending_low_stock_sync(user_id: int) -> bool:
+    return scheduler.flush(f"shopping:{user_id}")
+
+
+def init_app(app):
+    """Start the workers when the app serves its first request, unless
+    ``JOBS_AUTOSTART`` (``PANTRY_JOBS_AUTOSTART=0``) is off. Importing the app,
+    as the ASGI module, benchmarks and scripts do, starts nothing."""
+    app.config.setdefault("JOBS_AUTOSTART", os.environ.get("PANTRY_JOBS_AUTOSTART") != "0")
+
+    @app.before_request
+    def _start_jobs():
+        if app.config["JOBS_AUTOSTART"]:
+            scheduler.start()
@@ -0,0 +1,304 @@
+"""Routine maintenance for the pantry databases.
+
+Each task runs against the main database and every shard, on its own short
+sqlite3 connection, and is safe while the app is serving:
+
+    python -m pantry_app.maintenance stats
+    python -m pantry_app.maintenance optimize
+    python -m pantry_app.maintenance analyze
+    python -m pantry_app.maintenance vacuum [--max-pages 10000]
+    python -m pantry_app.maintenance vacuum --full
+    python -m pantry_app.maintenance check [--full]
+
+``optimize`` re-analyzes only tables that have no statistics or whose size
+drifted, with ``analysis_limit`` bounding the rows sampled per index, then
+runs ``PRAGMA optimize``. ``analyze`` runs a full ``ANALYZE``. ``vacuum``
+releases free pages with ``PRAGMA incremental_vacuum`` a few hundred pages
+per write transaction, pausing between steps like the online backup does,
+then a passive WAL checkpoint lets the file shrink. That needs
+``auto_vacuum=INCREMENTAL``, which new databases get at creation. Older
+files need one ``vacuum --full`` to switch, and that rewrites the whole
+file under an exclusive lock, so run it in a quiet moment. ``check`` runs
+``quick_check`` (``integrity_check`` with ``--full``) and
+``foreign_key_check``. References to tables kept in another file, such as a
+shard's ``user_id`` pointing at ``users`` in app.db, are skipped.
+
+``optimize`` plus ``vacuum`` run as the periodic ``db.optimize`` job and
+``check`` as ``db.check`` (see :mod:`pantry_app.jobs`).
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from pantry_app import metrics
+from pantry_app.sharding import database_files
+
+logger = logging.getLogger("pantry_app.maintenance")
+
+ANALYSIS_LIMIT = int(os.environ.get("PANTRY_ANALYSIS_LIMIT") or 1000)
+# re-analyze a table once its size is off its last estimate by this factor
+OPTIMIZE_DRIFT = 2.0
+VACUUM_STEP_PAGES = 256
+VACUUM_STEP_SLEEP = 0.005
+MAX_CHECK_ERRORS = 100
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+DB_PAGES = metrics.registry.register(
+    metrics.Gauge("pantry_db_pages", "Database pages by file and state (used, free).", ("database", "state"))
+)
+DB_BYTES = metrics.registry.register(
+    metrics.Gauge("pantry_db_bytes", "Database and WAL file sizes.", ("database", "file"))
+)
+MAINTENANCE_SECONDS = metrics.registry.register(
+    metrics.Histogram(
+        "pantry_db_maintenance_seconds",
+        "Time spent per maintenance task and database.",
+        ("task",),
+        buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0, 600.0),
+    )
+)
+CHECK_FAILURES = metrics.registry.register(
+    metrics.Counter("pantry_db_check_failures_total", "Integrity or foreign key checks that found problems.", ("database",))
+)
+
+
+def connect(path: Path) -> sqlite3.Connection:
+    # autocommit: each pragma or vacuum step is its own short transaction
+    conn = sqlite3.connect(str(path), timeout=30, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+def _pragma(conn: sqlite3.Connection, name: str):
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def stats(conn: sqlite3.Connection, path: Path) -> Dict:
+    page_size = _pragma(conn, "page_size")
+    page_count = _pragma(conn, "page_count")
+    free = _pragma(conn, "freelist_count")
+    wal = Path(str(path) + "-wal")
+    return {
+        "bytes": path.stat().st_size if path.exists() else 0,
+        "wal_bytes": wal.stat().st_size if wal.exists() else 0,
+        "page_size": page_size,
+        "pages": page_count,
+        "free_pages": free,
+        "free_bytes": free * page_size,
+        "auto_vacuum": AUTO_VACUUM_MODES.get(_pragma(conn, "auto_vacuum"), "unknown"),
+        "analyzed": _has_table(conn, "sqlite_stat1"),
+        "rows": _estimated_rows(conn),
+    }
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def _estimated_rows(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Row counts as of the last ANALYZE: free to read, unlike count(*)."""
+    if not _has_table(conn, "sqlite_stat1"):
+        return {}
+    rows = {}
+    for table, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+        count = int((stat or "0").split()[0])
+        rows[table] = max(rows.get(table, 0), count)
+    return dict(sorted(rows.items()))
+
+
+def optimize(conn: sqlite3.Connection, analysis_limit: int = ANALYSIS_LIMIT) -> Dict:
+    """ANALYZE the tables that were never analyzed or whose size drifted
+    by more than OPTIMIZE_DRIFT, then PRAGMA optimize.
+
+    Before SQLite 3.46 ``PRAGMA optimize`` only considers tables queried on
+    the same connection, which a fresh maintenance connection never has, so
+    drift is judged here from ``max(rowid)`` (one index probe) against the
+    stat1 estimate.
+    """
+    conn.execute(f"PRAGMA analysis_limit={int(analysis_limit)}")
+    estimates = _estimated_rows(conn)
+    stale = []
+    for table in _user_tables(conn):
+        if not _has_rows(conn, table):
+            continue
+        estimate = estimates.get(table)
+        size = _approximate_rows(conn, table)
+        if estimate is None or size is None or not estimate / OPTIMIZE_DRIFT <= size <= estimate * OPTIMIZE_DRIFT:
+            stale.append(table)
+    for table in stale:
+        conn.execute(f'ANALYZE "{table}"')
+    conn.execute("PRAGMA optimize").fetchall()
+    return {"analysis_limit": analysis_limit, "analyzed": stale}
+
+
+def _user_tables(conn: sqlite3.Connection) -> List[str]:
+    return [
+        row[0]
+        for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )
+    ]
+
+
+def _has_rows(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute(f'SELECT 1 FROM "{table}" LIMIT 1').fetchone() is not None
+
+
+def _approximate_rows(conn: sqlite3.Connection, table: str) -> Optional[int]:
+    try:
+        return conn.execute(f'SELECT max(rowid) FROM "{table}"').fetchone()[0]
+    except sqlite3.OperationalError:
+        # WITHOUT ROWID table
+        return None
+
+
+def analyze(conn: sqlite3.Connection, analysis_limit: int = 0) -> Dict:
+    conn.execute(f"PRAGMA analysis_limit={int(analysis_limit)}")
+    conn.execute("ANALYZE")
+    return {"analysis_limit": analysis_limit, "tables": len(_estimated_rows(conn))}
+
+
+def incremental_vacuum(
+    conn: sqlite3.Connection,
+    max_pages: Optional[int] = None,
+    step: int = VACUUM_STEP_PAGES,
+    sleep: float = VACUUM_STEP_SLEEP,
+) -> Dict:
+    free = _pragma(conn, "freelist_count")
+    if _pragma(conn, "auto_vacuum") != 2:
+        return {"skipped": "auto_vacuum is not incremental; run vacuum --full once", "free_pages": free}
+    released = 0
+    while free and (max_pages is None or released < max_pages):
+        pages = min(step, free) if max_pages is None else min(step, free, max_pages - released)
+        # sqlite3's execute() steps a row-less statement once, freeing one
+        # page; executescript() runs it to completion.
+        conn.executescript(f"PRAGMA incremental_vacuum({pages});")
+        now_free = _pragma(conn, "freelist_count")
+        if now_free >= free:
+            break
+        released += free - now_free
+        free = now_free
+        time.sleep(sleep)
+    if released:
+        # the file is truncated when the WAL is checkpointed; PASSIVE never
+        # waits on readers or writers
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+    return {"released_pages": released, "free_pages": free}
+
+
+def full_vacuum(conn: sqlite3.Connection) -> Dict:
+    """Rewrite the file, switching it to incremental auto-vacuum. Blocks
+    writers for the duration."""
+    before = _pragma(conn, "page_count")
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    return {"pages_before": before, "pages_after": _pragma(conn, "page_count")}
+
+
+def check(conn: sqlite3.Connection, full: bool = False, max_errors: int = MAX_CHECK_ERRORS) -> Dict:
+    pragma = "integrity_check" if full else "quick_check"
+    problems = [row[0] for row in conn.execute(f"PRAGMA {pragma}({int(max_errors)})")]
+    integrity = [] if problems == ["ok"] else problems
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    violations: List[Dict] = []
+    skipped = set()
+    for table, rowid, parent, fkid in conn.execute("PRAGMA foreign_key_check"):
+        if parent not in tables:
+            skipped.add(parent)
+            continue
+        if len(violations) < max_errors:
+            violations.append({"table": table, "rowid": rowid, "parent": parent})
+    return {
+        "ok": not integrity and not violations,
+        "check": pragma,
+        "integrity_errors": integrity,
+        "foreign_key_violations": violations,
+        "skipped_parents": sorted(skipped),
+    }
+
+
+TASKS: Dict[str, Callable] = {
+    "optimize": optimize,
+    "analyze": analyze,
+    "vacuum": incremental_vacuum,
+    "vacuum_full": full_vacuum,
+    "check": check,
+}
+
+
+def run(task: str, **options) -> Dict[str, Dict]:
+    """Run ``task`` on every database file; results keyed like the backup
+    manifest ("app.db", "shards/<key>.db")."""
+    results = {}
+    for name, path in database_files().items():
+        if not path.exists():
+            continue
+        conn = connect(path)
+        try:
+            started = time.perf_counter()
+            if task == "stats":
+                result = stats(conn, path)
+            else:
+                result = TASKS[task](conn, **options)
+                result["seconds"] = round(time.perf_counter() - started, 3)
+                MAINTENANCE_SECONDS.observe(time.perf_counter() - started, task=task)
+            if task == "check" and not result["ok"]:
+                CHECK_FAILURES.inc(database=name)
+                logger.error("database check failed for %s: %s", name, result)
+            _record(name, conn, path)
+        finally:
+            conn.close()
+        results[name] = result
+    return results
+
+
+def _record(name: str, conn: sqlite3.Connection, path: Path):
+    pages, free = _pragma(conn, "page_count"), _pragma(conn, "freelist_count")
+    DB_PAGES.set(pages - free, database=name, state="used")
+    DB_PAGES.set(free, database=name, state="free")
+    wal = Path(str(path) + "-wal")
+    DB_BYTES.set(path.stat().st_size, database=name, file="db")
+    DB_BYTES.set(wal.stat().st_size if wal.exists() else 0, database=name, file="wal")
+
+
+def routine(max_vacuum_pages: Optional[int] = None) -> Dict:
+    """The periodic pass: refresh planner statistics, release free pages."""
+    return {"optimize": run("optimize"), "vacuum": run("vacuum", max_pages=max_vacuum_pages)}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pantry database maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="file, page and row statistics")
+    optimize_cmd = sub.add_parser("optimize", help="PRAGMA optimize (analyze what changed)")
+    optimize_cmd.add_argument("--analysis-limit", type=int, default=ANALYSIS_LIMIT)
+    analyze_cmd = sub.add_parser("analyze", help="full ANALYZE")
+    analyze_cmd.add_argument("--analysis-limit", type=int, default=0, help="rows sampled per index; 0 for all")
+    vacuum = sub.add_parser("vacuum", help="release free pages incrementally")
+    vacuum.add_argument("--max-pages", type=int)
+    vacuum.add_argument("--full", action="store_true", help="rewrite the file and enable incremental auto-vacuum")
+    check_cmd = sub.add_parser("check", help="integrity and foreign key checks")
+    check_cmd.add_argument("--full", action="store_true", help="integrity_check instead of quick_check")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        results = run("stats")
+    elif args.command in ("optimize", "analyze"):
+        results = run(args.command, analysis_limit=args.analysis_limit)
+    elif args.command == "vacuum":
+        results = run("vacuum_full") if args.full else run("vacuum", max_pages=args.max_pages)
+    else:
+        results = run("check", full=args.full)
+    print(json.dumps(results, indent=2))
+    if args.command == "check" and not all(result["ok"] for result in results.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
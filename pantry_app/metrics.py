@@ -0,0 +1,273 @@
+import contextvars
+import cProfile
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger("pantry_app.metrics")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # per-bucket counts (+Inf last), sum, count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    labels = _labels(self.labelnames + ("le",), key + (le,))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict) -> Tuple:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _labels(labelnames: Tuple[str, ...], key: Tuple) -> str:
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+REQUEST_LATENCY = registry.register(
+    Histogram(
+        "pantry_request_duration_seconds",
+        "Request latency by endpoint.",
+        ("endpoint", "method"),
+    )
+)
+REQUESTS = registry.register(
+    Counter("pantry_requests_total", "Requests by endpoint and status.", ("endpoint", "method", "status"))
+)
+REQUEST_SQL = registry.register(
+    Histogram(
+        "pantry_request_sql_statements",
+        "SQL statements issued per request.",
+        ("endpoint",),
+        buckets=COUNT_BUCKETS,
+    )
+)
+SQL_DURATION = registry.register(
+    Histogram("pantry_sql_duration_seconds", "SQL statement latency by endpoint.", ("endpoint",))
+)
+SLOW_QUERIES = registry.register(
+    Counter("pantry_sql_slow_queries_total", "Statements slower than the slow-query threshold.", ("endpoint",))
+)
+SPAN_LATENCY = registry.register(
+    Histogram("pantry_span_duration_seconds", "Latency of instrumented operations.", ("span",))
+)
+SPAN_ERRORS = registry.register(
+    Counter("pantry_span_errors_total", "Instrumented operations that raised.", ("span",))
+)
+
+
+class RequestStats:
+    __slots__ = ("endpoint", "statements", "sql_seconds")
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "pantry_request_stats", default=None
+)
+slow_query_seconds = 0.1
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        SPAN_ERRORS.inc(span=name)
+        raise
+    finally:
+        SPAN_LATENCY.observe(time.perf_counter() - started, span=name)
+
+
+def install_sql_hooks(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("pantry_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("pantry_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        stats = _current.get()
+        endpoint = stats.endpoint if stats else "background"
+        if stats:
+            stats.statements += 1
+            stats.sql_seconds += elapsed
+        SQL_DURATION.observe(elapsed, endpoint=endpoint)
+        if elapsed >= slow_query_seconds:
+            SLOW_QUERIES.inc(endpoint=endpoint)
+            logger.warning("slow query (%.1f ms) in %s: %s", elapsed * 1000, endpoint, statement)
+
+
+def init_app(app, engine):
+    """Attach request timing, SQL counting, profiling and ``/metrics`` to ``app``.
+
+    ``SLOW_QUERY_MS`` sets the slow-query log threshold. With ``PROFILING``
+    enabled, requests carrying an ``X-Profile`` header are run under cProfile
+    and the stats are written to ``PROFILE_DIR``.
+    """
+    from flask import Response, g, request
+
+    global slow_query_seconds
+    app.config.setdefault("SLOW_QUERY_MS", 100)
+    app.config.setdefault("PROFILING", False)
+    app.config.setdefault("PROFILE_DIR", str(Path(app.root_path).parent / "profiles"))
+    slow_query_seconds = app.config["SLOW_QUERY_MS"] / 1000
+    install_sql_hooks(engine)
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_token = _current.set(RequestStats(request.endpoint or "unknown"))
+        if app.config["PROFILING"] and request.headers.get("X-Profile"):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def _record(response):
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            profile_dir = Path(app.config["PROFILE_DIR"])
+            profile_dir.mkdir(parents=True, exist_ok=True)
+            path = profile_dir / f"{request.endpoint or 'unknown'}-{time.time_ns()}.prof"
+            profiler.dump_stats(str(path))
+            response.headers["X-Profile-File"] = path.name
+        _finish(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _teardown(exc):
+        if "metrics_started" in g:
+            _finish(500)
+
+    def _finish(status: int):
+        started = g.pop("metrics_started", None)
+        token = g.pop("metrics_token", None)
+        if started is None:
+            return
+        stats = _current.get()
+        endpoint = request.endpoint or "unknown"
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=status)
+        if stats:
+            REQUEST_SQL.observe(stats.statements, endpoint=endpoint)
+        if token is not None:
+            _current.reset(token)
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
@@ -1,22 +1,52 @@
 import datetime as dt
+import hashlib
 import json
+import os
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
 
 from sqlalchemy import (
     Column,
+    Date,
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
+    UniqueConstraint,
+    bindparam,
     create_engine,
+    event,
+    inspect,
+    func,
+    select,
 )
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 
-DB_PATH = Path(__file__).resolve().parent.parent / "app.db"
+from pantry_app.utils import normalize_name
+
+DB_PATH = Path(os.environ.get("PANTRY_DB_PATH") or Path(__file__).resolve().parent.parent / "app.db")
 engine = create_engine(f"sqlite:///{DB_PATH}", connect_args={"check_same_thread": False})
+
+
+def configure_sqlite(bind):
+    # WAL lets readers (page renders, exports, online backups) run alongside a
+    # writer instead of blocking on the database file lock. auto_vacuum only
+    # takes effect on a new file; see pantry_app.maintenance.
+    @event.listens_for(bind, "connect")
+    def _set_pragmas(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+
+configure_sqlite(engine)
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
@@ -55,20 +85,136 @@ class Product(Base):
     location = Column(String, default="pantry")
     notes = Column(Text, default="")
     barcode = Column(String, nullable=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     user = relationship("User")
+    lots = relationship(
+        "ProductLot",
+        back_populates="product",
+        cascade="all, delete-orphan",
+        order_by="ProductLot.expires_on",
+    )
 
 
-class SavedRecipe(Base):
-    __tablename__ = "saved_recipes"
+# Case-insensitive name lookups (prompt context, shopping links) use this.
+Index("ix_products_user_lower_name", Product.user_id, func.lower(Product.name))
+
+
+# A dated batch of a product, in the product's unit. Lots cover part or all
+# of Product.quantity; the rest is undated stock. Decreases in quantity use up
+# lots soonest-expiring first (see _consume_lots below).
+class ProductLot(Base):
+    __tablename__ = "product_lots"
+    __table_args__ = (Index("ix_product_lots_user_expiry", "user_id", "expires_on"),)
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
+    product = relationship("Product", back_populates="lots")
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    quantity = Column(Float, nullable=False, default=0)
+    expires_on = Column(Date, nullable=True)
+    added_at = Column(DateTime, default=dt.datetime.utcnow)
+
+
+def take_fefo(lots, used: float):
+    """(lot, remaining quantity) for each lot that using ``used`` of the
+    product reduces, soonest-expiring first. ``lots`` are anything with
+    ``id``, ``quantity`` and ``expires_on``: entities or result rows."""
+    taken = []
+    for lot in sorted(lots, key=lambda lot: (lot.expires_on is None, lot.expires_on, lot.id or 0)):
+        if used <= 1e-9:
+            break
+        take = min(lot.quantity, used)
+        used -= take
+        taken.append((lot, lot.quantity - take))
+    return taken
+
+
+@event.listens_for(SessionLocal, "before_flush")
+def _consume_lots(session, flush_context, instances):
+    # Whatever lowered a product's quantity (cooking, an edit, a sync push),
+    # take it from the lots that expire first; emptied lots are removed.
+    for product in list(session.dirty):
+        if not isinstance(product, Product):
+            continue
+        state = inspect(product)
+        history = state.attrs.quantity.history
+        if not history.deleted or not history.added:
+            continue
+        if "lots" in state.dict and state.attrs.lots.history.has_changes():
+            continue  # lots set alongside the quantity (an import) are final
+        used = (history.deleted[0] or 0) - (history.added[0] or 0)
+        if used <= 0:
+            continue
+        with session.no_autoflush:
+            lots = list(product.lots)
+        for lot, remaining in take_fefo(lots, used):
+            lot.quantity = remaining
+            if remaining <= 1e-9:
+                product.lots.remove(lot)
+
+
+def trim_lots(connection, product_ids, chunk: int = 500) -> int:
+    """Core counterpart of _consume_lots for bulk quantity updates: shrink
+    each product's lots, soonest-expiring first, until they fit within its
+    quantity. Returns the number of lots changed or removed."""
+    lots, products = ProductLot.__table__, Product.__table__
+    product_ids = list(product_ids)
+    changed = 0
+    for start in range(0, len(product_ids), chunk):
+        rows = connection.execute(
+            select(lots.c.id, lots.c.product_id, lots.c.quantity, lots.c.expires_on, products.c.quantity.label("stock"))
+            .join(products, products.c.id == lots.c.product_id)
+            .where(lots.c.product_id.in_(product_ids[start : start + chunk]))
+        ).all()
+        by_product: Dict[int, list] = {}
+        for row in rows:
+            by_product.setdefault(row.product_id, []).append(row)
+        updates, removed = [], []
+        for product_lots in by_product.values():
+            excess = sum(lot.quantity for lot in product_lots) - max(product_lots[0].stock or 0, 0)
+            for lot, remaining in take_fefo(product_lots, excess):
+                if remaining <= 1e-9:
+                    removed.append(lot.id)
+                else:
+                    updates.append({"_id": lot.id, "quantity": remaining})
+        if updates:
+            connection.execute(
+                lots.update().where(lots.c.id == bindparam("_id")).values(quantity=bindparam("quantity")), updates
+            )
+        if removed:
+            connection.execute(lots.delete().where(lots.c.id.in_(removed)))
+        changed += len(updates) + len(removed)
+    return changed
+
+
+def trim_all_lots(bind) -> int:
+    """Repair lots left larger than their product's stock by bulk updates
+    made before trim_lots existed."""
+    lots, products = ProductLot.__table__, Product.__table__
+    with bind.begin() as conn:
+        over = conn.execute(
+            select(lots.c.product_id)
+            .join(products, products.c.id == lots.c.product_id)
+            .group_by(lots.c.product_id)
+            .having(func.sum(lots.c.quantity) > func.max(products.c.quantity) + 1e-9)
+        ).scalars().all()
+        return trim_lots(conn, over) if over else 0
+
+
+# One row per distinct recipe content (name, ingredients, instructions, tags)
+# per user, addressed by a SHA-256 of that content. Saved and cooked recipes
+# point here instead of each carrying their own copy.
+class RecipeVersion(Base):
+    __tablename__ = "recipe_versions"
+    __table_args__ = (UniqueConstraint("user_id", "content_hash", name="uq_recipe_versions_hash"),)
     id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    content_hash = Column(String(64), nullable=False)
     name = Column(String, nullable=False)
-    ingredients = Column(Text, default="[]")  # JSON list
+    ingredients = Column(Text, default="[]")
     instructions = Column(Text, default="")
-    tags = Column(Text, default="[]")  # JSON list
+    tags = Column(Text, default="[]")
     servings = Column(Integer, default=1)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    user = relationship("User")
+    created_at = Column(DateTime, default=dt.datetime.utcnow)
 
     def ingredient_list(self):
         try:
@@ -83,34 +229,151 @@ class SavedRecipe(Base):
             return []
 
 
-class CookedRecipe(Base):
+class VersionedContent:
+    """Reads recipe content from the linked RecipeVersion. The inline
+    ingredients, instructions and tags columns are only filled until the row
+    is flushed (or on rows written before versions existed)."""
+
+    def content(self):
+        if self.ingredients is None and self.version is not None:
+            return self.version
+        return self
+
+    def ingredient_list(self):
+        try:
+            return json.loads(self.content().ingredients or "[]")
+        except json.JSONDecodeError:
+            return []
+
+    def tag_list(self):
+        try:
+            return json.loads(self.content().tags or "[]")
+        except json.JSONDecodeError:
+            return []
+
+    def instruction_text(self):
+        return self.content().instructions or ""
+
+
+class SavedRecipe(VersionedContent, Base):
+    __tablename__ = "saved_recipes"
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    ingredients = Column(Text, default=None)
+    instructions = Column(Text, default=None)
+    tags = Column(Text, default=None)
+    servings = Column(Integer, default=1)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    user = relationship("User")
+    recipe_version_id = Column(Integer, ForeignKey("recipe_versions.id"), nullable=True, index=True)
+    version = relationship("RecipeVersion")
+
+
+class CookedRecipe(VersionedContent, Base):
     __tablename__ = "cooked_recipes"
+    __table_args__ = (
+        Index("ix_cooked_recipes_user_cooked_at", "user_id", "cooked_at"),
+        Index("ix_cooked_recipes_user_version", "user_id", "recipe_version_id"),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
-    ingredients = Column(Text, default="[]")
-    instructions = Column(Text, default="")
-    tags = Column(Text, default="[]")
+    ingredients = Column(Text, default=None)
+    instructions = Column(Text, default=None)
+    tags = Column(Text, default=None)
     servings = Column(Integer, default=1)
     cooked_at = Column(DateTime, default=dt.datetime.utcnow)
     rating = Column(Integer, default=None)
     user_id = Column(Integer, ForeignKey("users.id"))
     user = relationship("User")
+    recipe_version_id = Column(Integer, ForeignKey("recipe_versions.id"), nullable=True)
+    version = relationship("RecipeVersion")
 
-    def ingredient_list(self):
-        try:
-            return json.loads(self.ingredients)
-        except json.JSONDecodeError:
-            return []
 
-    def tag_list(self):
+def recipe_hash(name, ingredients, instructions, tags) -> str:
+    """Content address of a recipe; JSON columns may be passed as text."""
+    canonical = json.dumps(
+        {
+            "name": (name or "").strip(),
+            "ingredients": _json_value(ingredients, []),
+            "instructions": (instructions or "").strip(),
+            "tags": _json_value(tags, []),
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _json_value(value, default):
+    if isinstance(value, str):
         try:
-            return json.loads(self.tags)
+            return json.loads(value)
         except json.JSONDecodeError:
-            return []
+            return default
+    return value if value is not None else default
+
+
+def store_recipe_version(connection, user_id, name, ingredients, instructions, tags, servings=1) -> int:
+    """Return the id of the RecipeVersion with this content, creating it if needed."""
+    content_hash = recipe_hash(name, ingredients, instructions, tags)
+    table = RecipeVersion.__table__
+    connection.execute(
+        sqlite_insert(table)
+        .values(
+            user_id=user_id,
+            content_hash=content_hash,
+            name=name,
+            ingredients=_json_text(ingredients),
+            instructions=instructions or "",
+            tags=_json_text(tags),
+            servings=servings or 1,
+            created_at=dt.datetime.utcnow(),
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "content_hash"])
+    )
+    return connection.execute(
+        select(table.c.id).where(table.c.user_id == user_id, table.c.content_hash == content_hash)
+    ).scalar()
+
+
+def _json_text(value) -> str:
+    return value if isinstance(value, str) else json.dumps(value or [], ensure_ascii=False)
+
+
+@event.listens_for(SavedRecipe, "before_insert")
+@event.listens_for(SavedRecipe, "before_update")
+@event.listens_for(CookedRecipe, "before_insert")
+def _link_recipe_version(mapper, connection, target):
+    content = (target.ingredients, target.instructions, target.tags)
+    state = inspect(target)
+    renamed = state.persistent and state.attrs.name.history.has_changes()
+    if target.recipe_version_id and content == (None, None, None) and not renamed:
+        return
+    if target.recipe_version_id and None in content:
+        # a partial edit (a rename, new tags); the rest is on the current version
+        current = connection.execute(
+            select(RecipeVersion.__table__).where(RecipeVersion.id == target.recipe_version_id)
+        ).first()
+        if current is not None:
+            for field in ("ingredients", "instructions", "tags"):
+                if getattr(target, field) is None:
+                    setattr(target, field, getattr(current, field))
+    target.recipe_version_id = store_recipe_version(
+        connection,
+        target.user_id,
+        target.name,
+        target.ingredients,
+        target.instructions,
+        target.tags,
+        target.servings,
+    )
+    target.ingredients = target.instructions = target.tags = None
 
 
 class ShoppingItem(Base):
     __tablename__ = "shopping_items"
+    __table_args__ = (Index("ix_shopping_items_user_key", "user_id", "status", "name_key"),)
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     quantity = Column(Float, default=1)
@@ -119,6 +382,16 @@ class ShoppingItem(Base):
     linked_product_id = Column(Integer, ForeignKey("products.id"), nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     user = relationship("User")
+    # normalize_name(name), kept in step by the listener below; used to merge
+    # "Tomatoes" and "tomato" into one line.
+    name_key = Column(String, nullable=True)
+    bought_at = Column(DateTime, nullable=True)
+
+
+@event.listens_for(ShoppingItem, "before_insert")
+@event.listens_for(ShoppingItem, "before_update")
+def _set_shopping_name_key(mapper, connection, item):
+    item.name_key = normalize_name(item.name)
 
 
 class BarcodeMemory(Base):
@@ -131,8 +404,221 @@ class BarcodeMemory(Base):
     user = relationship("User")
 
 
-def init_db():
-    Base.metadata.create_all(engine)
+# Reference nutrient values per 100 g, seeded from pantry_app/data/nutrition.csv
+# and shared by all users. name_key is normalize_name(name).
+class NutritionFact(Base):
+    __tablename__ = "nutrition_facts"
+    id = Column(Integer, primary_key=True)
+    name_key = Column(String, nullable=False, unique=True)
+    name = Column(String, nullable=False)
+    kcal = Column(Float, nullable=False, default=0)
+    protein_g = Column(Float, nullable=False, default=0)
+    carbs_g = Column(Float, nullable=False, default=0)
+    fat_g = Column(Float, nullable=False, default=0)
+    fiber_g = Column(Float, nullable=False, default=0)
+    # density for volume units; weight of one piece for "units"/"packs"
+    g_per_ml = Column(Float, nullable=True)
+    g_per_unit = Column(Float, nullable=True)
+
+
+# Pre-aggregated cooking history maintained incrementally by HistoryService.
+# kind is one of "week", "recipe", "ingredient" or "tag".
+class CookingStat(Base):
+    __tablename__ = "cooking_stats"
+    __table_args__ = (
+        UniqueConstraint("user_id", "kind", "key", name="uq_cooking_stats_key"),
+        Index("ix_cooking_stats_rank", "user_id", "kind", "cook_count"),
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    cook_count = Column(Integer, default=0, nullable=False)
+    rating_sum = Column(Integer, default=0, nullable=False)
+    rating_count = Column(Integer, default=0, nullable=False)
+
+
+# Append-only update log backing the sync API. The autoincrement id doubles as
+# the per-user version cursor handed to clients.
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+    __table_args__ = (
+        Index("ix_change_log_user_version", "user_id", "id"),
+        {"sqlite_autoincrement": True},
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # "upsert" or "delete"
+    changed_at = Column(DateTime, default=dt.datetime.utcnow)
+
+
+SYNC_ENTITIES = {
+    Product: "products",
+    ShoppingItem: "shopping_items",
+    Category: "categories",
+    SavedRecipe: "saved_recipes",
+    CookedRecipe: "cooked_recipes",
+}
+
+
+def record_changes(connection, changes):
+    """Write (user_id, entity, entity_id, op) tuples to the change log.
+
+    ORM writes are captured automatically; bulk Core statements call this
+    directly with the ids they touched.
+    """
+    now = dt.datetime.utcnow()
+    rows = [
+        {"user_id": user_id, "entity": entity, "entity_id": entity_id, "op": op, "changed_at": now}
+        for user_id, entity, entity_id, op in changes
+        if user_id is not None
+    ]
+    if rows:
+        connection.execute(ChangeLog.__table__.insert(), rows)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _log_flushed_changes(session, flush_context):
+    changes = []
+    for obj in session.new:
+        entity = SYNC_ENTITIES.get(type(obj))
+        if entity:
+            changes.append((obj.user_id, entity, obj.id, "upsert"))
+    for obj in session.dirty:
+        entity = SYNC_ENTITIES.get(type(obj))
+        if entity and session.is_modified(obj, include_collections=False):
+            changes.append((obj.user_id, entity, obj.id, "upsert"))
+    for obj in session.deleted:
+        entity = SYNC_ENTITIES.get(type(obj))
+        if entity:
+            changes.append((obj.user_id, entity, obj.id, "delete"))
+    record_changes(session.connection(), changes)
+
+
+# Maps a user to the shard database holding their pantry data; lives in the
+# main database alongside users and the global barcode memory.
+class TenantShard(Base):
+    __tablename__ = "tenant_shards"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    shard_key = Column(String, nullable=False, index=True)
+    created_at = Column(DateTime, default=dt.datetime.utcnow)
+
+
+# Durable queue for pantry_app.jobs. status moves queued -> running -> done,
+# or back to queued with a later run_at until max_attempts is reached.
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_ready", "status", "run_at", "priority"),)
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    payload = Column(Text, default="{}")
+    priority = Column(Integer, default=0, nullable=False)
+    status = Column(String, default="queued", nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=3, nullable=False)
+    dedupe_key = Column(String, nullable=True, index=True)
+    run_at = Column(DateTime, default=dt.datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, default=dt.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    result = Column(Text, nullable=True)
+
+
+SHARED_MODELS = (User, BarcodeMemory, NutritionFact, TenantShard, Job)
+
+
+def tenant_tables():
+    shared = {model.__table__ for model in SHARED_MODELS}
+    return [table for table in Base.metadata.sorted_tables if table not in shared]
+
+
+def init_db(bind=None, tables=None):
+    bind = bind or engine
+    Base.metadata.create_all(bind, tables=tables)
+    _sync_schema(bind, tables)
+    if tables is None or RecipeVersion.__table__ in tables:
+        migrate_recipe_versions(bind)
+    if tables is None or ProductLot.__table__ in tables:
+        trim_all_lots(bind)
+
+
+def migrate_recipe_versions(bind, chunk: int = 5000) -> int:
+    """Link saved and cooked recipes written before recipe_versions existed,
+    moving their content out to the shared version rows."""
+    versions = RecipeVersion.__table__
+    migrated = 0
+    with bind.begin() as conn:
+        known = {
+            (row.user_id, row.content_hash): row.id
+            for row in conn.execute(select(versions.c.id, versions.c.user_id, versions.c.content_hash))
+        }
+        for model in (SavedRecipe, CookedRecipe):
+            table = model.__table__
+            last_id = 0
+            while True:
+                rows = conn.execute(
+                    select(
+                        table.c.id,
+                        table.c.user_id,
+                        table.c.name,
+                        table.c.ingredients,
+                        table.c.instructions,
+                        table.c.tags,
+                        table.c.servings,
+                    )
+                    .where(table.c.recipe_version_id.is_(None), table.c.id > last_id)
+                    .order_by(table.c.id)
+                    .limit(chunk)
+                ).all()
+                if not rows:
+                    break
+                updates = []
+                for row in rows:
+                    key = (row.user_id, recipe_hash(row.name, row.ingredients, row.instructions, row.tags))
+                    version_id = known.get(key)
+                    if version_id is None:
+                        version_id = known[key] = store_recipe_version(
+                            conn, row.user_id, row.name, row.ingredients, row.instructions, row.tags, row.servings
+                        )
+                    updates.append({"_id": row.id, "_version": version_id})
+                conn.execute(
+                    table.update()
+                    .where(table.c.id == bindparam("_id"))
+                    .values(recipe_version_id=bindparam("_version"), ingredients=None, instructions=None, tags=None),
+                    updates,
+                )
+                migrated += len(rows)
+                last_id = rows[-1].id
+        # saved rows linked before their content moved out kept a copy
+        saved = SavedRecipe.__table__
+        conn.execute(
+            saved.update()
+            .where(saved.c.recipe_version_id.isnot(None), saved.c.ingredients.isnot(None))
+            .values(ingredients=None, instructions=None, tags=None)
+        )
+    return migrated
+
+
+def _sync_schema(bind, tables=None):
+    # create_all only creates missing tables; bring older databases up to date
+    # with columns and indexes added since they were created.
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in tables or Base.metadata.sorted_tables:
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(bind.dialect)
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"
+                    )
+            for index in table.indexes:
+                # IF NOT EXISTS rather than checkfirst: reflection cannot see
+                # expression indexes such as ix_products_user_lower_name.
+                conn.execute(CreateIndex(index, if_not_exists=True))
 
 
 def get_default_categories():
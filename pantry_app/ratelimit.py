@@ -0,0 +1,93 @@
+"""Token-bucket rate limiting.
+
+A :class:`TokenBucket` holds up to ``capacity`` tokens and refills at
+``rate`` tokens per second; each attempt takes one. :class:`KeyedLimiter`
+keeps a bucket per key (a username, a client address) and forgets the
+least recently used keys beyond ``max_keys``, so a flood of distinct keys
+cannot grow memory without bound. A forgotten key starts again with a full
+bucket, which errs on the side of letting people in.
+
+    limiter = KeyedLimiter(rate=1 / 30, capacity=5)
+    allowed, retry_after = limiter.take("alice")
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost: float = 1.0) -> Tuple[bool, float]:
+        """Take ``cost`` tokens if available. Returns (allowed, seconds until
+        they would be)."""
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return True, 0.0
+            if self.rate <= 0:
+                return False, math.inf
+            return False, (cost - self.tokens) / self.rate
+
+    def give_back(self, amount: float = 1.0):
+        with self._lock:
+            self._refill(self.clock())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class KeyedLimiter:
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        max_keys: int = 10_000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bucket(self, key: Hashable) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity, self.clock)
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket
+
+    def take(self, key: Hashable, cost: float = 1.0) -> Tuple[bool, float]:
+        return self.bucket(key).take(cost)
+
+    def reset(self, key: Hashable):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+def retry_after_header(seconds: Optional[float]) -> str:
+    """Whole seconds for a Retry-After header, at least 1."""
+    if seconds is None or math.isinf(seconds):
+        return "60"
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,275 @@
+"""Read models for listing pages, the read API and exports.
+
+Rendering a page or an export only reads columns. Loading ORM entities for
+that pays for identity-map bookkeeping, change tracking and, worse, lazy
+relationship loads (``Product.category``, ``CookedRecipe.version``) issued
+once per row. The queries here select just the columns a reader needs, with
+related names joined in up front. Rows are streamed with ``yield_per`` and
+mapped to NamedTuple records, which hold only their values.
+
+Each record has a matching tuple of column expressions in field order, so
+``Record._make(row)`` maps a result row directly:
+
+    stmt = select(*PRODUCT_COLUMNS).select_from(Product).outerjoin(Category, ...)
+    products = read(db, stmt, ProductRow)
+
+Records are read-only snapshots. Code that changes data still loads
+entities through the services.
+"""
+import datetime as dt
+from typing import Iterator, List, NamedTuple, Optional, Type
+
+from sqlalchemy import func, select
+
+from pantry_app.models import (
+    BarcodeMemory,
+    Category,
+    CookedRecipe,
+    Product,
+    ProductLot,
+    RecipeVersion,
+    SavedRecipe,
+    ShoppingItem,
+)
+
+# rows fetched from the cursor per batch
+YIELD_PER = 1000
+
+
+class ProductRow(NamedTuple):
+    id: int
+    name: str
+    quantity: float
+    unit: str
+    low_stock_threshold: float
+    category_id: Optional[int]
+    category: Optional[str]
+    location: str
+    barcode: Optional[str]
+    notes: Optional[str]
+
+
+PRODUCT_COLUMNS = (
+    Product.id,
+    Product.name,
+    Product.quantity,
+    Product.unit,
+    Product.low_stock_threshold,
+    Product.category_id,
+    Category.name.label("category"),
+    Product.location,
+    Product.barcode,
+    Product.notes,
+)
+
+
+class ShoppingRow(NamedTuple):
+    id: int
+    name: str
+    quantity: float
+    unit: str
+    status: str
+    linked_product_id: Optional[int]
+    # the linked product's category or location, depending on the grouping
+    section: Optional[str]
+
+
+SHOPPING_COLUMNS = (
+    ShoppingItem.id,
+    ShoppingItem.name,
+    ShoppingItem.quantity,
+    ShoppingItem.unit,
+    ShoppingItem.status,
+    ShoppingItem.linked_product_id,
+)
+
+
+class CookedRow(NamedTuple):
+    id: int
+    name: str
+    servings: int
+    cooked_at: Optional[dt.datetime]
+    rating: Optional[int]
+
+
+COOKED_COLUMNS = (
+    CookedRecipe.id,
+    CookedRecipe.name,
+    CookedRecipe.servings,
+    CookedRecipe.cooked_at,
+    CookedRecipe.rating,
+)
+
+
+def stream(db, stmt, record: Type[NamedTuple], batch: int = YIELD_PER) -> Iterator:
+    """Rows of ``stmt`` as ``record`` instances, fetched ``batch`` at a time."""
+    make = record._make
+    for row in db.execute(stmt.execution_options(yield_per=batch)):
+        yield make(row)
+
+
+def read(db, stmt, record: Type[NamedTuple], batch: int = YIELD_PER) -> List:
+    return list(stream(db, stmt, record, batch))
+
+
+# export
+class ExportProduct(NamedTuple):
+    id: int
+    name: str
+    quantity: float
+    unit: str
+    low_stock_threshold: float
+    location: str
+    category: Optional[str]
+    notes: Optional[str]
+
+
+class ExportLot(NamedTuple):
+    product_id: int
+    quantity: float
+    expires_on: Optional[dt.date]
+
+
+class ExportRecipe(NamedTuple):
+    name: str
+    ingredients: str
+    instructions: str
+    tags: str
+    servings: int
+
+
+class ExportVersion(NamedTuple):
+    id: int
+    content_hash: str
+    name: str
+    ingredients: str
+    instructions: str
+    tags: str
+    servings: int
+
+
+class ExportCooked(NamedTuple):
+    name: str
+    ingredients: Optional[str]
+    instructions: Optional[str]
+    tags: Optional[str]
+    recipe_version_id: Optional[int]
+    content_hash: Optional[str]
+    servings: int
+    cooked_at: Optional[dt.datetime]
+    rating: Optional[int]
+
+
+class ExportShoppingItem(NamedTuple):
+    name: str
+    quantity: float
+    unit: str
+    status: str
+
+
+class ExportBarcode(NamedTuple):
+    barcode: str
+    name: str
+    category_name: Optional[str]
+
+
+class ExportReader:
+    """Streams each exported table of one user as records."""
+
+    def __init__(self, db, user_id: int, batch: int = YIELD_PER):
+        self.db = db
+        self.user_id = user_id
+        self.batch = batch
+
+    def _stream(self, stmt, record):
+        return stream(self.db, stmt, record, self.batch)
+
+    def products(self) -> Iterator[ExportProduct]:
+        stmt = (
+            select(
+                Product.id,
+                Product.name,
+                Product.quantity,
+                Product.unit,
+                Product.low_stock_threshold,
+                Product.location,
+                Category.name,
+                Product.notes,
+            )
+            .select_from(Product)
+            .outerjoin(Category, Category.id == Product.category_id)
+            .where(Product.user_id == self.user_id)
+        )
+        return self._stream(stmt, ExportProduct)
+
+    def categories(self) -> Iterator[str]:
+        stmt = select(Category.name).where(Category.user_id == self.user_id)
+        return self.db.execute(stmt).scalars()
+
+    def lots(self) -> Iterator[ExportLot]:
+        stmt = (
+            select(ProductLot.product_id, ProductLot.quantity, ProductLot.expires_on)
+            .where(ProductLot.user_id == self.user_id, ProductLot.quantity > 0)
+            .order_by(ProductLot.expires_on, ProductLot.id)
+        )
+        return self._stream(stmt, ExportLot)
+
+    def saved(self) -> Iterator[ExportRecipe]:
+        # content lives on the version; inline only on rows not yet migrated
+        stmt = (
+            select(
+                SavedRecipe.name,
+                func.coalesce(SavedRecipe.ingredients, RecipeVersion.ingredients, "[]"),
+                func.coalesce(SavedRecipe.instructions, RecipeVersion.instructions, ""),
+                func.coalesce(SavedRecipe.tags, RecipeVersion.tags, "[]"),
+                SavedRecipe.servings,
+            )
+            .select_from(SavedRecipe)
+            .outerjoin(RecipeVersion, RecipeVersion.id == SavedRecipe.recipe_version_id)
+            .where(SavedRecipe.user_id == self.user_id)
+        )
+        return self._stream(stmt, ExportRecipe)
+
+    def versions(self) -> Iterator[ExportVersion]:
+        stmt = select(
+            RecipeVersion.id,
+            RecipeVersion.content_hash,
+            RecipeVersion.name,
+            RecipeVersion.ingredients,
+            RecipeVersion.instructions,
+            RecipeVersion.tags,
+            RecipeVersion.servings,
+        ).where(RecipeVersion.user_id == self.user_id)
+        return self._stream(stmt, ExportVersion)
+
+    def cooked(self) -> Iterator[ExportCooked]:
+        stmt = (
+            select(
+                CookedRecipe.name,
+                CookedRecipe.ingredients,
+                CookedRecipe.instructions,
+                CookedRecipe.tags,
+                CookedRecipe.recipe_version_id,
+                RecipeVersion.content_hash,
+                CookedRecipe.servings,
+                CookedRecipe.cooked_at,
+                CookedRecipe.rating,
+            )
+            .select_from(CookedRecipe)
+            .outerjoin(RecipeVersion, RecipeVersion.id == CookedRecipe.recipe_version_id)
+            .where(CookedRecipe.user_id == self.user_id)
+        )
+        return self._stream(stmt, ExportCooked)
+
+    def shopping(self) -> Iterator[ExportShoppingItem]:
+        stmt = select(ShoppingItem.name, ShoppingItem.quantity, ShoppingItem.unit, ShoppingItem.status).where(
+            ShoppingItem.user_id == self.user_id
+        )
+        return self._stream(stmt, ExportShoppingItem)
+
+    def barcodes(self) -> Iterator[ExportBarcode]:
+        # barcode_memory is shared; the tenant session routes it by mapper
+        stmt = select(BarcodeMemory.barcode, BarcodeMemory.name, BarcodeMemory.category_name).where(
+            BarcodeMemory.user_id == self.user_id
+        )
+        return self._stream(stmt, ExportBarcode)
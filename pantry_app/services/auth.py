@@ -1,14 +1,156 @@
+"""Logins and password hashing.
+
+Password hashes are deliberately slow, so they run on a small dedicated
+thread pool (:class:`HashPool`) rather than on whichever request thread got
+the login. The pool admits at most ``workers + queue`` hashes at a time;
+beyond that :class:`AuthBusy` is raised at once, and the login page answers
+503, instead of every worker thread piling up behind a credential-stuffing
+burst. Before any hashing, each attempt takes a token from a per-address and
+a per-username bucket (:mod:`pantry_app.ratelimit`). An empty bucket raises
+:class:`LoginThrottled` with the seconds to wait.
+
+New hashes use PBKDF2-SHA256 with an iteration count calibrated once per
+process so one hash takes about ``PANTRY_PASSWORD_HASH_MS`` (default 250 ms),
+clamped to [MIN_ITERATIONS, MAX_ITERATIONS]; ``PANTRY_PASSWORD_HASH_ITERATIONS``
+pins it instead. Stored hashes with another algorithm or fewer iterations are
+replaced on the user's next successful login.
+"""
+import concurrent.futures
+import hashlib
+import os
+import threading
+import time
 from typing import Optional
 
 from werkzeug.security import check_password_hash, generate_password_hash
 
-from pantry_app.models import SessionLocal, User, ensure_default_user
+from pantry_app import metrics
+from pantry_app.models import SessionLocal, User
+from pantry_app.ratelimit import KeyedLimiter
+
+HASH_TARGET_MS = float(os.environ.get("PANTRY_PASSWORD_HASH_MS") or 250)
+PINNED_ITERATIONS = int(os.environ.get("PANTRY_PASSWORD_HASH_ITERATIONS") or 0)
+MIN_ITERATIONS = 310_000
+MAX_ITERATIONS = 2_000_000
+# Calibrated counts are rounded to this step so restarts agree.
+ITERATION_STEP = 50_000
+HASH_WORKERS = int(os.environ.get("PANTRY_HASH_WORKERS") or 2)
+HASH_QUEUE = int(os.environ.get("PANTRY_HASH_QUEUE") or 8)
+HASH_TIMEOUT = 10.0
+# attempts: burst, then one per N seconds
+LOGIN_BURST_PER_ADDRESS, LOGIN_SECONDS_PER_ADDRESS = 20, 3.0
+LOGIN_BURST_PER_USERNAME, LOGIN_SECONDS_PER_USERNAME = 5, 30.0
+
+HASH_SECONDS = metrics.registry.register(
+    metrics.Histogram("pantry_password_hash_seconds", "Time spent computing password hashes.", ("op",))
+)
+HASH_REJECTED = metrics.registry.register(
+    metrics.Counter("pantry_password_hash_rejected_total", "Hashes refused because the pool was saturated.")
+)
+LOGINS_THROTTLED = metrics.registry.register(
+    metrics.Counter("pantry_logins_throttled_total", "Login attempts refused by rate limits.", ("scope",))
+)
+REHASHED = metrics.registry.register(
+    metrics.Counter("pantry_password_rehashed_total", "Stored hashes upgraded at login.")
+)
+
+
+class AuthBusy(RuntimeError):
+    pass
+
+
+class LoginThrottled(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"too many login attempts; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def calibrate_iterations(target_ms: float = HASH_TARGET_MS, probe: int = 20_000) -> int:
+    """PBKDF2-SHA256 iterations that take about ``target_ms`` here."""
+    salt = os.urandom(16)
+    started = time.perf_counter()
+    hashlib.pbkdf2_hmac("sha256", b"calibration", salt, probe)
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    iterations = int(probe * target_ms / 1000 / elapsed)
+    iterations = round(iterations / ITERATION_STEP) * ITERATION_STEP
+    return max(MIN_ITERATIONS, min(iterations, MAX_ITERATIONS))
+
+
+_iterations: Optional[int] = None
+_iterations_lock = threading.Lock()
+
+
+def hash_iterations() -> int:
+    global _iterations
+    if _iterations is None:
+        with _iterations_lock:
+            if _iterations is None:
+                _iterations = PINNED_ITERATIONS or calibrate_iterations()
+    return _iterations
+
+
+def hash_method() -> str:
+    return f"pbkdf2:sha256:{hash_iterations()}"
+
+
+def needs_rehash(pwhash: str) -> bool:
+    """True for hashes weaker than, or in another scheme from, hash_method().
+    Lowering the target does not rehash anyone."""
+    method = pwhash.split("$", 1)[0].split(":")
+    if method[0] != "pbkdf2" or (len(method) > 1 and method[1] != "sha256"):
+        return True
+    try:
+        # werkzeug's implied default when the count is left out
+        iterations = int(method[2]) if len(method) > 2 else 600_000
+    except ValueError:
+        return True
+    return iterations < hash_iterations()
+
+
+class HashPool:
+    def __init__(self, workers: int = HASH_WORKERS, queue: int = HASH_QUEUE):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pantry-hash")
+        self._slots = threading.BoundedSemaphore(workers + queue)
+
+    def run(self, op: str, func, *args, timeout: float = HASH_TIMEOUT):
+        if not self._slots.acquire(blocking=False):
+            HASH_REJECTED.inc()
+            raise AuthBusy("password hashing is saturated")
+        try:
+            future = self._executor.submit(self._timed, op, func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until the hash finishes, even if the caller gave up.
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            raise AuthBusy("password hashing timed out") from None
+
+    @staticmethod
+    def _timed(op: str, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            HASH_SECONDS.observe(time.perf_counter() - started, op=op)
+
+
+hash_pool = HashPool()
+address_limiter = KeyedLimiter(1 / LOGIN_SECONDS_PER_ADDRESS, LOGIN_BURST_PER_ADDRESS)
+username_limiter = KeyedLimiter(1 / LOGIN_SECONDS_PER_USERNAME, LOGIN_BURST_PER_USERNAME)
+
+_dummy_hash: Optional[str] = None
+
+
+def _hash(password: str) -> str:
+    return generate_password_hash(password, method=hash_method())
 
 
 class AuthService:
     def __init__(self):
         self.db = SessionLocal()
-        ensure_default_user(self.db)
 
     def get_user(self, username: str) -> Optional[User]:
         return self.db.query(User).filter_by(username=username).first()
@@ -17,13 +159,42 @@ class AuthService:
         existing = self.get_user(username)
         if existing:
             raise ValueError("User already exists")
-        user = User(username=username, password_hash=generate_password_hash(password))
+        user = User(username=username, password_hash=hash_pool.run("hash", _hash, password))
         self.db.add(user)
         self.db.commit()
         return user
 
+    def login(self, username: str, password: str, address: Optional[str] = None) -> Optional[User]:
+        """verify() behind the per-address and per-username limits."""
+        key = (username or "").strip().lower()
+        for scope, limiter, limit_key in (
+            ("address", address_limiter, address),
+            ("username", username_limiter, key),
+        ):
+            if limit_key is None:
+                continue
+            allowed, retry_after = limiter.take(limit_key)
+            if not allowed:
+                LOGINS_THROTTLED.inc(scope=scope)
+                raise LoginThrottled(retry_after)
+        user = self.verify(username, password)
+        if user:
+            username_limiter.reset(key)
+        return user
+
     def verify(self, username: str, password: str) -> Optional[User]:
+        global _dummy_hash
         user = self.get_user(username)
-        if user and check_password_hash(user.password_hash, password):
-            return user
-        return None
+        if not user:
+            # Hash anyway so unknown usernames take as long as wrong passwords.
+            if _dummy_hash is None:
+                _dummy_hash = hash_pool.run("hash", _hash, os.urandom(16).hex())
+            hash_pool.run("verify", check_password_hash, _dummy_hash, password or "")
+            return None
+        if not hash_pool.run("verify", check_password_hash, user.password_hash, password or ""):
+            return None
+        if needs_rehash(user.password_hash):
+            user.password_hash = hash_pool.run("hash", _hash, password)
+            self.db.commit()
+            REHASHED.inc()
+        return user
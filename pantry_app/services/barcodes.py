@@ -0,0 +1,135 @@
+import csv
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional
+
+from pantry_app.models import BarcodeMemory, SessionLocal
+
+CATALOG_ENV = "PANTRY_BARCODE_CATALOG"
+
+
+class BarcodeEntry(NamedTuple):
+    barcode: str
+    name: str
+    category_name: Optional[str]
+
+
+class BarcodeIndex:
+    """Process-wide barcode cache.
+
+    Remembered barcodes (``BarcodeMemory``) are loaded lazily with a single
+    column-only query and kept current by the services that write them. An
+    optional bulk catalog file acts as a read-only fallback layer beneath them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._memory: Optional[Dict[str, BarcodeEntry]] = None
+        self._catalog: Dict[str, BarcodeEntry] = {}
+
+    @property
+    def loaded(self) -> bool:
+        return self._memory is not None
+
+    def get(self, barcode: str) -> Optional[BarcodeEntry]:
+        memory = self._ensure_loaded()
+        return memory.get(barcode) or self._catalog.get(barcode)
+
+    def get_many(self, barcodes: Iterable[str]) -> Dict[str, Optional[BarcodeEntry]]:
+        memory = self._ensure_loaded()
+        return {
+            code: memory.get(code) or self._catalog.get(code) for code in barcodes
+        }
+
+    def put(self, barcode: str, name: str, category_name: Optional[str] = None):
+        self.put_many([BarcodeEntry(barcode, name, category_name)])
+
+    def put_many(self, entries: Iterable[BarcodeEntry], replace: bool = False):
+        # Callers write BarcodeMemory first, so an index that has not been
+        # loaded yet will pick the entries up from the table anyway.
+        with self._lock:
+            if self._memory is None:
+                return
+            for entry in entries:
+                if replace:
+                    self._memory[entry.barcode] = entry
+                else:
+                    self._memory.setdefault(entry.barcode, entry)
+
+    def load_catalog(self, path) -> int:
+        loaded = {entry.barcode: entry for entry in catalog_rows(path)}
+        with self._lock:
+            self._catalog.update(loaded)
+        return len(loaded)
+
+    def reset(self):
+        with self._lock:
+            self._memory = None
+            self._catalog = {}
+
+    def _ensure_loaded(self) -> Dict[str, BarcodeEntry]:
+        memory = self._memory
+        if memory is not None:
+            return memory
+        with self._lock:
+            if self._memory is None:
+                self._memory = self._load_memory()
+                catalog_path = os.environ.get(CATALOG_ENV)
+                if catalog_path and os.path.exists(catalog_path):
+                    for entry in catalog_rows(catalog_path):
+                        self._catalog[entry.barcode] = entry
+            return self._memory
+
+    @staticmethod
+    def _load_memory() -> Dict[str, BarcodeEntry]:
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                BarcodeMemory.barcode, BarcodeMemory.name, BarcodeMemory.category_name
+            ).yield_per(5000)
+            return {row.barcode: BarcodeEntry(*row) for row in rows if row.barcode}
+        finally:
+            db.close()
+
+
+def catalog_rows(path) -> Iterator[BarcodeEntry]:
+    # Catalog files are streamed row by row so large catalogs never sit in
+    # memory twice; only the resulting entries are kept.
+    path = Path(path)
+    if path.suffix in {".ndjson", ".jsonl"}:
+        return _ndjson_rows(path)
+    return _csv_rows(path)
+
+
+def _csv_rows(path: Path) -> Iterator[BarcodeEntry]:
+    with path.open(newline="", encoding="utf-8") as handle:
+        for row in csv.DictReader(handle):
+            barcode = (row.get("barcode") or "").strip()
+            name = (row.get("name") or "").strip()
+            if barcode and name:
+                yield BarcodeEntry(barcode, name, _category(row))
+
+
+def _ndjson_rows(path: Path) -> Iterator[BarcodeEntry]:
+    with path.open(encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            barcode = str(row.get("barcode") or "").strip()
+            name = (row.get("name") or "").strip()
+            if barcode and name:
+                yield BarcodeEntry(barcode, name, _category(row))
+
+
+def _category(row: Dict) -> Optional[str]:
+    return row.get("category_name") or row.get("category") or None
+
+
+barcode_index = BarcodeIndex()
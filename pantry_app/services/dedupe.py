@@ -0,0 +1,313 @@
+"""Duplicate product detection and bulk merge.
+
+Products are created by name from several places, so one pantry can hold
+"Tomato", "tomatoes" and "Tomatoes (can)" side by side. :meth:`find`
+clusters likely duplicates without comparing every pair:
+
+1. Products are grouped by ``normalize_name``. Exact key matches are
+   duplicates outright.
+2. Each distinct key gets a MinHash signature over its character trigrams.
+   Keys sharing any LSH band (``BANDS`` x ``ROWS`` hashes) become candidate
+   pairs. A candidate pair is kept when the trigram Jaccard similarity
+   reaches ``SIMILARITY`` and both keys carry the same numbers, so "size 4
+   nappies" and "size 5 nappies" stay apart. Buckets over ``MAX_BUCKET`` keys are skipped as
+   too generic to be useful.
+3. Matches are joined with union-find. Each cluster is then split by unit
+   dimension (mass, volume, or the count unit itself), since only
+   convertible quantities can be merged.
+
+Signatures are computed once per distinct key, and candidate pairs only
+come from shared buckets, so the work grows with the number of products
+rather than its square.
+
+Detection only proposes clusters. :meth:`merge` applies the ones the user
+accepts, in one transaction, as Core statements:
+
+- quantities and lots are converted into the survivor's unit;
+- shopping items are relinked to the survivor;
+- remembered barcodes are renamed to the survivor's name;
+- the merged products are deleted.
+
+Changes are written to the change log, like bulk imports.
+"""
+import random
+import re
+import zlib
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import bindparam, delete, func, select, update
+
+from pantry_app.events import notify_changes
+from pantry_app.models import BarcodeMemory, Product, ProductLot, ShoppingItem, record_changes
+from pantry_app.services.barcodes import BarcodeEntry, barcode_index
+from pantry_app.sharding import tenant_session
+from pantry_app.utils import UNIT_BASES, convert_quantity, convertible, normalize_name, normalize_unit
+
+BANDS = 8
+ROWS = 2
+SIMILARITY = 0.6
+MAX_BUCKET = 200
+# clusters returned by find(); the largest come first
+MAX_CLUSTERS = 1000
+_MASKS = [random.Random(20240601 + i).getrandbits(32) for i in range(BANDS * ROWS)]
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+class ProductRef(NamedTuple):
+    id: int
+    name: str
+    quantity: float
+    unit: str
+    barcode: Optional[str]
+
+
+def trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def minhash(shingles: Iterable[str]) -> List[int]:
+    hashes = [zlib.crc32(shingle.encode()) for shingle in shingles]
+    return [min(h ^ mask for h in hashes) for mask in _MASKS]
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent: Dict = {}
+
+    def find(self, item):
+        parent = self.parent.setdefault(item, item)
+        if parent != item:
+            parent = self.parent[item] = self.find(parent)
+        return parent
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def unit_dimension(unit: str) -> str:
+    unit = normalize_unit(unit)
+    base = UNIT_BASES.get(unit)
+    return base[0] if base else unit
+
+
+class DuplicateService:
+    def __init__(self, user_id: int):
+        self.db = tenant_session(user_id)
+        self.user_id = user_id
+
+    # detection
+    def find(self, similarity: float = SIMILARITY, max_clusters: int = MAX_CLUSTERS) -> Dict:
+        by_key: Dict[str, List[ProductRef]] = {}
+        rows = self.db.execute(
+            select(Product.id, Product.name, Product.quantity, Product.unit, Product.barcode)
+            .where(Product.user_id == self.user_id)
+            .execution_options(yield_per=5000)
+        )
+        products = 0
+        for row in rows:
+            products += 1
+            key = normalize_name(row.name)
+            if key:
+                by_key.setdefault(key, []).append(ProductRef(row.id, row.name, row.quantity or 0, row.unit or "g", row.barcode))
+
+        keys = sorted(by_key)
+        shingles = [trigrams(key) for key in keys]
+        numbers = [_NUMBER.findall(key) for key in keys]
+        buckets: Dict[Tuple, List[int]] = {}
+        for index, signature in enumerate(minhash(s) for s in shingles):
+            for band in range(BANDS):
+                bucket = (band, *signature[band * ROWS:(band + 1) * ROWS])
+                buckets.setdefault(bucket, []).append(index)
+
+        keys_union = UnionFind()
+        compared, skipped_buckets = set(), 0
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            if len(members) > MAX_BUCKET:
+                skipped_buckets += 1
+                continue
+            for i, a in enumerate(members):
+                for b in members[i + 1:]:
+                    if (a, b) in compared:
+                        continue
+                    compared.add((a, b))
+                    if numbers[a] == numbers[b] and jaccard(shingles[a], shingles[b]) >= similarity:
+                        keys_union.union(a, b)
+
+        groups: Dict[int, List[ProductRef]] = {}
+        for index, key in enumerate(keys):
+            groups.setdefault(keys_union.find(index), []).extend(by_key[key])
+        clusters = []
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            by_dimension: Dict[str, List[ProductRef]] = {}
+            for product in members:
+                by_dimension.setdefault(unit_dimension(product.unit), []).append(product)
+            for same_unit in by_dimension.values():
+                if len(same_unit) > 1:
+                    clusters.append(self._cluster(same_unit))
+        clusters.sort(key=lambda cluster: (-len(cluster["products"]), cluster["survivor"]))
+        return {
+            "products": products,
+            "distinct_keys": len(keys),
+            "candidate_pairs": len(compared),
+            "skipped_buckets": skipped_buckets,
+            "cluster_count": len(clusters),
+            "clusters": clusters[:max_clusters],
+        }
+
+    @staticmethod
+    def _cluster(products: List[ProductRef]) -> Dict:
+        # Keep the product that already has a barcode, else the oldest.
+        products = sorted(products, key=lambda product: (product.barcode is None, product.id))
+        survivor = products[0]
+        return {
+            "survivor": survivor.id,
+            "name": survivor.name,
+            "unit": survivor.unit,
+            "total_quantity": round(
+                sum(convert_quantity(p.quantity, normalize_unit(p.unit), normalize_unit(survivor.unit)) for p in products), 3
+            ),
+            "products": [product._asdict() for product in products],
+        }
+
+    # merge
+    def merge(self, clusters: Sequence[Sequence[int]]) -> Dict:
+        """Merge each ``[survivor_id, duplicate_id, ...]`` group; ids that are
+        not the user's, or whose unit cannot convert, are skipped."""
+        wanted = {int(pid) for cluster in clusters for pid in cluster}
+        if not wanted:
+            return {"clusters": 0, "merged": 0, "skipped": []}
+        self.db.commit()
+        connection = self.db.connection()
+        # Take the write lock before reading: the survivors' quantities are
+        # written back as absolute values, so an edit committed between this
+        # read and the update would be lost. (pysqlite would otherwise BEGIN
+        # at the first UPDATE.)
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        found = {
+            row.id: row
+            for row in connection.execute(
+                select(
+                    Product.id, Product.name, Product.quantity, Product.unit, Product.barcode,
+                    Product.category_id, Product.low_stock_threshold,
+                ).where(Product.user_id == self.user_id, Product.id.in_(wanted))
+            )
+        }
+        survivors, lot_moves, removed, renames, skipped = [], [], {}, {}, []
+        claimed: Set[int] = set()
+        for cluster in clusters:
+            ids = [int(pid) for pid in cluster]
+            if not ids or ids[0] not in found or ids[0] in claimed:
+                skipped.extend(ids)
+                continue
+            keep = found[ids[0]]
+            claimed.add(keep.id)
+            keep_unit = normalize_unit(keep.unit)
+            values = {
+                "_id": keep.id,
+                "quantity": keep.quantity or 0,
+                "low_stock_threshold": keep.low_stock_threshold or 0,
+                "barcode": keep.barcode,
+                "category_id": keep.category_id,
+            }
+            merged_any = False
+            for pid in ids[1:]:
+                other = found.get(pid)
+                if other is None or pid in claimed or not convertible(normalize_unit(other.unit), keep_unit):
+                    skipped.append(pid)
+                    continue
+                claimed.add(pid)
+                factor = convert_quantity(1.0, normalize_unit(other.unit), keep_unit)
+                values["quantity"] += (other.quantity or 0) * factor
+                values["low_stock_threshold"] = max(values["low_stock_threshold"], (other.low_stock_threshold or 0) * factor)
+                values["barcode"] = values["barcode"] or other.barcode
+                values["category_id"] = values["category_id"] or other.category_id
+                lot_moves.append({"_old": pid, "_new": keep.id, "_factor": factor})
+                removed[pid] = keep.id
+                merged_any = True
+                if other.name != keep.name:
+                    renames[other.name.lower()] = keep.name
+            if merged_any:
+                survivors.append(values)
+
+        report = {"clusters": len(survivors), "merged": len(removed), "skipped": skipped}
+        if not removed:
+            self.db.rollback()
+            return {**report, "lots": 0, "shopping_items": 0, "barcodes": 0}
+        try:
+            products = Product.__table__
+            connection.execute(
+                update(products)
+                .where(products.c.id == bindparam("_id"))
+                .values(
+                    quantity=bindparam("quantity"),
+                    low_stock_threshold=bindparam("low_stock_threshold"),
+                    barcode=bindparam("barcode"),
+                    category_id=bindparam("category_id"),
+                ),
+                survivors,
+            )
+            lots = ProductLot.__table__
+            report["lots"] = connection.execute(
+                update(lots)
+                .where(lots.c.product_id == bindparam("_old"))
+                .values(product_id=bindparam("_new"), quantity=lots.c.quantity * bindparam("_factor")),
+                lot_moves,
+            ).rowcount
+            items = ShoppingItem.__table__
+            relinked = connection.execute(
+                select(items.c.id, items.c.linked_product_id).where(
+                    items.c.user_id == self.user_id, items.c.linked_product_id.in_(list(removed))
+                )
+            ).all()
+            if relinked:
+                connection.execute(
+                    update(items).where(items.c.id == bindparam("_id")).values(linked_product_id=bindparam("_new")),
+                    [{"_id": item.id, "_new": removed[item.linked_product_id]} for item in relinked],
+                )
+            report["shopping_items"] = len(relinked)
+            connection.execute(delete(products).where(products.c.id.in_(list(removed))))
+            record_changes(
+                connection,
+                [(self.user_id, "products", values["_id"], "upsert") for values in survivors]
+                + [(self.user_id, "products", pid, "delete") for pid in removed]
+                + [(self.user_id, "shopping_items", item.id, "upsert") for item in relinked],
+            )
+            renamed = self._rename_barcodes(renames)
+            report["barcodes"] = len(renamed)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        barcode_index.put_many(renamed, replace=True)
+        notify_changes()
+        return report
+
+    def _rename_barcodes(self, renames: Dict[str, str]) -> List[BarcodeEntry]:
+        if not renames:
+            return []
+        # barcode_memory is shared and may live in another database; the
+        # session routes the connection by mapper.
+        connection = self.db.connection(bind_arguments={"mapper": BarcodeMemory})
+        memory = BarcodeMemory.__table__
+        rows = connection.execute(
+            select(memory.c.id, memory.c.barcode, memory.c.name, memory.c.category_name).where(
+                memory.c.user_id == self.user_id, func.lower(memory.c.name).in_(list(renames))
+            )
+        ).all()
+        if rows:
+            connection.execute(
+                update(memory).where(memory.c.id == bindparam("_id")).values(name=bindparam("name")),
+                [{"_id": row.id, "name": renames[row.name.lower()]} for row in rows],
+            )
+        return [BarcodeEntry(row.barcode, renames[row.name.lower()], row.category_name) for row in rows]
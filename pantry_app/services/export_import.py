@@ -1,3 +1,4 @@
+import datetime as dt
 import json
 from typing import Dict
 
@@ -6,28 +7,67 @@ from pantry_app.models import (
     Category,
     CookedRecipe,
     Product,
+    ProductLot,
     SavedRecipe,
-    SessionLocal,
     ShoppingItem,
+    store_recipe_version,
 )
-from pantry_app.utils import serialize_json
+from pantry_app.read_models import ExportCooked, ExportProduct, ExportReader, ExportRecipe, ExportVersion
+from pantry_app.services.barcodes import barcode_index
+from pantry_app.services.history import HistoryService
+from pantry_app.sharding import tenant_session
+from pantry_app.snapshot import read_snapshot, write_snapshot
+from pantry_app.utils import parse_date, serialize_json
 
 
 class ExportImportService:
-    def __init__(self, user_id: int):
-        self.db = SessionLocal()
+    def __init__(self, user_id: int, db=None):
+        self.db = db or tenant_session(user_id)
         self.user_id = user_id
 
     def export_all(self) -> Dict:
+        # Cooked entries reference their recipe by content hash; each recipe's
+        # content is written once under "recipes". Tables are read as column
+        # rows (see pantry_app.read_models), with category names and recipe
+        # hashes joined in, so no entity or lazy load is created per row.
+        reader = ExportReader(self.db, self.user_id)
+        cooked = list(reader.cooked())
+        used = {rec.recipe_version_id for rec in cooked if rec.ingredients is None}
+        lots = {}
+        for lot in reader.lots():
+            lots.setdefault(lot.product_id, []).append(lot)
         return {
-            "products": [self._product_dict(p) for p in self._products()],
-            "categories": [self._category_dict(c) for c in self._categories()],
-            "saved_recipes": [self._saved_dict(r) for r in self._saved()],
-            "cooked_recipes": [self._cooked_dict(r) for r in self._cooked()],
-            "shopping_items": [self._shopping_dict(i) for i in self._shopping()],
-            "barcode_memory": [self._barcode_dict(b) for b in self._barcode()],
+            "products": [self._product_dict(p, lots.get(p.id)) for p in reader.products()],
+            "categories": [{"name": name} for name in reader.categories()],
+            "saved_recipes": [self._saved_dict(r) for r in reader.saved()],
+            "recipes": [
+                self._version_dict(v) for v in sorted(reader.versions(), key=lambda v: v.id) if v.id in used
+            ],
+            "cooked_recipes": [self._cooked_dict(r) for r in cooked],
+            "shopping_items": [i._asdict() for i in reader.shopping()],
+            "barcode_memory": [b._asdict() for b in reader.barcodes()],
         }
 
+    def export_snapshot(self) -> Dict:
+        """Export inside one read transaction so every table is read as of
+        the same moment, even while other requests keep writing."""
+        self.db.commit()
+        self.db.connection().exec_driver_sql("BEGIN")
+        try:
+            data = self.export_all()
+        finally:
+            self.db.rollback()
+        data["snapshot_at"] = dt.datetime.utcnow().isoformat(timespec="seconds")
+        return data
+
+    def export_binary(self, path) -> Dict:
+        """Write a consistent snapshot to ``path`` in the compact binary
+        format (see ``pantry_app.snapshot``) and return its metadata."""
+        return write_snapshot(self.export_snapshot(), path)
+
+    def import_binary(self, path):
+        self.import_data(read_snapshot(path))
+
     def import_data(self, payload: Dict):
         # merge: overwrite by name where possible
         for cat in payload.get("categories", []):
@@ -62,18 +102,26 @@ class ExportImportService:
                 existing.category_id = category_id or existing.category_id
                 existing.notes = prod.get("notes", existing.notes)
             else:
-                self.db.add(
-                    Product(
-                        name=prod.get("name"),
-                        quantity=prod.get("quantity", 0),
-                        unit=prod.get("unit", "g"),
-                        low_stock_threshold=prod.get("low_stock_threshold", 0),
-                        location=prod.get("location", "pantry"),
-                        category_id=category_id,
-                        notes=prod.get("notes", ""),
+                existing = Product(
+                    name=prod.get("name"),
+                    quantity=prod.get("quantity", 0),
+                    unit=prod.get("unit", "g"),
+                    low_stock_threshold=prod.get("low_stock_threshold", 0),
+                    location=prod.get("location", "pantry"),
+                    category_id=category_id,
+                    notes=prod.get("notes", ""),
+                    user_id=self.user_id,
+                )
+                self.db.add(existing)
+            if prod.get("lots"):
+                existing.lots = [
+                    ProductLot(
+                        quantity=lot.get("quantity", 0),
+                        expires_on=parse_date(lot.get("expires_on")),
                         user_id=self.user_id,
                     )
-                )
+                    for lot in prod["lots"]
+                ]
         self.db.commit()
 
         for rec in payload.get("saved_recipes", []):
@@ -94,28 +142,45 @@ class ExportImportService:
                 )
         self.db.commit()
 
+        recipes = {rec.get("hash"): rec for rec in payload.get("recipes", []) if rec.get("hash")}
+        version_ids = {}
         for rec in payload.get("cooked_recipes", []):
             cooked_at = rec.get("cooked_at")
             if isinstance(cooked_at, str):
                 try:
-                    import datetime as dt
-
                     cooked_at = dt.datetime.fromisoformat(cooked_at)
                 except Exception:
                     cooked_at = None
-            self.db.add(
-                CookedRecipe(
+            content = recipes.get(rec.get("recipe"))
+            if content is None:
+                # older exports carry the recipe inline on every entry
+                cooked = CookedRecipe(
                     name=rec.get("name"),
                     ingredients=serialize_json(rec.get("ingredients", [])),
                     instructions=rec.get("instructions", ""),
                     tags=serialize_json(rec.get("tags", [])),
-                    servings=rec.get("servings", 1),
-                    cooked_at=cooked_at,
-                    rating=rec.get("rating"),
-                    user_id=self.user_id,
                 )
-            )
+            else:
+                version_id = version_ids.get(rec["recipe"])
+                if version_id is None:
+                    version_id = version_ids[rec["recipe"]] = store_recipe_version(
+                        self.db.connection(),
+                        self.user_id,
+                        content.get("name"),
+                        content.get("ingredients", []),
+                        content.get("instructions", ""),
+                        content.get("tags", []),
+                        content.get("servings", 1),
+                    )
+                cooked = CookedRecipe(name=rec.get("name") or content.get("name"), recipe_version_id=version_id)
+            cooked.servings = rec.get("servings", 1)
+            cooked.cooked_at = cooked_at
+            cooked.rating = rec.get("rating")
+            cooked.user_id = self.user_id
+            self.db.add(cooked)
         self.db.commit()
+        if payload.get("cooked_recipes"):
+            HistoryService(self.user_id, db=self.db).rebuild()
 
         for item in payload.get("shopping_items", []):
             self.db.add(
@@ -129,6 +194,7 @@ class ExportImportService:
             )
         self.db.commit()
 
+        added_barcodes = []
         for mem in payload.get("barcode_memory", []):
             if not self.db.query(BarcodeMemory).filter_by(barcode=mem.get("barcode")).first():
                 self.db.add(
@@ -139,72 +205,64 @@ class ExportImportService:
                         user_id=self.user_id,
                     )
                 )
+                added_barcodes.append(mem)
         self.db.commit()
+        for mem in added_barcodes:
+            barcode_index.put(mem.get("barcode"), mem.get("name"), mem.get("category_name"))
 
     # helpers
-    def _products(self):
-        return self.db.query(Product).filter_by(user_id=self.user_id).all()
-
-    def _categories(self):
-        return self.db.query(Category).filter_by(user_id=self.user_id).all()
-
-    def _saved(self):
-        return self.db.query(SavedRecipe).filter_by(user_id=self.user_id).all()
-
-    def _cooked(self):
-        return self.db.query(CookedRecipe).filter_by(user_id=self.user_id).all()
-
-    def _shopping(self):
-        return self.db.query(ShoppingItem).filter_by(user_id=self.user_id).all()
-
-    def _barcode(self):
-        return self.db.query(BarcodeMemory).filter_by(user_id=self.user_id).all()
-
-    def _product_dict(self, prod: Product):
-        return {
+    def _product_dict(self, prod: ExportProduct, lots=None):
+        data = {
             "name": prod.name,
             "quantity": prod.quantity,
             "unit": prod.unit,
             "low_stock_threshold": prod.low_stock_threshold,
             "location": prod.location,
-            "category": prod.category.name if prod.category else None,
+            "category": prod.category,
             "notes": prod.notes,
         }
+        if lots:
+            data["lots"] = [
+                {
+                    "quantity": lot.quantity,
+                    "expires_on": lot.expires_on.isoformat() if lot.expires_on else None,
+                }
+                for lot in lots
+            ]
+        return data
 
-    def _category_dict(self, cat: Category):
-        return {"name": cat.name}
-
-    def _saved_dict(self, rec: SavedRecipe):
-        return {
-            "name": rec.name,
-            "ingredients": json.loads(rec.ingredients),
-            "instructions": rec.instructions,
-            "tags": json.loads(rec.tags),
-            "servings": rec.servings,
-        }
-
-    def _cooked_dict(self, rec: CookedRecipe):
+    def _saved_dict(self, rec: ExportRecipe):
         return {
             "name": rec.name,
             "ingredients": json.loads(rec.ingredients),
             "instructions": rec.instructions,
             "tags": json.loads(rec.tags),
             "servings": rec.servings,
-            "cooked_at": rec.cooked_at.isoformat() if rec.cooked_at else None,
-            "rating": rec.rating,
         }
 
-    def _shopping_dict(self, item: ShoppingItem):
-        return {
-            "name": item.name,
-            "quantity": item.quantity,
-            "unit": item.unit,
-            "status": item.status,
-        }
+    def _cooked_dict(self, rec: ExportCooked):
+        data = {"name": rec.name}
+        if rec.ingredients is None and rec.content_hash is not None:
+            data["recipe"] = rec.content_hash
+        else:
+            data.update(
+                ingredients=json.loads(rec.ingredients or "[]"),
+                instructions=rec.instructions,
+                tags=json.loads(rec.tags or "[]"),
+            )
+        data.update(
+            servings=rec.servings,
+            cooked_at=rec.cooked_at.isoformat() if rec.cooked_at else None,
+            rating=rec.rating,
+        )
+        return data
 
-    def _barcode_dict(self, mem: BarcodeMemory):
+    def _version_dict(self, version: ExportVersion):
         return {
-            "barcode": mem.barcode,
-            "name": mem.name,
-            "category_name": mem.category_name,
+            "hash": version.content_hash,
+            "name": version.name,
+            "ingredients": json.loads(version.ingredients),
+            "instructions": version.instructions,
+            "tags": json.loads(version.tags),
+            "servings": version.servings,
         }
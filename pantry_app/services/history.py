@@ -0,0 +1,240 @@
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, select, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from pantry_app.models import CookedRecipe, CookingStat, RecipeVersion
+from pantry_app.read_models import COOKED_COLUMNS, CookedRow, read
+from pantry_app.sharding import tenant_session
+
+WEEK_FORMAT = "%G-W%V"
+# written by rebuild(); rollups without it predate the backfill
+BACKFILLED = {"kind": "meta", "key": "backfilled"}
+
+
+class HistoryPage:
+    def __init__(self, items: List[CookedRow], page: int, per_page: int, total: int):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+
+    @property
+    def pages(self) -> int:
+        return max(1, math.ceil(self.total / self.per_page))
+
+    @property
+    def has_prev(self) -> bool:
+        return self.page > 1
+
+    @property
+    def has_next(self) -> bool:
+        return self.page < self.pages
+
+
+def history_stmts(user_id: int, page: int, per_page: int):
+    """(count, items) queries for one history page; items are
+    :class:`CookedRow` columns. Shared by HistoryService and the async read
+    API."""
+    count = select(func.count(CookedRecipe.id)).where(CookedRecipe.user_id == user_id)
+    items = (
+        select(*COOKED_COLUMNS)
+        .where(CookedRecipe.user_id == user_id)
+        .order_by(CookedRecipe.cooked_at.desc(), CookedRecipe.id.desc())
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+    )
+    return count, items
+
+
+class HistoryService:
+    def __init__(self, user_id: int, db=None):
+        self.db = db or tenant_session(user_id)
+        self.user_id = user_id
+
+    def page(self, page: int = 1, per_page: int = 25) -> HistoryPage:
+        page = max(page, 1)
+        count, items = history_stmts(self.user_id, page, per_page)
+        total = self.db.execute(count).scalar()
+        return HistoryPage(read(self.db, items, CookedRow), page, per_page, total)
+
+    # rollup maintenance
+    def record_cook(self, cooked: CookedRecipe):
+        rows = [
+            {
+                "user_id": self.user_id,
+                "kind": kind,
+                "key": key,
+                "cook_count": 1,
+                "rating_sum": cooked.rating or 0,
+                "rating_count": 0 if cooked.rating is None else 1,
+            }
+            for kind, key in self.stat_keys(cooked, include_week=True)
+        ]
+        self._upsert(rows)
+
+    def record_rating(self, cooked: CookedRecipe, previous: Optional[int]):
+        sum_delta = (cooked.rating or 0) - (previous or 0)
+        count_delta = (cooked.rating is not None) - (previous is not None)
+        if not sum_delta and not count_delta:
+            return
+        keys = list(self.stat_keys(cooked, include_week=False))
+        self.db.query(CookingStat).filter(
+            CookingStat.user_id == self.user_id,
+            tuple_(CookingStat.kind, CookingStat.key).in_(keys),
+        ).update(
+            {
+                CookingStat.rating_sum: CookingStat.rating_sum + sum_delta,
+                CookingStat.rating_count: CookingStat.rating_count + count_delta,
+            },
+            synchronize_session=False,
+        )
+
+    def record_uncook(self, cooked: CookedRecipe):
+        """Take a cooked entry that is about to be deleted out of the rollups."""
+        keys = list(self.stat_keys(cooked, include_week=True))
+        if not keys:
+            return
+        rated = cooked.rating is not None
+        stats = self.db.query(CookingStat).filter(
+            CookingStat.user_id == self.user_id,
+            tuple_(CookingStat.kind, CookingStat.key).in_(keys),
+        )
+        stats.update(
+            {
+                CookingStat.cook_count: CookingStat.cook_count - 1,
+                # weeks never carry ratings; see rebuild()
+                CookingStat.rating_sum: CookingStat.rating_sum
+                - case((CookingStat.kind == "week", 0), else_=cooked.rating or 0),
+                CookingStat.rating_count: CookingStat.rating_count
+                - case((CookingStat.kind == "week", 0), else_=int(rated)),
+            },
+            synchronize_session=False,
+        )
+        stats.filter(CookingStat.cook_count <= 0).delete(synchronize_session=False)
+
+    def rebuild(self):
+        self.db.query(CookingStat).filter_by(user_id=self.user_id).delete()
+        totals: Dict[Tuple[str, str], List[int]] = {}
+        # Held so each row's many-to-one version resolves from the identity
+        # map instead of one query per cooked row.
+        versions = self.db.query(RecipeVersion).filter_by(user_id=self.user_id).all()
+        cooked_rows = (
+            self.db.query(CookedRecipe)
+            .filter_by(user_id=self.user_id)
+            .yield_per(1000)
+        )
+        for cooked in cooked_rows:
+            for key in self.stat_keys(cooked, include_week=True):
+                entry = totals.setdefault(key, [0, 0, 0])
+                entry[0] += 1
+                if cooked.rating is not None and key[0] != "week":
+                    entry[1] += cooked.rating
+                    entry[2] += 1
+        self.db.bulk_insert_mappings(
+            CookingStat,
+            [
+                {
+                    "user_id": self.user_id,
+                    "kind": kind,
+                    "key": key,
+                    "cook_count": count,
+                    "rating_sum": rating_sum,
+                    "rating_count": rating_count,
+                }
+                for (kind, key), (count, rating_sum, rating_count) in totals.items()
+            ]
+            + [{"user_id": self.user_id, **BACKFILLED}],
+        )
+        self.db.commit()
+
+    # statistics
+    def stats(self, limit: int = 10, weeks: int = 12) -> Dict:
+        self.ensure_rollups()
+        return {
+            "total_cooks": self._total_cooks(),
+            "cooks_per_week": [
+                {"week": row.key, "count": row.cook_count}
+                for row in self._stat_rows("week", weeks, order_by=CookingStat.key.desc())
+            ],
+            "recipes": [
+                {
+                    "name": row.key,
+                    "cook_count": row.cook_count,
+                    "average_rating": self._average(row),
+                }
+                for row in self._stat_rows("recipe", limit)
+            ],
+            "top_ingredients": [
+                {"name": row.key, "count": row.cook_count}
+                for row in self._stat_rows("ingredient", limit)
+            ],
+            "top_tags": [
+                {"tag": row.key, "count": row.cook_count}
+                for row in self._stat_rows("tag", limit)
+            ],
+        }
+
+    def _total_cooks(self) -> int:
+        return (
+            self.db.query(func.coalesce(func.sum(CookingStat.cook_count), 0))
+            .filter_by(user_id=self.user_id, kind="week")
+            .scalar()
+        )
+
+    def _stat_rows(self, kind: str, limit: int, order_by=None):
+        return (
+            self.db.query(CookingStat)
+            .filter_by(user_id=self.user_id, kind=kind)
+            .order_by(order_by if order_by is not None else CookingStat.cook_count.desc())
+            .limit(limit)
+            .all()
+        )
+
+    def ensure_rollups(self):
+        # Rebuild once per user. Rows record_cook added since an upgrade only
+        # count the new cooks, so their presence alone doesn't mean the
+        # older history has been rolled up.
+        backfilled = self.db.query(
+            self.db.query(CookingStat.id).filter_by(user_id=self.user_id, **BACKFILLED).exists()
+        ).scalar()
+        if not backfilled:
+            self.rebuild()
+
+    def _upsert(self, rows: List[Dict]):
+        if not rows:
+            return
+        stmt = sqlite_insert(CookingStat.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "kind", "key"],
+            set_={
+                "cook_count": CookingStat.cook_count + stmt.excluded.cook_count,
+                "rating_sum": CookingStat.rating_sum + stmt.excluded.rating_sum,
+                "rating_count": CookingStat.rating_count + stmt.excluded.rating_count,
+            },
+        )
+        self.db.execute(stmt, rows)
+
+    @staticmethod
+    def _average(row: CookingStat) -> Optional[float]:
+        if not row.rating_count:
+            return None
+        return round(row.rating_sum / row.rating_count, 2)
+
+    @staticmethod
+    def stat_keys(cooked: CookedRecipe, include_week: bool) -> Iterable[Tuple[str, str]]:
+        if include_week and cooked.cooked_at:
+            yield "week", cooked.cooked_at.strftime(WEEK_FORMAT)
+        yield "recipe", cooked.name
+        seen = set()
+        for ing in cooked.ingredient_list():
+            name = (ing.get("name") or "").strip().lower() if isinstance(ing, dict) else ""
+            if name and ("ingredient", name) not in seen:
+                seen.add(("ingredient", name))
+                yield "ingredient", name
+        for tag in cooked.tag_list():
+            if tag and ("tag", tag) not in seen:
+                seen.add(("tag", tag))
+                yield "tag", tag
+
@@ -0,0 +1,365 @@
+"""Streaming CSV ingest for stocktake exports.
+
+Rows flow through generator stages (read -> map columns -> validate and
+normalize) and are written in batches with Core statements inside one
+transaction. Memory is bounded by one batch plus the user's existing product
+names and the barcodes seen, not by the length of the file. Invalid rows
+are skipped and reported by line number.
+"""
+import csv
+import io
+import itertools
+import re
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.dialects.sqlite import insert
+
+from pantry_app.events import notify_changes
+from pantry_app.models import BarcodeMemory, Category, Product, record_changes, trim_lots
+from pantry_app.services.barcodes import BarcodeEntry, barcode_index
+from pantry_app.sharding import tenant_session
+from pantry_app.utils import convert_quantity, convertible, normalize_name, normalize_unit
+
+BATCH_SIZE = 2_000
+MAX_ERRORS = 1_000
+LOCATIONS = {"pantry", "fridge", "freezer"}
+
+# Canonical field -> header spellings accepted without an explicit mapping.
+COLUMN_ALIASES = {
+    "name": ("name", "product", "item", "description"),
+    "quantity": ("quantity", "qty", "amount", "count", "stock"),
+    "unit": ("unit", "units", "uom"),
+    "category": ("category", "category_name", "group"),
+    "location": ("location", "storage", "place"),
+    "low_stock_threshold": ("low_stock_threshold", "threshold", "minimum", "min", "reorder_level"),
+    "barcode": ("barcode", "ean", "upc", "gtin"),
+    "notes": ("notes", "note", "comment", "comments"),
+}
+QUANTITY_WITH_UNIT = re.compile(r"^\s*([-+]?\d+(?:[.,]\d+)?)\s*([^\d\s].*)?$")
+
+
+class IngestRow(NamedTuple):
+    line: int
+    name: str
+    key: str
+    quantity: float
+    unit: Optional[str]
+    category: Optional[str]
+    location: Optional[str]
+    low_stock_threshold: Optional[float]
+    barcode: Optional[str]
+    notes: Optional[str]
+
+
+class IngestError(NamedTuple):
+    line: int
+    message: str
+
+
+def read_csv(stream: Union[io.IOBase, Iterable[str]]) -> Iterator[List[str]]:
+    """Yield raw CSV records, sniffing ``,``/``;``/tab from the header line."""
+    if hasattr(stream, "read") and not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    lines = iter(stream)
+    header = next(lines, "")
+    delimiter = max(",;\t", key=header.count)
+    return csv.reader(itertools.chain([header], lines), delimiter=delimiter)
+
+
+def resolve_columns(header: List[str], mapping: Optional[Dict[str, str]] = None) -> Dict[str, int]:
+    """Map canonical fields to column positions.
+
+    ``mapping`` maps a field to the header it lives under in this file and
+    takes precedence over the built-in aliases.
+    """
+    positions = {title.strip().lower(): index for index, title in enumerate(header)}
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        wanted = (mapping or {}).get(field)
+        candidates = (wanted,) if wanted else aliases
+        for candidate in candidates:
+            index = positions.get(candidate.strip().lower())
+            if index is not None:
+                columns[field] = index
+                break
+    if "name" not in columns:
+        raise ValueError("CSV needs a name column (or a mapping for it)")
+    return columns
+
+
+def parse_number(text: str) -> Optional[float]:
+    text = (text or "").strip().replace(",", ".")
+    if not text:
+        return None
+    return float(text)
+
+
+def validate(records: Iterator[List[str]], columns: Dict[str, int]) -> Iterator[Union[IngestRow, IngestError]]:
+    def cell(record, field):
+        index = columns.get(field)
+        if index is None or index >= len(record):
+            return ""
+        return record[index].strip()
+
+    for line, record in enumerate(records, start=2):
+        if not any(value.strip() for value in record):
+            continue
+        name = cell(record, "name")
+        if not name:
+            yield IngestError(line, "missing name")
+            continue
+        unit = normalize_unit(cell(record, "unit")) or None
+        raw_quantity = cell(record, "quantity")
+        match = QUANTITY_WITH_UNIT.match(raw_quantity)
+        if raw_quantity and not match:
+            yield IngestError(line, f"invalid quantity {raw_quantity!r}")
+            continue
+        quantity = float(match.group(1).replace(",", ".")) if match else 0.0
+        if match and match.group(2) and not unit:
+            unit = normalize_unit(match.group(2))
+        if quantity < 0:
+            yield IngestError(line, "quantity cannot be negative")
+            continue
+        try:
+            threshold = parse_number(cell(record, "low_stock_threshold"))
+        except ValueError:
+            yield IngestError(line, "invalid low stock threshold")
+            continue
+        location = cell(record, "location").lower() or None
+        if location and location not in LOCATIONS:
+            yield IngestError(line, f"unknown location {location!r}")
+            continue
+        yield IngestRow(
+            line=line,
+            name=name,
+            key=normalize_name(name),
+            quantity=quantity,
+            unit=unit,
+            category=cell(record, "category") or None,
+            location=location,
+            low_stock_threshold=threshold,
+            barcode=cell(record, "barcode") or None,
+            notes=cell(record, "notes") or None,
+        )
+
+
+class IngestService:
+    def __init__(self, user_id: int, db=None):
+        self.db = db or tenant_session(user_id)
+        self.user_id = user_id
+
+    def ingest_csv(
+        self,
+        stream,
+        mapping: Optional[Dict[str, str]] = None,
+        mode: str = "set",
+        dry_run: bool = False,
+    ) -> Dict:
+        """Import a stocktake CSV.
+
+        ``mode="set"`` treats quantities as counted stock and overwrites
+        matching products; ``mode="add"`` adds them (a delivery). Rows match
+        existing products by normalized name, converting to the product's
+        unit where possible.
+        """
+        started = time.perf_counter()
+        report = {
+            "rows": 0,
+            "inserted": 0,
+            "updated": 0,
+            "errors": [],
+            "error_count": 0,
+            "categories_created": [],
+            "barcodes_remembered": 0,
+            "dry_run": dry_run,
+        }
+        records = read_csv(stream)
+        columns = resolve_columns(next(records, []), mapping)
+
+        self.db.commit()
+        connection = self.db.connection()
+        # Take the write lock before reading: new product ids are matched to
+        # rows by insert order below, which is only safe if nobody else can
+        # insert in between. (pysqlite would otherwise BEGIN at the first
+        # INSERT.)
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        self._products = {
+            normalize_name(row.name): (row.id, row.unit)
+            for row in connection.execute(
+                select(Product.id, Product.name, Product.unit).where(Product.user_id == self.user_id)
+            )
+        }
+        self._categories = {
+            row.name.lower(): row.id
+            for row in connection.execute(
+                select(Category.id, Category.name).where(Category.user_id == self.user_id)
+            )
+        }
+        self._new_barcodes = {}
+        try:
+            batch: Dict[str, IngestRow] = {}
+            for item in validate(records, columns):
+                report["rows"] += 1
+                if isinstance(item, IngestError):
+                    report["error_count"] += 1
+                    if len(report["errors"]) < MAX_ERRORS:
+                        report["errors"].append(item._asdict())
+                    continue
+                pending = batch.get(item.key)
+                batch[item.key] = self._merge_duplicate(pending, item, mode) if pending else item
+                if len(batch) >= BATCH_SIZE:
+                    self._write_batch(connection, batch.values(), mode, report)
+                    batch = {}
+            if batch:
+                self._write_batch(connection, batch.values(), mode, report)
+            report["barcodes_remembered"] = self._remember_barcodes()
+            if dry_run:
+                self.db.rollback()
+            else:
+                self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        if not dry_run:
+            if report["inserted"] or report["updated"]:
+                notify_changes()
+            barcode_index.put_many(
+                BarcodeEntry(barcode, name, category)
+                for barcode, (name, category) in self._new_barcodes.items()
+            )
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        return report
+
+    def _merge_duplicate(self, first: IngestRow, second: IngestRow, mode: str) -> IngestRow:
+        # The same product twice in one file: later fields win, and in "add"
+        # mode the quantities accumulate.
+        quantity = second.quantity
+        unit = second.unit or first.unit
+        if mode == "add" and convertible(second.unit or unit, first.unit or unit):
+            quantity = first.quantity + convert_quantity(second.quantity, second.unit or unit, unit)
+        return second._replace(
+            quantity=quantity,
+            unit=unit,
+            category=second.category or first.category,
+            location=second.location or first.location,
+            low_stock_threshold=(
+                second.low_stock_threshold
+                if second.low_stock_threshold is not None
+                else first.low_stock_threshold
+            ),
+            barcode=second.barcode or first.barcode,
+            notes=second.notes or first.notes,
+        )
+
+    def _category_id(self, connection, name: Optional[str], report: Dict) -> Optional[int]:
+        if not name:
+            return None
+        category_id = self._categories.get(name.lower())
+        if category_id is None:
+            result = connection.execute(
+                Category.__table__.insert().values(name=name, user_id=self.user_id)
+            )
+            category_id = result.inserted_primary_key[0]
+            self._categories[name.lower()] = category_id
+            record_changes(connection, [(self.user_id, "categories", category_id, "upsert")])
+            report["categories_created"].append(name)
+        return category_id
+
+    def _write_batch(self, connection, rows: Iterable[IngestRow], mode: str, report: Dict):
+        table = Product.__table__
+        inserts = []
+        insert_keys = []
+        updates: Dict[tuple, List[Dict]] = {}
+        for row in rows:
+            category_id = self._category_id(connection, row.category, report)
+            existing = self._products.get(row.key)
+            if row.barcode:
+                self._new_barcodes.setdefault(row.barcode, (row.name, row.category))
+            if existing is None:
+                insert_keys.append(row.key)
+                inserts.append(
+                    {
+                        "name": row.name,
+                        "quantity": row.quantity,
+                        "unit": row.unit or "units",
+                        "low_stock_threshold": row.low_stock_threshold or 0,
+                        "category_id": category_id,
+                        "location": row.location or "pantry",
+                        "notes": row.notes or "",
+                        "barcode": row.barcode,
+                        "user_id": self.user_id,
+                    }
+                )
+                continue
+            product_id, product_unit = existing
+            values = {
+                "_id": product_id,
+                "quantity": convert_quantity(row.quantity, row.unit or product_unit, product_unit),
+            }
+            for field, value in (
+                ("category_id", category_id),
+                ("location", row.location),
+                ("low_stock_threshold", row.low_stock_threshold),
+                ("notes", row.notes),
+                ("barcode", row.barcode),
+            ):
+                if value is not None:
+                    values[field] = value
+            updates.setdefault(tuple(sorted(values)), []).append(values)
+
+        changed = []
+        if inserts:
+            before = connection.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar()
+            connection.execute(table.insert(), inserts)
+            # ingest_csv holds the write lock (BEGIN IMMEDIATE), so the new
+            # ids are ours and follow the insert order.
+            new_ids = connection.execute(
+                select(table.c.id)
+                .where(table.c.id > before, table.c.user_id == self.user_id)
+                .order_by(table.c.id)
+            ).scalars().all()
+            if len(new_ids) != len(inserts):
+                raise RuntimeError("products were inserted concurrently with a CSV import")
+            for key, values, product_id in zip(insert_keys, inserts, new_ids):
+                self._products[key] = (product_id, values["unit"])
+            changed.extend(new_ids)
+            report["inserted"] += len(inserts)
+        for keys, params in updates.items():
+            quantity = bindparam("quantity")
+            statement = table.update().where(
+                table.c.id == bindparam("_id"), table.c.user_id == self.user_id
+            ).values(
+                {
+                    key: (table.c.quantity + quantity if mode == "add" else quantity)
+                    if key == "quantity"
+                    else bindparam(key)
+                    for key in keys
+                    if key != "_id"
+                }
+            )
+            connection.execute(statement, params)
+            changed.extend(values["_id"] for values in params)
+            report["updated"] += len(params)
+        if updates:
+            # Core updates skip the ORM hook that uses up lots when stock
+            # goes down; trim them here.
+            trim_lots(connection, [values["_id"] for params in updates.values() for values in params])
+        record_changes(connection, [(self.user_id, "products", pid, "upsert") for pid in changed])
+
+    def _remember_barcodes(self) -> int:
+        if not self._new_barcodes:
+            return 0
+        # barcode_memory is shared and may live in another database than the
+        # tenant's products; the session routes the connection by mapper.
+        connection = self.db.connection(bind_arguments={"mapper": BarcodeMemory})
+        statement = insert(BarcodeMemory.__table__).on_conflict_do_nothing(index_elements=["barcode"])
+        rows = [
+            {"barcode": barcode, "name": name, "category_name": category, "user_id": self.user_id}
+            for barcode, (name, category) in self._new_barcodes.items()
+        ]
+        remembered = 0
+        for start in range(0, len(rows), BATCH_SIZE):
+            remembered += connection.execute(statement, rows[start : start + BATCH_SIZE]).rowcount
+        return remembered
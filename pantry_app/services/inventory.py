@@ -1,11 +1,98 @@
-from typing import List, Optional
+import datetime as dt
+from typing import Dict, Iterable, List, NamedTuple, Optional
 
-from pantry_app.models import BarcodeMemory, Category, Product, SessionLocal
+from sqlalchemy import func, select
+
+from pantry_app.models import BarcodeMemory, Category, Product, ProductLot
+from pantry_app.read_models import PRODUCT_COLUMNS, ProductRow, read
+from pantry_app.services.barcodes import BarcodeEntry, barcode_index
+from pantry_app.sharding import tenant_session
+from pantry_app.utils import convert_quantity
+
+EXPIRING_DAYS = 3
+
+
+class ExpiringLot(NamedTuple):
+    lot_id: int
+    product_id: int
+    name: str
+    quantity: float
+    unit: str
+    location: str
+    expires_on: dt.date
+    days_left: int
+
+
+def expiring_lots(
+    db, user_id: int, days: int = EXPIRING_DAYS, today: Optional[dt.date] = None, limit: Optional[int] = None
+) -> List[ExpiringLot]:
+    """Lots expiring within ``days`` (already expired ones included), soonest
+    first, at most ``limit``. A range scan on (user_id, expires_on); the rest
+    of the inventory is not read."""
+    today = today or dt.date.today()
+    query = (
+        db.query(
+            ProductLot.id,
+            ProductLot.product_id,
+            ProductLot.quantity,
+            ProductLot.expires_on,
+            Product.name,
+            Product.unit,
+            Product.location,
+        )
+        .join(Product, Product.id == ProductLot.product_id)
+        .filter(
+            ProductLot.user_id == user_id,
+            ProductLot.expires_on.isnot(None),
+            ProductLot.expires_on <= today + dt.timedelta(days=days),
+            ProductLot.quantity > 0,
+        )
+        .order_by(ProductLot.expires_on, ProductLot.id)
+    )
+    rows = query.limit(limit).all() if limit else query.all()
+    return [
+        ExpiringLot(
+            lot_id=row.id,
+            product_id=row.product_id,
+            name=row.name,
+            quantity=row.quantity,
+            unit=row.unit,
+            location=row.location,
+            expires_on=row.expires_on,
+            days_left=(row.expires_on - today).days,
+        )
+        for row in rows
+    ]
+
+
+def products_stmt(
+    user_id: int,
+    location: Optional[str] = None,
+    category_id: Optional[int] = None,
+    low_stock: bool = False,
+    columns: tuple = PRODUCT_COLUMNS,
+):
+    """The product listing query, shared by InventoryService and the async
+    read API. Selects ``columns`` (Category columns allowed) rather than
+    Product entities; the default matches :class:`ProductRow`."""
+    stmt = (
+        select(*columns)
+        .select_from(Product)
+        .outerjoin(Category, Category.id == Product.category_id)
+        .where(Product.user_id == user_id)
+    )
+    if location:
+        stmt = stmt.where(Product.location == location)
+    if category_id:
+        stmt = stmt.where(Product.category_id == category_id)
+    if low_stock:
+        stmt = stmt.where(Product.quantity <= Product.low_stock_threshold)
+    return stmt
 
 
 class InventoryService:
     def __init__(self, user_id: int):
-        self.db = SessionLocal()
+        self.db = tenant_session(user_id)
         self.user_id = user_id
 
     def categories(self) -> List[Category]:
@@ -26,6 +113,7 @@ class InventoryService:
         location: str,
         notes: str = "",
         barcode: Optional[str] = None,
+        expires_on: Optional[dt.date] = None,
     ) -> Product:
         product = Product(
             name=name,
@@ -38,6 +126,8 @@ class InventoryService:
             barcode=barcode,
             user_id=self.user_id,
         )
+        if expires_on and quantity > 0:
+            product.lots.append(ProductLot(quantity=quantity, expires_on=expires_on, user_id=self.user_id))
         self.db.add(product)
         self.db.commit()
         if barcode:
@@ -56,18 +146,57 @@ class InventoryService:
                     )
                 )
                 self.db.commit()
+                barcode_index.put(barcode, name, category_name)
         return product
 
-    def update_product(self, product_id: int, **kwargs) -> Product:
+    def update_product(self, product_id: int, expires_on: Optional[dt.date] = None, **kwargs) -> Product:
+        """Update fields; with ``expires_on``, any increase in quantity is
+        recorded as a new lot with that date."""
         product = self.db.query(Product).filter_by(id=product_id, user_id=self.user_id).first()
         if not product:
             raise ValueError("Product not found")
+        before = product.quantity or 0
         for key, value in kwargs.items():
             if hasattr(product, key):
                 setattr(product, key, value)
+        added = (product.quantity or 0) - before
+        if expires_on and added > 0:
+            product.lots.append(ProductLot(quantity=added, expires_on=expires_on, user_id=self.user_id))
         self.db.commit()
         return product
 
+    def add_lot(
+        self, product_id: int, quantity: float, expires_on: Optional[dt.date], unit: Optional[str] = None
+    ) -> ProductLot:
+        """Stock a new batch: raises the product's quantity and dates it."""
+        product = self.db.query(Product).filter_by(id=product_id, user_id=self.user_id).first()
+        if not product:
+            raise ValueError("Product not found")
+        quantity = convert_quantity(quantity, unit or product.unit, product.unit)
+        if quantity <= 0:
+            raise ValueError("Quantity must be positive")
+        lot = ProductLot(quantity=quantity, expires_on=expires_on, user_id=self.user_id)
+        product.lots.append(lot)
+        product.quantity = (product.quantity or 0) + quantity
+        self.db.commit()
+        return lot
+
+    def expiring_within(self, days: int = EXPIRING_DAYS) -> List[ExpiringLot]:
+        return expiring_lots(self.db, self.user_id, days)
+
+    def next_expiry(self) -> Dict[int, dt.date]:
+        """Earliest lot expiry per product."""
+        return dict(
+            self.db.query(ProductLot.product_id, func.min(ProductLot.expires_on))
+            .filter(
+                ProductLot.user_id == self.user_id,
+                ProductLot.expires_on.isnot(None),
+                ProductLot.quantity > 0,
+            )
+            .group_by(ProductLot.product_id)
+            .all()
+        )
+
     def delete_product(self, product_id: int):
         product = self.db.query(Product).filter_by(id=product_id, user_id=self.user_id).first()
         if product:
@@ -84,19 +213,20 @@ class InventoryService:
             .all()
         )
 
-    def get_products(self, location: Optional[str] = None, category_id: Optional[int] = None):
-        query = self.db.query(Product).filter(Product.user_id == self.user_id)
-        if location:
-            query = query.filter(Product.location == location)
-        if category_id:
-            query = query.filter(Product.category_id == category_id)
-        return query.all()
+    def get_products(
+        self, location: Optional[str] = None, category_id: Optional[int] = None, low_stock: bool = False
+    ) -> List[ProductRow]:
+        stmt = products_stmt(self.user_id, location, category_id, low_stock).order_by(Product.id)
+        return read(self.db, stmt, ProductRow)
 
     def get_product(self, product_id: int) -> Optional[Product]:
         return self.db.query(Product).filter_by(id=product_id, user_id=self.user_id).first()
 
-    def barcode_lookup(self, barcode: str) -> Optional[BarcodeMemory]:
-        return self.db.query(BarcodeMemory).filter_by(barcode=barcode).first()
+    def barcode_lookup(self, barcode: str) -> Optional[BarcodeEntry]:
+        return barcode_index.get(barcode)
+
+    def barcode_lookup_many(self, barcodes: Iterable[str]) -> Dict[str, Optional[BarcodeEntry]]:
+        return barcode_index.get_many(barcodes)
 
     def add_category(self, name: str) -> Category:
         cat = Category(name=name, user_id=self.user_id)
@@ -115,16 +245,26 @@ class InventoryService:
         cat = self.db.query(Category).filter_by(id=category_id, user_id=self.user_id).first()
         if not cat:
             return
-        fallback = (
-            self.db.query(Category)
-            .filter_by(name=fallback_category_name, user_id=self.user_id)
-            .first()
-        )
-        if not fallback:
-            fallback = Category(name=fallback_category_name, user_id=self.user_id)
-            self.db.add(fallback)
-            self.db.commit()
-        for product in self.db.query(Product).filter_by(category_id=cat.id).all():
-            product.category_id = fallback.id
-        self.db.delete(cat)
+        remove_category(self.db, self.user_id, cat, fallback_category_name)
         self.db.commit()
+
+
+def remove_category(db, user_id: int, cat: Category, fallback_category_name: str = "Other"):
+    """Delete one of the user's categories, moving its products to the
+    fallback category (created if missing). Flushes but does not commit."""
+    fallback = (
+        db.query(Category)
+        .filter(Category.name == fallback_category_name, Category.user_id == user_id, Category.id != cat.id)
+        .first()
+    )
+    if not fallback:
+        fallback = Category(name=fallback_category_name, user_id=user_id)
+        db.add(fallback)
+        db.flush()
+    for product in db.query(Product).filter_by(category_id=cat.id, user_id=user_id).all():
+        product.category_id = fallback.id
+    # flush the moves first, or the delete nulls category_id on products
+    # still in the category's loaded collection
+    db.flush()
+    db.delete(cat)
+    db.flush()
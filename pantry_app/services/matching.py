@@ -0,0 +1,282 @@
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from pantry_app.models import ChangeLog, CookedRecipe, Product, RecipeVersion, SavedRecipe
+from pantry_app.services.recipes import SPICE_CATEGORIES
+from pantry_app.services.taste import TasteProfile, rank_score, taste_profile
+from pantry_app.sharding import tenant_session
+from pantry_app.utils import convert_quantity, parse_json
+
+RECIPE_ENTITIES = {"saved_recipes", "cooked_recipes"}
+
+
+class RecipeMatrix:
+    """Sparse ingredient-requirement matrix over a user's recipe library.
+
+    Rows are recipes, columns are normalized ingredient names. Requirements
+    are stored CSR-style in flat arrays, each amount expressed in the unit
+    of its column, with an inverted column -> rows index for incremental
+    rescoring.
+    """
+
+    def __init__(self, recipes: List[Dict], ignore_spices: bool):
+        self.recipes = recipes
+        self.columns: Dict[str, int] = {}
+        self.column_names: List[str] = []
+        self.column_units: List[str] = []
+        self.indptr = array("l", [0])
+        self.indices = array("l")
+        self.amounts = array("d")
+        self.column_rows: List[List[int]] = []
+        for row, recipe in enumerate(recipes):
+            required: Dict[int, float] = {}
+            for ing in recipe["ingredients"]:
+                if not isinstance(ing, dict):
+                    continue
+                if ignore_spices and ing.get("category", "") in SPICE_CATEGORIES:
+                    continue
+                name = (ing.get("name") or "").strip().lower()
+                if not name:
+                    continue
+                col = self._column(name, ing.get("unit") or "g")
+                amount = convert_quantity(
+                    float(ing.get("quantity") or 0), ing.get("unit") or "g", self.column_units[col]
+                )
+                required[col] = required.get(col, 0.0) + amount
+            for col, amount in required.items():
+                self.indices.append(col)
+                self.amounts.append(amount)
+                self.column_rows[col].append(row)
+            self.indptr.append(len(self.indices))
+
+    def _column(self, name: str, unit: str) -> int:
+        col = self.columns.get(name)
+        if col is None:
+            col = len(self.column_units)
+            self.columns[name] = col
+            self.column_names.append(name)
+            self.column_units.append(unit)
+            self.column_rows.append([])
+        return col
+
+
+class MatchEngine:
+    def __init__(self, user_id: int, ignore_spices: bool = True):
+        self.user_id = user_id
+        self.ignore_spices = ignore_spices
+        self.version = -1
+        self.matrix: Optional[RecipeMatrix] = None
+        self.inventory = array("d")
+        self.contributions: Dict[int, Tuple[int, float]] = {}
+        self.missing = array("l")
+        self.coverage = array("d")
+        self.servings = array("l")
+        self.taste = array("d")
+        self.score = array("d")
+        self._lock = threading.Lock()
+
+    def matches(self, max_missing: int = 0, limit: int = 20) -> List[Dict]:
+        with self._lock:
+            self._refresh()
+            matrix = self.matrix
+            candidates = [
+                row for row in range(len(matrix.recipes)) if self.missing[row] <= max_missing
+            ]
+            candidates.sort(
+                key=lambda row: (-self.score[row], self.missing[row], -self.servings[row])
+            )
+            return [self._result(row) for row in candidates[:limit]]
+
+    def _result(self, row: int) -> Dict:
+        matrix = self.matrix
+        recipe = matrix.recipes[row]
+        missing_names = [
+            matrix.column_names[matrix.indices[k]]
+            for k in range(matrix.indptr[row], matrix.indptr[row + 1])
+            if self.inventory[matrix.indices[k]] < matrix.amounts[k]
+        ]
+        return {
+            "recipe": recipe,
+            "missing_count": self.missing[row],
+            "missing": missing_names,
+            "coverage": round(self.coverage[row], 3),
+            "servings_possible": self.servings[row],
+            "taste": round(self.taste[row], 3),
+            "score": round(self.score[row], 3),
+        }
+
+    # state maintenance
+    def _refresh(self):
+        db = tenant_session(self.user_id)
+        try:
+            if self.matrix is None:
+                self._rebuild(db)
+                return
+            changes = (
+                db.query(ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id)
+                .filter(ChangeLog.user_id == self.user_id, ChangeLog.id > self.version)
+                .order_by(ChangeLog.id)
+                .all()
+            )
+            if not changes:
+                return
+            if any(change.entity in RECIPE_ENTITIES for change in changes):
+                self._rebuild(db)
+                return
+            product_ids = {c.entity_id for c in changes if c.entity == "products"}
+            if product_ids:
+                self._apply_products(db, product_ids)
+            self.version = changes[-1].id
+        finally:
+            db.close()
+
+    def _rebuild(self, db):
+        self.version = (
+            db.query(func.coalesce(func.max(ChangeLog.id), 0))
+            .filter(ChangeLog.user_id == self.user_id)
+            .scalar()
+        )
+        self.matrix = RecipeMatrix(load_recipe_library(db, self.user_id), self.ignore_spices)
+        n_cols = len(self.matrix.column_units)
+        n_rows = len(self.matrix.recipes)
+        self.inventory = array("d", bytes(8 * n_cols))
+        self.contributions = {}
+        self.missing = array("l", [0] * n_rows)
+        self.coverage = array("d", bytes(8 * n_rows))
+        self.servings = array("l", [0] * n_rows)
+        # Rating or cooking anything logs a cooked_recipes change, which
+        # lands here, so the taste scores only need computing on rebuild.
+        self.taste = self._taste_scores(taste_profile(self.user_id).refresh(db))
+        self.score = array("d", bytes(8 * n_rows))
+        products = (
+            db.query(Product.id, Product.name, Product.quantity, Product.unit)
+            .filter(Product.user_id == self.user_id)
+            .all()
+        )
+        for product in products:
+            self._add_contribution(product)
+        for row in range(n_rows):
+            self._score(row)
+
+    def _taste_scores(self, profile: TasteProfile) -> array:
+        matrix = self.matrix
+        weights = array("d", (profile.ingredients.get(name, 0.0) for name in matrix.column_names))
+        taste = array("d")
+        for row, recipe in enumerate(matrix.recipes):
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            ingredients = sum(weights[col] for col in matrix.indices[start:end]) / (end - start) if end > start else 0.0
+            taste.append(ingredients + profile.tag_score(recipe["tags"]))
+        return taste
+
+    def _apply_products(self, db, product_ids):
+        touched = set()
+        for product_id in product_ids:
+            previous = self.contributions.pop(product_id, None)
+            if previous:
+                col, amount = previous
+                self.inventory[col] -= amount
+                touched.add(col)
+        products = (
+            db.query(Product.id, Product.name, Product.quantity, Product.unit)
+            .filter(Product.user_id == self.user_id, Product.id.in_(product_ids))
+            .all()
+        )
+        for product in products:
+            col = self._add_contribution(product)
+            if col is not None:
+                touched.add(col)
+        rows = set()
+        for col in touched:
+            rows.update(self.matrix.column_rows[col])
+        for row in rows:
+            self._score(row)
+
+    def _add_contribution(self, product) -> Optional[int]:
+        col = self.matrix.columns.get((product.name or "").strip().lower())
+        if col is None:
+            return None
+        amount = convert_quantity(
+            product.quantity or 0, product.unit or "g", self.matrix.column_units[col]
+        )
+        self.inventory[col] += amount
+        self.contributions[product.id] = (col, amount)
+        return col
+
+    def _score(self, row: int):
+        matrix = self.matrix
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        required = end - start
+        missing = 0
+        ratio = None
+        for k in range(start, end):
+            have = self.inventory[matrix.indices[k]]
+            need = matrix.amounts[k]
+            if have < need:
+                missing += 1
+            if need > 0:
+                share = have / need
+                ratio = share if ratio is None or share < ratio else ratio
+        self.missing[row] = missing
+        self.coverage[row] = (required - missing) / required if required else 1.0
+        servings = matrix.recipes[row]["servings"] or 1
+        if missing or ratio is None:
+            self.servings[row] = 0 if missing else servings
+        else:
+            self.servings[row] = int(ratio * servings)
+        self.score[row] = rank_score(self.taste[row], self.coverage[row])
+
+
+def load_recipe_library(db, user_id: int) -> List[Dict]:
+    """Saved recipes plus one entry per distinct cooked recipe, newest first."""
+    recipes = []
+    seen = set()
+    for saved in db.query(SavedRecipe).options(joinedload(SavedRecipe.version)).filter_by(user_id=user_id).all():
+        seen.add(saved.recipe_version_id)
+        recipes.append(_recipe_dict(saved, "saved", saved.id, saved.content()))
+    # Cooked entries share content through recipe_versions, so "distinct
+    # cooked recipe" is one indexed group-by on the version id.
+    latest = (
+        db.query(CookedRecipe.recipe_version_id, func.max(CookedRecipe.id).label("cooked_id"))
+        .filter(CookedRecipe.user_id == user_id, CookedRecipe.recipe_version_id.isnot(None))
+        .group_by(CookedRecipe.recipe_version_id)
+        .subquery()
+    )
+    rows = (
+        db.query(RecipeVersion, latest.c.cooked_id)
+        .join(latest, latest.c.recipe_version_id == RecipeVersion.id)
+        .order_by(latest.c.cooked_id.desc())
+    )
+    for version, cooked_id in rows:
+        if version.id not in seen:
+            recipes.append(_recipe_dict(version, "cooked", cooked_id))
+    return recipes
+
+
+def _recipe_dict(row, source: str, source_id: int, content=None) -> Dict:
+    content = content or row
+    return {
+        "name": row.name,
+        "ingredients": parse_json(content.ingredients, []),
+        "instructions": content.instructions,
+        "tags": parse_json(content.tags, []),
+        "servings": row.servings,
+        "source": source,
+        "source_id": source_id,
+    }
+
+
+_engines: Dict[Tuple[int, bool], MatchEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def match_engine(user_id: int, ignore_spices: bool = True) -> MatchEngine:
+    key = (user_id, ignore_spices)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _engines[key] = MatchEngine(user_id, ignore_spices)
+        return engine
@@ -0,0 +1,289 @@
+"""Offline nutrition data and batch macro computation.
+
+Nutrient values per 100 g ship in ``pantry_app/data/nutrition.csv``
+(``PANTRY_NUTRITION_CSV`` points elsewhere) and are upserted into the shared
+``nutrition_facts`` table at startup, keyed by ``normalize_name``. Each
+process loads the table once into a :class:`NutritionIndex` of plain tuples.
+Ingredient names that are not in the table fall back to the longest known
+phrase inside them, so "chopped red onion" resolves to "onion"; the
+resolution is cached per name.
+
+Quantities go through the unit engine in :mod:`pantry_app.utils`: mass
+units convert to grams, volumes to millilitres and then to grams by the
+food's density (water when unknown), and "units"/"packs" by its weight per
+piece. Ingredients without a usable unit or entry are reported as
+``unknown`` rather than guessed.
+
+High protein and low carb are judged on shares of energy: at least
+``HIGH_PROTEIN_SHARE`` from protein (the EU "high protein" claim threshold)
+and at most ``LOW_CARB_SHARE`` from carbohydrate. Recipes where less than
+``MIN_COVERAGE`` of ingredients resolved are never filtered out, since
+their macros are mostly unknown.
+"""
+import csv
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from pantry_app.models import NutritionFact, SessionLocal, engine
+from pantry_app.utils import UNIT_BASES, normalize_name, normalize_unit
+
+NUTRITION_CSV = Path(
+    os.environ.get("PANTRY_NUTRITION_CSV") or Path(__file__).resolve().parent.parent / "data" / "nutrition.csv"
+)
+HIGH_PROTEIN_SHARE = 0.20
+LOW_CARB_SHARE = 0.26
+MIN_COVERAGE = 0.5
+# longest sub-phrase tried when a name is not in the table
+MAX_PHRASE_WORDS = 4
+KCAL_PER_G = {"protein": 4.0, "carbs": 4.0, "fat": 9.0}
+PIECE_UNITS = {"units", "packs", ""}
+
+
+class Macros(NamedTuple):
+    kcal: float = 0.0
+    protein_g: float = 0.0
+    carbs_g: float = 0.0
+    fat_g: float = 0.0
+    fiber_g: float = 0.0
+
+    def scaled(self, factor: float) -> "Macros":
+        return Macros(*(value * factor for value in self))
+
+    def plus(self, other: "Macros") -> "Macros":
+        return Macros(*(a + b for a, b in zip(self, other)))
+
+    def share(self, nutrient: str) -> Optional[float]:
+        """Fraction of energy from protein, carbs or fat; None without energy."""
+        if self.kcal <= 0:
+            return None
+        return getattr(self, f"{nutrient}_g") * KCAL_PER_G[nutrient] / self.kcal
+
+    def rounded(self) -> Dict[str, float]:
+        return {field: round(value, 1) for field, value in self._asdict().items()}
+
+
+class Fact(NamedTuple):
+    name: str
+    per_100g: Macros
+    g_per_ml: Optional[float]
+    g_per_unit: Optional[float]
+
+
+class RecipeMacros(NamedTuple):
+    total: Macros
+    per_serving: Macros
+    matched: int
+    ingredients: int
+    unknown: Tuple[str, ...]
+
+    @property
+    def coverage(self) -> float:
+        return self.matched / self.ingredients if self.ingredients else 1.0
+
+    def as_dict(self) -> Dict:
+        return {
+            "per_serving": self.per_serving.rounded(),
+            "total": self.total.rounded(),
+            "coverage": round(self.coverage, 2),
+            "unknown": list(self.unknown),
+        }
+
+
+def csv_rows(path=NUTRITION_CSV) -> Iterator[Dict]:
+    with Path(path).open(newline="", encoding="utf-8") as handle:
+        for row in csv.DictReader(handle):
+            name = (row.get("name") or "").strip()
+            key = normalize_name(name)
+            if not key:
+                continue
+            yield {
+                "name_key": key,
+                "name": name,
+                "kcal": _number(row.get("kcal")) or 0.0,
+                "protein_g": _number(row.get("protein_g")) or 0.0,
+                "carbs_g": _number(row.get("carbs_g")) or 0.0,
+                "fat_g": _number(row.get("fat_g")) or 0.0,
+                "fiber_g": _number(row.get("fiber_g")) or 0.0,
+                "g_per_ml": _number(row.get("g_per_ml")),
+                "g_per_unit": _number(row.get("g_per_unit")),
+            }
+
+
+def _number(text) -> Optional[float]:
+    try:
+        return float(text) if text not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def seed_nutrition(bind=None, path=NUTRITION_CSV) -> int:
+    """Upsert the dataset into nutrition_facts; returns rows written."""
+    if not Path(path).exists():
+        return 0
+    rows = list(csv_rows(path))
+    if not rows:
+        return 0
+    stmt = sqlite_insert(NutritionFact.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["name_key"],
+        set_={column: stmt.excluded[column] for column in rows[0] if column != "name_key"},
+    )
+    with (bind or engine).begin() as conn:
+        conn.execute(stmt, rows)
+    nutrition_index.reset()
+    return len(rows)
+
+
+class NutritionIndex:
+    """Process-wide nutrient lookup, loaded lazily with one query."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._facts: Optional[Dict[str, Fact]] = None
+        self._resolved: Dict[str, Optional[Fact]] = {}
+
+    def lookup(self, name: str) -> Optional[Fact]:
+        facts = self._ensure_loaded()
+        key = normalize_name(name)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+        fact = facts.get(key) or self._fallback(facts, key)
+        self._resolved[key] = fact
+        return fact
+
+    def reset(self):
+        with self._lock:
+            self._facts = None
+            self._resolved = {}
+
+    @staticmethod
+    def _fallback(facts: Dict[str, Fact], key: str) -> Optional[Fact]:
+        words = key.split()
+        for size in range(min(len(words) - 1, MAX_PHRASE_WORDS), 0, -1):
+            # right-most first: the head noun usually ends the phrase
+            for start in range(len(words) - size, -1, -1):
+                fact = facts.get(" ".join(words[start:start + size]))
+                if fact:
+                    return fact
+        return None
+
+    def _ensure_loaded(self) -> Dict[str, Fact]:
+        facts = self._facts
+        if facts is not None:
+            return facts
+        with self._lock:
+            if self._facts is None:
+                self._facts = self._load()
+            return self._facts
+
+    @staticmethod
+    def _load() -> Dict[str, Fact]:
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                NutritionFact.name_key,
+                NutritionFact.name,
+                NutritionFact.kcal,
+                NutritionFact.protein_g,
+                NutritionFact.carbs_g,
+                NutritionFact.fat_g,
+                NutritionFact.fiber_g,
+                NutritionFact.g_per_ml,
+                NutritionFact.g_per_unit,
+            )
+            return {
+                row.name_key: Fact(
+                    row.name,
+                    Macros(row.kcal, row.protein_g, row.carbs_g, row.fat_g, row.fiber_g),
+                    row.g_per_ml,
+                    row.g_per_unit,
+                )
+                for row in rows
+            }
+        finally:
+            db.close()
+
+
+nutrition_index = NutritionIndex()
+
+
+def grams(quantity: float, unit: Optional[str], fact: Fact) -> Optional[float]:
+    unit = normalize_unit(unit)
+    base = UNIT_BASES.get(unit)
+    if base is not None:
+        base_unit, factor = base
+        amount = quantity * factor
+        return amount if base_unit == "g" else amount * (fact.g_per_ml or 1.0)
+    if unit in PIECE_UNITS and fact.g_per_unit:
+        return quantity * fact.g_per_unit
+    return None
+
+
+def recipe_macros(recipes: Sequence[Dict]) -> List[RecipeMacros]:
+    """Macros for many recipe dicts (``ingredients``, ``servings``) at once.
+
+    Each distinct ingredient name is resolved once for the whole batch.
+    """
+    facts: Dict[str, Optional[Fact]] = {}
+    results = []
+    for recipe in recipes:
+        total = Macros()
+        matched, counted, unknown = 0, 0, []
+        for ing in recipe.get("ingredients") or []:
+            if not isinstance(ing, dict) or not ing.get("name"):
+                continue
+            counted += 1
+            name = ing["name"]
+            if name not in facts:
+                facts[name] = nutrition_index.lookup(name)
+            fact = facts[name]
+            weight = grams(float(ing.get("quantity") or 0), ing.get("unit"), fact) if fact else None
+            if weight is None:
+                unknown.append(name)
+                continue
+            matched += 1
+            total = total.plus(fact.per_100g.scaled(weight / 100))
+        servings = max(int(recipe.get("servings") or 1), 1)
+        results.append(RecipeMacros(total, total.scaled(1 / servings), matched, counted, tuple(unknown)))
+    return results
+
+
+def fits(macros: RecipeMacros, preferences: Dict) -> bool:
+    """False only when known macros clearly miss a requested diet."""
+    if macros.coverage < MIN_COVERAGE:
+        return True
+    per_serving = macros.per_serving
+    protein, carbs = per_serving.share("protein"), per_serving.share("carbs")
+    if preferences.get("high_protein") and protein is not None and protein < HIGH_PROTEIN_SHARE:
+        return False
+    if preferences.get("low_carb") and carbs is not None and carbs > LOW_CARB_SHARE:
+        return False
+    return True
+
+
+def macro_score(macros: RecipeMacros, preferences: Dict) -> float:
+    """Ranking bonus in [-1, 1] toward the requested diets, scaled by coverage."""
+    score = 0.0
+    if preferences.get("high_protein"):
+        score += macros.per_serving.share("protein") or 0.0
+    if preferences.get("low_carb"):
+        score -= macros.per_serving.share("carbs") or 0.0
+    return score * macros.coverage
+
+
+def filter_and_rank(recipes: Iterable[Dict], preferences: Dict) -> List[Tuple[Dict, RecipeMacros]]:
+    """Recipes that fit ``preferences`` with their macros, best match first."""
+    recipes = list(recipes)
+    pairs = [
+        (recipe, macros)
+        for recipe, macros in zip(recipes, recipe_macros(recipes))
+        if fits(macros, preferences)
+    ]
+    pairs.sort(key=lambda pair: -macro_score(pair[1], preferences))
+    return pairs
@@ -0,0 +1,294 @@
+import time
+from typing import Dict, List, Optional, Sequence
+
+from pantry_app.models import Product
+from pantry_app.services.inventory import expiring_lots
+from pantry_app.services.matching import load_recipe_library
+from pantry_app.services.recipes import SPICE_CATEGORIES
+from pantry_app.sharding import tenant_session
+from pantry_app.utils import convert_quantity
+
+# Undated stock is ranked by storage location; dated lots expiring within
+# EXPIRY_WINDOW_DAYS rank above it, rising to MAX_URGENCY on the last day.
+URGENCY_BY_LOCATION = {"fridge": 1.0, "pantry": 0.4, "freezer": 0.2}
+EXPIRY_WINDOW_DAYS = 7
+MAX_URGENCY = 2.0
+MISSING_WEIGHT = 2.0
+
+
+def expiry_urgency(days_left: int) -> float:
+    days_left = min(max(days_left, 0), EXPIRY_WINDOW_DAYS)
+    return 1.0 + (MAX_URGENCY - 1.0) * (EXPIRY_WINDOW_DAYS - days_left) / EXPIRY_WINDOW_DAYS
+
+
+class PlanProblem:
+    """Inventory allocation across a set of candidate recipes.
+
+    Needs are aggregated per normalized ingredient name, so the objective of a
+    plan depends only on which recipes it contains. Stock for a name is
+    consumed most-urgent first; every portion that has to be bought costs
+    ``MISSING_WEIGHT``. Adding a recipe never gains more than it would on its
+    own, which makes the standalone scores a valid branch-and-bound bound.
+    """
+
+    def __init__(self, recipes: Sequence[Dict], stock: Sequence[Dict], ignore_spices: bool = True):
+        self.recipes = list(recipes)
+        self.names: List[str] = []
+        self.units: List[str] = []
+        index: Dict[str, int] = {}
+
+        def name_index(name: str, unit: str) -> int:
+            idx = index.get(name)
+            if idx is None:
+                idx = index[name] = len(self.names)
+                self.names.append(name)
+                self.units.append(unit)
+            return idx
+
+        for item in stock:
+            name_index(item["name"].strip().lower(), item.get("unit") or "g")
+        self.needs: List[List[tuple]] = []
+        for recipe in self.recipes:
+            per_name: Dict[int, float] = {}
+            for ing in recipe.get("ingredients", []):
+                if not isinstance(ing, dict) or not ing.get("name"):
+                    continue
+                if ignore_spices and ing.get("category", "") in SPICE_CATEGORIES:
+                    continue
+                unit = ing.get("unit") or "g"
+                idx = name_index(ing["name"].strip().lower(), unit)
+                amount = convert_quantity(float(ing.get("quantity") or 0), unit, self.units[idx])
+                per_name[idx] = per_name.get(idx, 0.0) + amount
+            self.needs.append(list(per_name.items()))
+
+        self.stock: List[List[List]] = [[] for _ in self.names]
+        for item in stock:
+            idx = index[item["name"].strip().lower()]
+            qty = convert_quantity(item.get("quantity") or 0, item.get("unit") or "g", self.units[idx])
+            if qty > 0:
+                self.stock[idx].append([qty, item.get("urgency", 0.0), item.get("product_id")])
+        for entries in self.stock:
+            entries.sort(key=lambda entry: -entry[1])
+        self.totals = [sum(entry[0] for entry in entries) for entries in self.stock]
+
+        self.portion = [0.0] * len(self.names)
+        for needs in self.needs:
+            for idx, amount in needs:
+                self.portion[idx] = max(self.portion[idx], amount)
+        self.standalone = [self.marginal([0.0] * len(self.names), r) for r in range(len(self.recipes))]
+
+    def name_value(self, idx: int, need: float) -> float:
+        portion = self.portion[idx] or 1.0
+        credit = 0.0
+        remaining = need
+        for qty, urgency, _ in self.stock[idx]:
+            if remaining <= 0:
+                break
+            used = qty if qty < remaining else remaining
+            credit += used * urgency
+            remaining -= used
+        missing = need - self.totals[idx]
+        penalty = MISSING_WEIGHT * missing if missing > 0 else 0.0
+        return (credit - penalty) / portion
+
+    def marginal(self, aggregate: List[float], r: int) -> float:
+        gain = 0.0
+        for idx, amount in self.needs[r]:
+            before = aggregate[idx]
+            gain += self.name_value(idx, before + amount) - self.name_value(idx, before)
+        return gain
+
+    @staticmethod
+    def add(aggregate: List[float], needs, sign: float = 1.0):
+        for idx, amount in needs:
+            aggregate[idx] += sign * amount
+
+    def objective(self, chosen: Sequence[int]) -> float:
+        aggregate = [0.0] * len(self.names)
+        for r in chosen:
+            self.add(aggregate, self.needs[r])
+        return sum(self.name_value(idx, need) for idx, need in enumerate(aggregate) if need)
+
+
+def plan_greedy(problem: PlanProblem, horizon: int) -> List[int]:
+    aggregate = [0.0] * len(problem.names)
+    remaining = set(range(len(problem.recipes)))
+    chosen = []
+    while remaining and len(chosen) < horizon:
+        best = max(remaining, key=lambda r: (problem.marginal(aggregate, r), -r))
+        chosen.append(best)
+        remaining.discard(best)
+        problem.add(aggregate, problem.needs[best])
+    return chosen
+
+
+def plan_exact(problem: PlanProblem, horizon: int, time_budget: float):
+    """Branch and bound over recipe subsets, seeded with the greedy plan.
+
+    Returns ``(chosen, optimal)``; ``optimal`` is False when the time budget
+    ran out before the search space was exhausted.
+    """
+    deadline = time.perf_counter() + time_budget
+    order = sorted(range(len(problem.recipes)), key=lambda r: -problem.standalone[r])
+    slots = min(horizon, len(order))
+    best = plan_greedy(problem, slots)
+    best_value = problem.objective(best)
+    aggregate = [0.0] * len(problem.names)
+    path: List[int] = []
+    timed_out = False
+    nodes = 0
+    # Iterative depth-first search: each frame either explores "take order[pos]"
+    # (stage 0) or undoes it and explores "skip order[pos]" (stage 1).
+    stack = [(0, 0.0, 0)]
+    while stack:
+        pos, value, stage = stack.pop()
+        if stage == 1:
+            r = order[pos]
+            path.pop()
+            problem.add(aggregate, problem.needs[r], -1.0)
+            stack.append((pos + 1, value, 0))
+            continue
+        nodes += 1
+        if nodes & 255 == 0 and time.perf_counter() > deadline:
+            timed_out = True
+            break
+        left = slots - len(path)
+        if left == 0:
+            if value > best_value:
+                best, best_value = list(path), value
+            continue
+        if len(order) - pos < left:
+            continue
+        bound = value + sum(problem.standalone[r] for r in order[pos : pos + left])
+        if bound <= best_value + 1e-9:
+            continue
+        r = order[pos]
+        gain = problem.marginal(aggregate, r)
+        problem.add(aggregate, problem.needs[r])
+        path.append(r)
+        stack.append((pos, value, 1))
+        stack.append((pos + 1, value + gain, 0))
+    return best, not timed_out
+
+
+def build_plan(problem: PlanProblem, chosen: Sequence[int]) -> Dict:
+    stock = [[list(entry) for entry in entries] for entries in problem.stock]
+    shopping: Dict[int, float] = {}
+    meals = []
+    for r in chosen:
+        allocations = []
+        for idx, amount in problem.needs[r]:
+            remaining = amount
+            for entry in stock[idx]:
+                if remaining <= 0:
+                    break
+                used = min(entry[0], remaining)
+                if used > 0:
+                    entry[0] -= used
+                    remaining -= used
+                    allocations.append(
+                        {
+                            "ingredient": problem.names[idx],
+                            "product_id": entry[2],
+                            "quantity": round(used, 3),
+                            "unit": problem.units[idx],
+                        }
+                    )
+            if remaining > 0:
+                shopping[idx] = shopping.get(idx, 0.0) + remaining
+        recipe = problem.recipes[r]
+        meals.append(
+            {
+                "name": recipe.get("name"),
+                "source": recipe.get("source"),
+                "source_id": recipe.get("source_id"),
+                "allocations": allocations,
+            }
+        )
+    return {
+        "meals": meals,
+        "shopping_list": [
+            {"name": problem.names[idx], "quantity": round(qty, 3), "unit": problem.units[idx]}
+            for idx, qty in sorted(shopping.items(), key=lambda item: problem.names[item[0]])
+        ],
+        "objective": round(problem.objective(chosen), 4),
+    }
+
+
+class MealPlanner:
+    def __init__(self, user_id: int):
+        self.db = tenant_session(user_id)
+        self.user_id = user_id
+
+    def stock(self) -> List[Dict]:
+        products = (
+            self.db.query(Product.id, Product.name, Product.quantity, Product.unit, Product.location)
+            .filter(Product.user_id == self.user_id, Product.quantity > 0)
+            .all()
+        )
+        # Lots expiring soon become their own, more urgent stock entries; the
+        # rest of each product keeps its location's urgency.
+        dated: Dict[int, List] = {}
+        for lot in expiring_lots(self.db, self.user_id, EXPIRY_WINDOW_DAYS):
+            dated.setdefault(lot.product_id, []).append(lot)
+        stock = []
+        for p in products:
+            remaining = p.quantity
+            for lot in dated.get(p.id, ()):
+                quantity = min(lot.quantity, remaining)
+                if quantity <= 0:
+                    break
+                remaining -= quantity
+                stock.append(
+                    {
+                        "product_id": p.id,
+                        "name": p.name,
+                        "quantity": quantity,
+                        "unit": p.unit,
+                        "urgency": expiry_urgency(lot.days_left),
+                        "expires_on": lot.expires_on.isoformat(),
+                    }
+                )
+            if remaining > 0:
+                stock.append(
+                    {
+                        "product_id": p.id,
+                        "name": p.name,
+                        "quantity": remaining,
+                        "unit": p.unit,
+                        "urgency": URGENCY_BY_LOCATION.get(p.location, 0.4),
+                    }
+                )
+        return stock
+
+    def candidates(self, saved_ids: Optional[Sequence[int]] = None) -> List[Dict]:
+        library = load_recipe_library(self.db, self.user_id)
+        if saved_ids:
+            wanted = set(saved_ids)
+            library = [r for r in library if r["source"] == "saved" and r["source_id"] in wanted]
+        return library
+
+    def plan(
+        self,
+        horizon: int = 7,
+        mode: str = "greedy",
+        time_budget: float = 0.5,
+        saved_ids: Optional[Sequence[int]] = None,
+        ignore_spices: bool = True,
+    ) -> Dict:
+        started = time.perf_counter()
+        problem = PlanProblem(self.candidates(saved_ids), self.stock(), ignore_spices)
+        if mode == "exact":
+            chosen, optimal = plan_exact(problem, horizon, time_budget)
+        else:
+            chosen, optimal = plan_greedy(problem, horizon), False
+        result = build_plan(problem, chosen)
+        result.update(
+            {
+                "mode": mode,
+                "optimal": optimal,
+                "candidates": len(problem.recipes),
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+            }
+        )
+        return result
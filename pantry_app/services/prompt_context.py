@@ -0,0 +1,222 @@
+"""Inventory context for LLM recipe prompts.
+
+Sending every product to the model makes prompts grow with the pantry and
+buries the items that matter. :class:`PromptContextBuilder` instead gathers a
+bounded set of candidates from indexed lookups:
+
+- lots expiring within a week (the lot expiry index),
+- the ingredients this user cooks most (the cooking-stat rollups),
+- products whose name matches the recipe keyword,
+- the most recently added products,
+
+scores them on keyword match, expiry, past usage and quantity, merges
+duplicates ("Tomatoes" and "tomato" in compatible units), and fills a token
+budget highest score first. Pantries smaller than the recent pool are
+considered in full. The budget comes from the user's ``llm_config``
+(``{"context_tokens": 1200}``).
+"""
+import math
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import func
+
+from pantry_app.models import Category, CookingStat, Product, User
+from pantry_app.services.inventory import EXPIRING_DAYS, expiring_lots
+from pantry_app.utils import convert_quantity, convertible, normalize_name, parse_json, serialize_json
+
+DEFAULT_TOKEN_BUDGET = 1200
+MIN_TOKEN_BUDGET, MAX_TOKEN_BUDGET = 100, 32_000
+# The separator between items in a serialized list.
+ITEM_OVERHEAD_TOKENS = 1
+EXPIRY_WINDOW_DAYS = 7
+EXPIRING_POOL = 200
+RECENT_POOL = 200
+USAGE_POOL = 200
+KEYWORD_POOL = 100
+WEIGHTS = {"keyword": 3.0, "expiry": 2.0, "usage": 1.0, "quantity": 0.5}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough BPE token count: about four characters per token for English
+    text. No tokenizer needed, and close enough to budget against."""
+    return (len(text) + 3) // 4
+
+
+def context_budget(user: Optional[User]) -> int:
+    config = parse_json(user.llm_config, {}) if user and user.llm_config else {}
+    try:
+        budget = int(config.get("context_tokens", DEFAULT_TOKEN_BUDGET))
+    except (TypeError, ValueError, AttributeError):
+        budget = DEFAULT_TOKEN_BUDGET
+    return max(MIN_TOKEN_BUDGET, min(budget, MAX_TOKEN_BUDGET))
+
+
+class PromptContext(NamedTuple):
+    items: List[Dict]
+    tokens: int
+    budget: int
+    candidates: int
+    omitted: int
+    # lower-cased names of items expiring within EXPIRING_DAYS
+    use_first: List[str]
+
+
+def _round(quantity: float):
+    quantity = round(quantity or 0, 1)
+    return int(quantity) if quantity == int(quantity) else quantity
+
+
+class PromptContextBuilder:
+    def __init__(self, db, user_id: int, budget: int = DEFAULT_TOKEN_BUDGET):
+        self.db = db
+        self.user_id = user_id
+        self.budget = budget
+
+    def build(self, keyword: str = "") -> PromptContext:
+        keywords = [word for word in normalize_name(keyword).split() if len(word) >= 3]
+        expiring: Dict[int, int] = {}
+        for lot in expiring_lots(self.db, self.user_id, EXPIRY_WINDOW_DAYS, limit=EXPIRING_POOL):
+            expiring.setdefault(lot.product_id, lot.days_left)
+        usage = self._usage()
+
+        ids = set(expiring)
+        ids.update(self._recent_ids())
+        ids.update(self._keyword_ids(keywords))
+        rows = self._rows(ids)
+        rows.extend(self._used_rows(usage, ids))
+
+        top_usage = math.log1p(max(usage.values(), default=0)) or 1.0
+        merged: Dict[str, Dict] = {}
+        for row in rows:
+            if not row.quantity or row.quantity <= 0:
+                continue
+            key = normalize_name(row.name)
+            words = set(key.split())
+            score = WEIGHTS["quantity"] * row.quantity / (row.quantity + max(row.low_stock_threshold or 0, 1))
+            if keywords:
+                hits = sum(1.0 if word in words else 0.5 if word in key else 0.0 for word in keywords)
+                score += WEIGHTS["keyword"] * hits / len(keywords)
+            days_left = expiring.get(row.id)
+            if days_left is not None:
+                score += WEIGHTS["expiry"] * (1 - max(days_left, 0) / (EXPIRY_WINDOW_DAYS + 1))
+            count = usage.get(row.name.strip().lower(), 0)
+            if count:
+                score += WEIGHTS["usage"] * math.log1p(count) / top_usage
+            self._merge(merged, key, row, score, days_left)
+
+        ranked = sorted(merged.values(), key=lambda entry: (-entry["score"], entry["item"]["name"]))
+        items, tokens = [], 0
+        for entry in ranked:
+            item = entry["item"]
+            item["quantity"] = _round(item["quantity"])
+            cost = estimate_tokens(serialize_json(item)) + ITEM_OVERHEAD_TOKENS
+            if tokens + cost > self.budget:
+                # a shorter item further down may still fit
+                continue
+            items.append(item)
+            tokens += cost
+        use_first = sorted(
+            entry["item"]["name"].lower()
+            for entry in ranked
+            if entry["item"].get("expires_in_days", EXPIRING_DAYS + 1) <= EXPIRING_DAYS
+        )
+        return PromptContext(
+            items=items,
+            tokens=tokens,
+            budget=self.budget,
+            candidates=len(merged),
+            omitted=len(merged) - len(items),
+            use_first=use_first,
+        )
+
+    @staticmethod
+    def _merge(merged: Dict[str, Dict], key: str, row, score: float, days_left: Optional[int]):
+        entry = merged.get(key)
+        if entry is None:
+            item = {
+                "name": row.name,
+                "quantity": row.quantity,
+                "unit": row.unit,
+                "category": row.category or "Other",
+            }
+            if days_left is not None:
+                item["expires_in_days"] = days_left
+            merged[key] = {"item": item, "score": score}
+            return
+        item = entry["item"]
+        if not convertible(row.unit, item["unit"]):
+            # same name in an unrelated unit ("2 packs", "500 g"): list both
+            PromptContextBuilder._merge(merged, f"{key}|{row.unit}", row, score, days_left)
+            return
+        item["quantity"] += convert_quantity(row.quantity, row.unit, item["unit"])
+        entry["score"] = max(entry["score"], score)
+        if days_left is not None:
+            item["expires_in_days"] = min(item.get("expires_in_days", days_left), days_left)
+
+    def _columns(self):
+        return self.db.query(
+            Product.id,
+            Product.name,
+            Product.quantity,
+            Product.unit,
+            Product.low_stock_threshold,
+            Category.name.label("category"),
+        ).outerjoin(Category, Category.id == Product.category_id)
+
+    def _rows(self, ids: Iterable[int]) -> list:
+        ids = list(ids)
+        rows = []
+        for start in range(0, len(ids), 500):
+            rows.extend(
+                self._columns()
+                .filter(Product.user_id == self.user_id, Product.id.in_(ids[start : start + 500]))
+                .all()
+            )
+        return rows
+
+    def _recent_ids(self) -> List[int]:
+        return [
+            row.id
+            for row in self.db.query(Product.id)
+            .filter(Product.user_id == self.user_id, Product.quantity > 0)
+            .order_by(Product.id.desc())
+            .limit(RECENT_POOL)
+        ]
+
+    def _keyword_ids(self, keywords: List[str]) -> List[int]:
+        ids = []
+        for word in keywords:
+            ids.extend(
+                row.id
+                for row in self.db.query(Product.id)
+                .filter(
+                    Product.user_id == self.user_id,
+                    Product.quantity > 0,
+                    func.lower(Product.name).contains(word, autoescape=True),
+                )
+                # newest first, and stop after the pool fills
+                .order_by(Product.id.desc())
+                .limit(KEYWORD_POOL)
+            )
+        return ids
+
+    def _usage(self) -> Dict[str, int]:
+        return dict(
+            self.db.query(CookingStat.key, CookingStat.cook_count)
+            .filter_by(user_id=self.user_id, kind="ingredient")
+            .order_by(CookingStat.cook_count.desc())
+            .limit(USAGE_POOL)
+            .all()
+        )
+
+    def _used_rows(self, usage: Dict[str, int], seen: set) -> list:
+        # Matched through ix_products_user_lower_name, not a scan.
+        if not usage:
+            return []
+        return [
+            row
+            for row in self._columns()
+            .filter(Product.user_id == self.user_id, func.lower(Product.name).in_(list(usage)))
+            .all()
+            if row.id not in seen
+        ]
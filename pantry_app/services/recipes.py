@@ -1,9 +1,23 @@
 import datetime as dt
 import random
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 
 from pantry_app.llm import get_recipes_from_llm
-from pantry_app.models import CookedRecipe, Product, SavedRecipe, SessionLocal
+from pantry_app.metrics import span
+from pantry_app.models import (
+    CookedRecipe,
+    Product,
+    SavedRecipe,
+    store_recipe_version,
+)
+from pantry_app.services.history import HistoryService
+from pantry_app.services.nutrition import filter_and_rank, fits, macro_score, recipe_macros
+from pantry_app.services.prompt_context import DEFAULT_TOKEN_BUDGET, PromptContextBuilder
+from pantry_app.services.taste import rank_score, taste_profile
+from pantry_app.sharding import tenant_session
 from pantry_app.utils import convert_quantity, serialize_json
 
 
@@ -12,7 +26,7 @@ SPICE_CATEGORIES = {"Spices"}
 
 class RecipeService:
     def __init__(self, user_id: int, preferred_units: str = "metric"):
-        self.db = SessionLocal()
+        self.db = tenant_session(user_id)
         self.user_id = user_id
         self.preferred_units = preferred_units
 
@@ -24,25 +38,46 @@ class RecipeService:
         only_have: bool = False,
         minimize_missing: bool = False,
         ignore_spices: bool = True,
+        context_tokens: Optional[int] = None,
     ):
-        inventory_items = self.db.query(Product).filter_by(user_id=self.user_id).all()
-        inventory = [
-            {
-                "name": item.name,
-                "quantity": item.quantity,
-                "unit": item.unit,
-                "category": item.category.name if item.category else "Other",
-            }
-            for item in inventory_items
-        ]
-        raw_recipes = get_recipes_from_llm(inventory, servings, preferences, keyword)
+        context = PromptContextBuilder(self.db, self.user_id, context_tokens or DEFAULT_TOKEN_BUDGET).build(keyword)
+        inventory = context.items
+        use_first = set(context.use_first)
+        preferences = {**preferences, "use_first": context.use_first}
+        if context.omitted:
+            preferences["inventory_omitted"] = context.omitted
+        with span("llm.get_recipes"):
+            raw_recipes = get_recipes_from_llm(inventory, servings, preferences, keyword)
+        profile = taste_profile(self.user_id).refresh(self.db)
         recipes_with_availability = []
-        for recipe in raw_recipes:
+        for recipe, macros in zip(raw_recipes, recipe_macros(raw_recipes)):
+            if not fits(macros, preferences):
+                continue
             missing, available = self._missing_ingredients(recipe["ingredients"], ignore_spices)
             if only_have and missing:
                 continue
-            recipes_with_availability.append({"recipe": recipe, "missing": missing, "available": available})
+            uses_expiring = sorted(
+                {ing.get("name", "") for ing in recipe["ingredients"] if ing.get("name", "").lower() in use_first}
+            )
+            taste = profile.score([ing.get("name", "") for ing in recipe["ingredients"]], recipe.get("tags") or [])
+            total = len(missing) + len(available)
+            coverage = len(available) / total if total else 1.0
+            recipes_with_availability.append(
+                {
+                    "recipe": recipe,
+                    "missing": missing,
+                    "available": available,
+                    "uses_expiring": uses_expiring,
+                    "taste": round(taste, 3),
+                    "macros": macros.as_dict(),
+                    "score": rank_score(taste, coverage) + macro_score(macros, preferences),
+                }
+            )
 
+        # Stable sorts: taste and coverage order recipes within the same
+        # expiring-ingredient count (and missing count, when minimizing).
+        recipes_with_availability.sort(key=lambda r: -r["score"])
+        recipes_with_availability.sort(key=lambda r: -len(r["uses_expiring"]))
         if minimize_missing:
             recipes_with_availability.sort(key=lambda r: len(r["missing"]))
         return recipes_with_availability
@@ -66,7 +101,33 @@ class RecipeService:
                 missing.append(ing)
         return missing, available
 
+    def saved_with_macros(self, preferences: Dict) -> List[Dict]:
+        """Saved recipes that fit the diet preferences, best match first."""
+        recipes = [
+            {
+                "id": saved.id,
+                "name": saved.name,
+                "ingredients": saved.ingredient_list(),
+                "tags": saved.tag_list(),
+                "servings": saved.servings,
+            }
+            for saved in self.saved_recipes()
+        ]
+        return [
+            {**recipe, "macros": macros.as_dict()}
+            for recipe, macros in filter_and_rank(recipes, preferences)
+        ]
+
     def save_recipe(self, recipe_data: Dict):
+        version_id = self._version_id(recipe_data)
+        existing = (
+            self.db.query(SavedRecipe)
+            .filter_by(user_id=self.user_id, recipe_version_id=version_id)
+            .first()
+        )
+        if existing:
+            self.db.commit()
+            return existing
         saved = SavedRecipe(
             name=recipe_data["name"],
             ingredients=serialize_json(recipe_data.get("ingredients", [])),
@@ -74,11 +135,32 @@ class RecipeService:
             tags=serialize_json(recipe_data.get("tags", [])),
             servings=recipe_data.get("servings", 1),
             user_id=self.user_id,
+            recipe_version_id=version_id,
         )
         self.db.add(saved)
         self.db.commit()
         return saved
 
+    def _version_id(self, recipe_data: Dict) -> int:
+        return store_recipe_version(
+            self.db.connection(),
+            self.user_id,
+            recipe_data["name"],
+            recipe_data.get("ingredients", []),
+            recipe_data.get("instructions", ""),
+            recipe_data.get("tags", []),
+            recipe_data.get("servings", 1),
+        )
+
+    def cook_counts(self) -> Dict[int, int]:
+        """Times cooked per recipe version, from the (user, version) index."""
+        return dict(
+            self.db.query(CookedRecipe.recipe_version_id, func.count(CookedRecipe.id))
+            .filter(CookedRecipe.user_id == self.user_id, CookedRecipe.recipe_version_id.isnot(None))
+            .group_by(CookedRecipe.recipe_version_id)
+            .all()
+        )
+
     def cook_recipe(self, recipe_data: Dict, servings: int):
         cooked = CookedRecipe(
             name=recipe_data["name"],
@@ -90,6 +172,7 @@ class RecipeService:
             user_id=self.user_id,
         )
         self.db.add(cooked)
+        HistoryService(self.user_id, db=self.db).record_cook(cooked)
         self._deduct_inventory(recipe_data.get("ingredients", []))
         self.db.commit()
         return cooked
@@ -110,15 +193,22 @@ class RecipeService:
         self.db.commit()
 
     def saved_recipes(self):
-        return self.db.query(SavedRecipe).filter_by(user_id=self.user_id).all()
-
-    def cooked_recipes(self):
         return (
+            self.db.query(SavedRecipe)
+            .options(joinedload(SavedRecipe.version))
+            .filter_by(user_id=self.user_id)
+            .all()
+        )
+
+    def cooked_recipes(self, limit: Optional[int] = None):
+        query = (
             self.db.query(CookedRecipe)
             .filter_by(user_id=self.user_id)
             .order_by(CookedRecipe.cooked_at.desc())
-            .all()
         )
+        if limit:
+            query = query.limit(limit)
+        return query.all()
 
     def rate_cooked(self, cooked_id: int, rating: int):
         cooked = (
@@ -128,6 +218,8 @@ class RecipeService:
         )
         if not cooked:
             raise ValueError("Cooked recipe not found")
+        previous = cooked.rating
         cooked.rating = rating
+        HistoryService(self.user_id, db=self.db).record_rating(cooked, previous)
         self.db.commit()
         return cooked
@@ -1,15 +1,51 @@
-from typing import List
+import datetime as dt
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from pantry_app.models import Product, SessionLocal, ShoppingItem
+from sqlalchemy import func, select
+
+from pantry_app.events import notify_changes
+from pantry_app.models import Category, Product, ShoppingItem, record_changes
+from pantry_app.read_models import SHOPPING_COLUMNS, ShoppingRow, stream
+from pantry_app.sharding import tenant_session
+from pantry_app.utils import convert_quantity, convertible, normalize_name, normalize_unit
+
+# Bought items are history, not a to-do list; keep a bounded tail of them.
+BOUGHT_RETENTION_DAYS = 30
+MAX_BOUGHT_ITEMS = 200
+UNGROUPED = "Other"
+
+
+def grouped_stmt(user_id: int, group_by: str = "category"):
+    """Shopping item columns with their product's category or location as
+    the last column (a :class:`ShoppingRow`); shared by
+    ShoppingService.grouped and the async read API."""
+    section = Product.location if group_by == "location" else Category.name
+    return (
+        select(*SHOPPING_COLUMNS, section)
+        .outerjoin(Product, Product.id == ShoppingItem.linked_product_id)
+        .outerjoin(Category, Category.id == Product.category_id)
+        .where(ShoppingItem.user_id == user_id)
+        .order_by(ShoppingItem.status.desc(), ShoppingItem.name)
+    )
+
+
+def group_items(items: Iterable[ShoppingRow]) -> List[Tuple[str, List[ShoppingRow]]]:
+    groups: Dict[str, List[ShoppingRow]] = {}
+    for item in items:
+        groups.setdefault(item.section or UNGROUPED, []).append(item)
+    return sorted(groups.items(), key=lambda group: (group[0] == UNGROUPED, group[0].lower()))
 
 
 class ShoppingService:
     def __init__(self, user_id: int):
-        self.db = SessionLocal()
+        self.db = tenant_session(user_id)
         self.user_id = user_id
 
     def auto_low_stock_items(self) -> List[ShoppingItem]:
-        items = []
+        self.sync_low_stock()
+        return self.all_items()
+
+    def sync_low_stock(self) -> int:
         low_stock = (
             self.db.query(Product)
             .filter(
@@ -18,14 +54,27 @@ class ShoppingService:
             )
             .all()
         )
+        if not low_stock:
+            return 0
+        items = self.db.query(ShoppingItem).filter_by(user_id=self.user_id).all()
+        linked = {item.linked_product_id for item in items if item.linked_product_id}
+        manual = {
+            item.name_key: item
+            for item in items
+            if item.status == "to_buy" and not item.linked_product_id
+        }
+        added = 0
         for prod in low_stock:
-            existing = (
-                self.db.query(ShoppingItem)
-                .filter_by(user_id=self.user_id, linked_product_id=prod.id)
-                .first()
-            )
-            if not existing:
-                item = ShoppingItem(
+            if prod.id in linked:
+                continue
+            # A hand-written entry for the same product covers it; link it
+            # instead of adding a second line.
+            existing = manual.pop(normalize_name(prod.name), None)
+            if existing is not None and convertible(existing.unit, prod.unit):
+                existing.linked_product_id = prod.id
+                continue
+            self.db.add(
+                ShoppingItem(
                     name=prod.name,
                     quantity=prod.low_stock_threshold - prod.quantity + 1,
                     unit=prod.unit,
@@ -33,27 +82,130 @@ class ShoppingService:
                     linked_product_id=prod.id,
                     user_id=self.user_id,
                 )
-                self.db.add(item)
+            )
+            added += 1
         self.db.commit()
-        return (
+        return added
+
+    def refresh(self) -> Dict[str, int]:
+        """Low-stock sync, merge duplicates and prune old bought items."""
+        return {
+            "added": self.sync_low_stock(),
+            "merged": self.consolidate(),
+            "pruned": self.prune(),
+        }
+
+    def add_item(
+        self, name: str, quantity: float, unit: str, linked_product_id: Optional[int] = None
+    ) -> ShoppingItem:
+        unit = normalize_unit(unit) or "units"
+        key = normalize_name(name)
+        if linked_product_id is None:
+            linked_product_id = self._resolve_product(name, key)
+        same_item = ShoppingItem.name_key == key
+        if linked_product_id:
+            same_item = same_item | (ShoppingItem.linked_product_id == linked_product_id)
+        candidates = (
             self.db.query(ShoppingItem)
-            .filter_by(user_id=self.user_id)
-            .order_by(ShoppingItem.status)
+            .filter(
+                ShoppingItem.user_id == self.user_id,
+                ShoppingItem.status == "to_buy",
+                same_item,
+            )
+            .order_by(ShoppingItem.id)
             .all()
         )
-
-    def add_item(self, name: str, quantity: float, unit: str):
+        for item in candidates:
+            if convertible(unit, item.unit):
+                item.quantity = round(item.quantity + convert_quantity(quantity, unit, item.unit), 3)
+                item.linked_product_id = item.linked_product_id or linked_product_id
+                self.db.commit()
+                return item
         item = ShoppingItem(
             name=name,
             quantity=quantity,
             unit=unit,
             user_id=self.user_id,
             status="to_buy",
+            linked_product_id=linked_product_id,
         )
         self.db.add(item)
         self.db.commit()
         return item
 
+    def _resolve_product(self, name: str, key: str) -> Optional[int]:
+        names = {(name or "").strip().lower(), key}
+        row = (
+            self.db.query(Product.id)
+            .filter(Product.user_id == self.user_id, func.lower(Product.name).in_(names))
+            .order_by(Product.id)
+            .first()
+        )
+        return row.id if row else None
+
+    def consolidate(self) -> int:
+        """Merge to-buy lines for the same product or name, summing quantities
+        in the first line's unit. Lines whose units cannot be converted (say
+        "packs" and "g") stay separate."""
+        items = (
+            self.db.query(ShoppingItem)
+            .filter_by(user_id=self.user_id, status="to_buy")
+            .order_by(ShoppingItem.id)
+            .all()
+        )
+        product_by_name = {}
+        for item in items:
+            if item.linked_product_id:
+                product_by_name.setdefault(item.name_key or normalize_name(item.name), item.linked_product_id)
+        groups: Dict[Tuple, List[ShoppingItem]] = {}
+        merged = 0
+        for item in items:
+            name_key = item.name_key or normalize_name(item.name)
+            product_id = item.linked_product_id or product_by_name.get(name_key)
+            group = groups.setdefault(("product", product_id) if product_id else ("name", name_key), [])
+            target = next((other for other in group if convertible(item.unit, other.unit)), None)
+            if target is None:
+                group.append(item)
+                continue
+            target.quantity = round(target.quantity + convert_quantity(item.quantity, item.unit, target.unit), 3)
+            target.linked_product_id = target.linked_product_id or item.linked_product_id
+            self.db.delete(item)
+            merged += 1
+        self.db.commit()
+        return merged
+
+    def prune(self, days: int = BOUGHT_RETENTION_DAYS, keep: int = MAX_BOUGHT_ITEMS) -> int:
+        now = dt.datetime.utcnow()
+        # Rows bought before bought_at existed start their retention clock now.
+        self.db.query(ShoppingItem).filter_by(
+            user_id=self.user_id, status="bought", bought_at=None
+        ).update({"bought_at": now}, synchronize_session=False)
+        bought = (
+            self.db.query(ShoppingItem.id, ShoppingItem.bought_at)
+            .filter_by(user_id=self.user_id, status="bought")
+            .order_by(ShoppingItem.bought_at.desc(), ShoppingItem.id.desc())
+            .all()
+        )
+        cutoff = now - dt.timedelta(days=days)
+        stale = [row.id for index, row in enumerate(bought) if index >= keep or row.bought_at < cutoff]
+        table = ShoppingItem.__table__
+        connection = self.db.connection()
+        for start in range(0, len(stale), 500):
+            chunk = stale[start : start + 500]
+            connection.execute(table.delete().where(table.c.id.in_(chunk)))
+            record_changes(
+                connection, [(self.user_id, "shopping_items", item_id, "delete") for item_id in chunk]
+            )
+        self.db.commit()
+        if stale:
+            notify_changes()
+        return len(stale)
+
+    def grouped(self, group_by: str = "category") -> List[Tuple[str, List[ShoppingRow]]]:
+        """Items grouped by product category or by storage location, with
+        to-buy lines first in each group; one query, one pass."""
+        return group_items(stream(self.db, grouped_stmt(self.user_id, group_by), ShoppingRow))
+
     def update_status(self, item_id: int, status: str, update_inventory: bool = False):
         item = (
             self.db.query(ShoppingItem)
@@ -63,11 +215,16 @@ class ShoppingService:
         if not item:
             return
         item.status = status
+        item.bought_at = dt.datetime.utcnow() if status == "bought" else None
         if status == "bought" and update_inventory:
             if item.linked_product_id:
-                prod = self.db.query(Product).get(item.linked_product_id)
+                prod = (
+                    self.db.query(Product)
+                    .filter_by(id=item.linked_product_id, user_id=self.user_id)
+                    .first()
+                )
                 if prod:
-                    prod.quantity += item.quantity
+                    prod.quantity += convert_quantity(item.quantity, item.unit, prod.unit)
             else:
                 prod = Product(
                     name=item.name,
@@ -91,4 +248,9 @@ class ShoppingService:
             self.db.commit()
 
     def all_items(self) -> List[ShoppingItem]:
-        return self.db.query(ShoppingItem).filter_by(user_id=self.user_id).all()
+        return (
+            self.db.query(ShoppingItem)
+            .filter_by(user_id=self.user_id)
+            .order_by(ShoppingItem.status)
+            .all()
+        )
@@ -0,0 +1,251 @@
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+
+from pantry_app.models import (
+    Category,
+    ChangeLog,
+    CookedRecipe,
+    Product,
+    SavedRecipe,
+    ShoppingItem,
+)
+from pantry_app.services.history import HistoryService
+from pantry_app.services.inventory import remove_category
+from pantry_app.sharding import tenant_session
+from pantry_app.utils import parse_json, serialize_json
+
+ENTITY_MODELS = {
+    "products": Product,
+    "shopping_items": ShoppingItem,
+    "categories": Category,
+    "saved_recipes": SavedRecipe,
+    "cooked_recipes": CookedRecipe,
+}
+
+# Fields a client may write through /sync/push. Cooked recipes are created by
+# cooking, so only their rating is writable.
+WRITABLE_FIELDS = {
+    "products": {
+        "name",
+        "quantity",
+        "unit",
+        "low_stock_threshold",
+        "category_id",
+        "location",
+        "notes",
+        "barcode",
+    },
+    "shopping_items": {"name", "quantity", "unit", "status", "linked_product_id"},
+    "categories": {"name"},
+    "saved_recipes": {"name", "ingredients", "instructions", "tags", "servings"},
+    "cooked_recipes": {"rating"},
+}
+JSON_FIELDS = {"ingredients", "tags"}
+# Writable fields that point at another row; the row must be the user's own
+# (or, for categories, a shared default).
+REFERENCES = {"category_id": Category, "linked_product_id": Product}
+# cooked recipe ratings, as on the history page
+MIN_RATING, MAX_RATING = 0, 10
+
+
+class SyncService:
+    def __init__(self, user_id: int):
+        self.db = tenant_session(user_id)
+        self.user_id = user_id
+
+    def current_version(self) -> int:
+        return (
+            self.db.query(func.coalesce(func.max(ChangeLog.id), 0))
+            .filter(ChangeLog.user_id == self.user_id)
+            .scalar()
+        )
+
+    def changes(self, since: int = 0, limit: int = 1000) -> Dict:
+        if since <= 0:
+            return self.snapshot()
+        entries = (
+            self.db.query(ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op)
+            .filter(ChangeLog.user_id == self.user_id, ChangeLog.id > since)
+            .order_by(ChangeLog.id)
+            .limit(limit)
+            .all()
+        )
+        if not entries and since > self.current_version():
+            # The log is behind the client's cursor: the database was
+            # restored or the user moved shards. Start the client over.
+            return self.snapshot()
+        latest = {}
+        for entry in entries:
+            latest[(entry.entity, entry.entity_id)] = entry.op
+        upserts: Dict[str, List[int]] = {}
+        deleted: Dict[str, List[int]] = {entity: [] for entity in ENTITY_MODELS}
+        for (entity, entity_id), op in latest.items():
+            if op == "delete":
+                deleted[entity].append(entity_id)
+            else:
+                upserts.setdefault(entity, []).append(entity_id)
+
+        changed = {entity: [] for entity in ENTITY_MODELS}
+        for entity, ids in upserts.items():
+            model = ENTITY_MODELS[entity]
+            rows = self.db.query(model).filter(model.user_id == self.user_id, model.id.in_(ids)).all()
+            changed[entity] = [_row_dict(entity, row) for row in rows]
+            # rows deleted after being logged as upserts are reported as deletions
+            found = {row.id for row in rows}
+            deleted[entity].extend(i for i in ids if i not in found)
+
+        return {
+            "cursor": entries[-1].id if entries else since,
+            "has_more": len(entries) == limit,
+            "reset": False,
+            "changed": changed,
+            "deleted": deleted,
+        }
+
+    def snapshot(self) -> Dict:
+        cursor = self.current_version()
+        changed = {}
+        for entity, model in ENTITY_MODELS.items():
+            rows = self.db.query(model).filter(model.user_id == self.user_id).all()
+            changed[entity] = [_row_dict(entity, row) for row in rows]
+        return {
+            "cursor": cursor,
+            "has_more": False,
+            "reset": True,
+            "changed": changed,
+            "deleted": {entity: [] for entity in ENTITY_MODELS},
+        }
+
+    def push(self, mutations: List[Dict]) -> Dict:
+        results = []
+        for mutation in mutations:
+            entity = mutation.get("entity")
+            model = ENTITY_MODELS.get(entity)
+            if model is None:
+                results.append({"client_id": mutation.get("client_id"), "error": "unknown entity"})
+                continue
+            op = mutation.get("op", "upsert")
+            entity_id = mutation.get("id")
+            row = None
+            if entity_id:
+                row = self.db.query(model).filter_by(id=entity_id, user_id=self.user_id).first()
+            if op == "delete":
+                if row is not None and entity == "categories":
+                    remove_category(self.db, self.user_id, row)
+                elif row is not None:
+                    if entity == "cooked_recipes":
+                        HistoryService(self.user_id, db=self.db).record_uncook(row)
+                    self.db.delete(row)
+                results.append({"client_id": mutation.get("client_id"), "id": entity_id})
+                continue
+            data = mutation.get("data") or {}
+            if not isinstance(data, dict):
+                results.append({"client_id": mutation.get("client_id"), "error": "invalid data"})
+                continue
+            if entity == "cooked_recipes" and data.get("rating") is not None:
+                rating = _rating(data["rating"])
+                if rating is None:
+                    results.append({"client_id": mutation.get("client_id"), "error": "invalid rating"})
+                    continue
+                data = {**data, "rating": rating}
+            foreign = self._foreign_reference(entity, data)
+            if foreign:
+                results.append({"client_id": mutation.get("client_id"), "error": f"unknown {foreign}"})
+                continue
+            if row is None:
+                if entity == "cooked_recipes" or not data.get("name"):
+                    results.append({"client_id": mutation.get("client_id"), "error": "not found"})
+                    continue
+                row = model(user_id=self.user_id)
+                self.db.add(row)
+            previous_rating = row.rating if entity == "cooked_recipes" else None
+            for key, value in data.items():
+                if key in WRITABLE_FIELDS[entity]:
+                    setattr(row, key, serialize_json(value) if key in JSON_FIELDS else value)
+            if entity == "cooked_recipes":
+                HistoryService(self.user_id, db=self.db).record_rating(row, previous_rating)
+            self.db.flush()
+            results.append({"client_id": mutation.get("client_id"), "id": row.id})
+        self.db.commit()
+        return {"results": results, "cursor": self.current_version()}
+
+    def _foreign_reference(self, entity: str, data: Dict):
+        """The first referencing field in ``data`` whose target is not the
+        user's, else None."""
+        for key, model in REFERENCES.items():
+            target = data.get(key)
+            if key not in WRITABLE_FIELDS[entity] or target is None:
+                continue
+            owner = model.user_id == self.user_id
+            if model is Category:
+                owner = owner | model.user_id.is_(None)
+            if not self.db.query(model.id).filter(model.id == target, owner).first():
+                return key
+        return None
+
+    def compact(self) -> int:
+        return compact_change_log(self.db, self.user_id)
+
+
+def compact_change_log(db, user_id: Optional[int] = None) -> int:
+    """Drop superseded change log entries, of one user or of everyone in
+    ``db``; only the newest entry per row matters for deltas. Commits."""
+    newest = db.query(func.max(ChangeLog.id)).group_by(ChangeLog.entity, ChangeLog.entity_id)
+    stale = db.query(ChangeLog)
+    if user_id is not None:
+        newest = newest.filter(ChangeLog.user_id == user_id)
+        stale = stale.filter(ChangeLog.user_id == user_id)
+    removed = stale.filter(ChangeLog.id.notin_(newest)).delete(synchronize_session=False)
+    db.commit()
+    return removed
+
+
+def _rating(value) -> Optional[int]:
+    """``value`` as a rating, or None when it is not one."""
+    if isinstance(value, bool):
+        return None
+    try:
+        rating = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return rating if MIN_RATING <= rating <= MAX_RATING else None
+
+
+def _row_dict(entity: str, row) -> Dict:
+    if entity == "products":
+        return {
+            "id": row.id,
+            "name": row.name,
+            "quantity": row.quantity,
+            "unit": row.unit,
+            "low_stock_threshold": row.low_stock_threshold,
+            "category_id": row.category_id,
+            "location": row.location,
+            "notes": row.notes,
+            "barcode": row.barcode,
+        }
+    if entity == "shopping_items":
+        return {
+            "id": row.id,
+            "name": row.name,
+            "quantity": row.quantity,
+            "unit": row.unit,
+            "status": row.status,
+            "linked_product_id": row.linked_product_id,
+        }
+    if entity == "categories":
+        return {"id": row.id, "name": row.name}
+    content = row.content()
+    data = {
+        "id": row.id,
+        "name": row.name,
+        "ingredients": parse_json(content.ingredients, []),
+        "instructions": content.instructions,
+        "tags": parse_json(content.tags, []),
+        "servings": row.servings,
+    }
+    if entity == "cooked_recipes":
+        data["cooked_at"] = row.cooked_at.isoformat() if row.cooked_at else None
+        data["rating"] = row.rating
+    return data
@@ -0,0 +1,155 @@
+"""Per-user taste profile for ranking recipes.
+
+Each ingredient and tag the user has cooked gets an affinity weight from its
+``CookingStat`` rollup: how often it was cooked, saturating at
+``FREQUENCY_HALF`` cooks for half the frequency weight, plus how its ratings
+sit against a neutral 5/10. Ratings are shrunk toward neutral with
+``PRIOR_RATINGS`` phantom ratings, so one 10 does not outweigh a long record.
+
+The rollups are already maintained on every cook and rating, so the
+profile never rescans history. A process keeps one profile per user and
+refreshes it from the change log: only the ingredient and tag keys of cooked
+recipes changed since the last refresh are re-read. A deleted cooked recipe
+triggers a full reload of the rollups, which is bounded by the number of
+distinct ingredients and tags rather than by history length.
+
+A candidate's taste is the mean weight of its ingredients plus
+``TAG_SHARE`` times the mean weight of its tags. :func:`rank_score` combines
+it with ingredient coverage into the value recipes are sorted by.
+"""
+import threading
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import selectinload
+
+from pantry_app.models import ChangeLog, CookedRecipe, CookingStat
+from pantry_app.services.history import HistoryService
+
+KINDS = ("ingredient", "tag")
+NEUTRAL_RATING = 5.0
+PRIOR_RATINGS = 2
+FREQUENCY_HALF = 4
+FREQUENCY_WEIGHT = 0.5
+TAG_SHARE = 0.5
+TASTE_WEIGHT = 1.0
+AVAILABILITY_WEIGHT = 1.0
+# keys per IN (...) when re-reading changed rollups
+KEY_CHUNK = 400
+
+
+def affinity(cook_count: int, rating_sum: int, rating_count: int) -> float:
+    """Weight of one ingredient or tag: in (-1, 1.5), 0 for never cooked."""
+    frequency = cook_count / (cook_count + FREQUENCY_HALF) if cook_count > 0 else 0.0
+    mean = (rating_sum + NEUTRAL_RATING * PRIOR_RATINGS) / (rating_count + PRIOR_RATINGS)
+    return FREQUENCY_WEIGHT * frequency + (mean - NEUTRAL_RATING) / NEUTRAL_RATING
+
+
+def rank_score(taste: float, coverage: float) -> float:
+    return TASTE_WEIGHT * taste + AVAILABILITY_WEIGHT * coverage
+
+
+class TasteProfile:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.version = -1
+        self.ingredients: Dict[str, float] = {}
+        self.tags: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def score(self, ingredients: Sequence[str], tags: Sequence[str]) -> float:
+        names = [(name or "").strip().lower() for name in ingredients]
+        names = [name for name in names if name]
+        taste = sum(self.ingredients.get(name, 0.0) for name in names) / len(names) if names else 0.0
+        return taste + self.tag_score(tags)
+
+    def tag_score(self, tags: Sequence[str]) -> float:
+        tags = [tag for tag in tags if tag]
+        if not tags:
+            return 0.0
+        return TAG_SHARE * sum(self.tags.get(tag, 0.0) for tag in tags) / len(tags)
+
+    def top(self, kind: str, limit: int = 10) -> List[Tuple[str, float]]:
+        weights = self.ingredients if kind == "ingredient" else self.tags
+        return sorted(weights.items(), key=lambda item: -item[1])[:limit]
+
+    # state maintenance
+    def refresh(self, db) -> "TasteProfile":
+        with self._lock:
+            if self.version < 0:
+                self._load(db)
+                return self
+            changes = (
+                db.query(ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op)
+                .filter(ChangeLog.user_id == self.user_id, ChangeLog.id > self.version)
+                .order_by(ChangeLog.id)
+                .all()
+            )
+            if not changes:
+                return self
+            cooked = [change for change in changes if change.entity == "cooked_recipes"]
+            if any(change.op == "delete" for change in cooked):
+                self._load(db)
+                return self
+            if cooked:
+                self._apply(db, {change.entity_id for change in cooked})
+            self.version = changes[-1].id
+        return self
+
+    def _load(self, db):
+        self.version = (
+            db.query(func.coalesce(func.max(ChangeLog.id), 0))
+            .filter(ChangeLog.user_id == self.user_id)
+            .scalar()
+        )
+        HistoryService(self.user_id, db=db).ensure_rollups()
+        ingredients, tags = {}, {}
+        rows = (
+            db.query(CookingStat.kind, CookingStat.key, CookingStat.cook_count, CookingStat.rating_sum, CookingStat.rating_count)
+            .filter(CookingStat.user_id == self.user_id, CookingStat.kind.in_(KINDS))
+        )
+        for row in rows:
+            weights = ingredients if row.kind == "ingredient" else tags
+            weights[row.key] = affinity(row.cook_count, row.rating_sum, row.rating_count)
+        self.ingredients, self.tags = ingredients, tags
+
+    def _apply(self, db, cooked_ids: Set[int]):
+        keys: Set[Tuple[str, str]] = set()
+        cooked_rows = (
+            db.query(CookedRecipe)
+            .options(selectinload(CookedRecipe.version))
+            .filter(CookedRecipe.user_id == self.user_id, CookedRecipe.id.in_(cooked_ids))
+        )
+        for cooked in cooked_rows:
+            keys.update(key for key in HistoryService.stat_keys(cooked, include_week=False) if key[0] in KINDS)
+        for chunk in _chunks(sorted(keys), KEY_CHUNK):
+            found = set()
+            rows = db.query(
+                CookingStat.kind, CookingStat.key, CookingStat.cook_count, CookingStat.rating_sum, CookingStat.rating_count
+            ).filter(
+                CookingStat.user_id == self.user_id,
+                tuple_(CookingStat.kind, CookingStat.key).in_(chunk),
+            )
+            for row in rows:
+                found.add((row.kind, row.key))
+                weights = self.ingredients if row.kind == "ingredient" else self.tags
+                weights[row.key] = affinity(row.cook_count, row.rating_sum, row.rating_count)
+            for kind, key in set(chunk) - found:
+                (self.ingredients if kind == "ingredient" else self.tags).pop(key, None)
+
+
+def _chunks(items: List, size: int) -> Iterable[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+_profiles: Dict[int, TasteProfile] = {}
+_profiles_lock = threading.Lock()
+
+
+def taste_profile(user_id: int) -> TasteProfile:
+    with _profiles_lock:
+        profile = _profiles.get(user_id)
+        if profile is None:
+            profile = _profiles[user_id] = TasteProfile(user_id)
+        return profile
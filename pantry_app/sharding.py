@@ -0,0 +1,340 @@
+"""Per-tenant database routing.
+
+With ``PANTRY_SHARDING=1`` every user's pantry data (products, categories,
+recipes, history, shopping list, change log) lives in its own SQLite file
+under ``PANTRY_SHARD_DIR``, so one household's writes never wait on another
+household's file lock. ``PANTRY_SHARD_GROUPS=N`` packs users into N shared
+files instead, and :meth:`ShardRouter.assign` can place several users (a
+household) in the same shard explicitly.
+
+Users, the barcode memory and the tenant directory stay in the main
+database. Sessions from :func:`tenant_session` route tenant tables to the
+user's shard and shared tables to the main database transparently.
+Moving a user between shards touches a marker file in the shard directory,
+which tells every process to drop the assignments it has cached.
+"""
+import datetime as dt
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import create_engine, func, select
+
+from pantry_app import metrics
+from pantry_app.models import (
+    DB_PATH,
+    SHARED_MODELS,
+    SYNC_ENTITIES,
+    Category,
+    ChangeLog,
+    CookedRecipe,
+    Product,
+    SessionLocal,
+    TenantShard,
+    configure_sqlite,
+    engine as main_engine,
+    get_default_categories,
+    init_db,
+    tenant_tables,
+)
+
+SHARDING_ENABLED = os.environ.get("PANTRY_SHARDING") == "1"
+SHARD_DIR = Path(os.environ.get("PANTRY_SHARD_DIR") or DB_PATH.parent / "shards")
+SHARD_GROUPS = int(os.environ.get("PANTRY_SHARD_GROUPS") or 0)
+
+
+class ShardRouter:
+    def __init__(self, shard_dir: Path = SHARD_DIR, groups: int = SHARD_GROUPS):
+        self.shard_dir = Path(shard_dir)
+        self.groups = groups
+        self._engines: Dict[str, object] = {}
+        self._assignments: Dict[int, str] = {}
+        self._moves_seen: Optional[int] = None
+        self._lock = threading.RLock()
+
+    def default_key(self, user_id: int) -> str:
+        if self.groups:
+            return f"group-{user_id % self.groups}"
+        return f"user-{user_id}"
+
+    def shard_path(self, key: str) -> Path:
+        return self.shard_dir / f"{key}.db"
+
+    def engine_for(self, key: str):
+        engine = self._engines.get(key)
+        if engine is not None:
+            return engine
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is None:
+                engine = self.create_shard(key)
+            return engine
+
+    def create_shard(self, key: str):
+        with self._lock:
+            self.shard_dir.mkdir(parents=True, exist_ok=True)
+            engine = create_engine(
+                f"sqlite:///{self.shard_path(key)}", connect_args={"check_same_thread": False}
+            )
+            configure_sqlite(engine)
+            init_db(engine, tenant_tables())
+            metrics.install_sql_hooks(engine)
+            self._engines[key] = engine
+            return engine
+
+    def session_for_key(self, key: str):
+        return SessionLocal(
+            bind=self.engine_for(key), binds={model: main_engine for model in SHARED_MODELS}
+        )
+
+    def session(self, user_id: int):
+        return self.session_for_key(self.shard_key(user_id))
+
+    @property
+    def moves_marker(self) -> Path:
+        # touched after every move so other processes drop cached assignments
+        return self.shard_dir / "moves"
+
+    def _check_moves(self):
+        try:
+            stamp = self.moves_marker.stat().st_mtime_ns
+        except FileNotFoundError:
+            stamp = None
+        if stamp != self._moves_seen:
+            with self._lock:
+                self._assignments.clear()
+                self._moves_seen = stamp
+
+    def known_key(self, user_id: int) -> Optional[str]:
+        """The user's shard if already resolved in this process; never blocks."""
+        self._check_moves()
+        return self._assignments.get(user_id)
+
+    def shard_key(self, user_id: int) -> str:
+        self._check_moves()
+        key = self._assignments.get(user_id)
+        if key is not None:
+            return key
+        with self._lock:
+            key = self._assignments.get(user_id)
+            if key is None:
+                db = SessionLocal()
+                try:
+                    entry = db.query(TenantShard).get(user_id)
+                    key = entry.shard_key if entry else None
+                finally:
+                    db.close()
+                if key is None:
+                    key = self.assign(user_id)
+                self._assignments[user_id] = key
+            return key
+
+    def assign(self, user_id: int, key: Optional[str] = None) -> str:
+        """Place ``user_id`` in shard ``key``, moving any existing data there."""
+        key = key or self.default_key(user_id)
+        with self._lock:
+            db = SessionLocal()
+            try:
+                entry = db.query(TenantShard).get(user_id)
+                current = entry.shard_key if entry else None
+                if current == key:
+                    return key
+                source = self.session_for_key(current) if current else SessionLocal()
+                target = self.session_for_key(key)
+                try:
+                    self._move(user_id, source, target)
+                finally:
+                    source.close()
+                    target.close()
+                if entry:
+                    entry.shard_key = key
+                else:
+                    db.add(TenantShard(user_id=user_id, shard_key=key))
+                db.commit()
+            finally:
+                db.close()
+            if current:
+                self.moves_marker.touch()
+            self._assignments[user_id] = key
+            return key
+
+    def _move(self, user_id: int, source, target):
+        """Copy the user's rows from ``source`` to ``target`` table by table,
+        keeping their ids, then delete them from ``source``.
+
+        Ids that sync clients and the change log refer to stay valid. Rows
+        only get new ids when their ids are already taken in a shared target
+        shard. In that case references to them are rewritten, and the change
+        log gets a delete for each old id and an upsert for each new one, so
+        clients drop the old rows on their next pull.
+        """
+        tables = tenant_tables()
+        change_log = ChangeLog.__table__
+        rows = {
+            table: [
+                dict(row._mapping)
+                for row in source.execute(select(table).where(table.c.user_id == user_id).order_by(table.c.id))
+            ]
+            for table in tables
+        }
+
+        renumbered: Dict[object, Dict[int, int]] = {}
+        for table in tables:
+            if table is change_log or not rows[table]:
+                continue
+            ids = [row["id"] for row in rows[table]]
+            if self._taken(target, table, ids):
+                start = target.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar() + 1
+                renumbered[table] = {old: start + offset for offset, old in enumerate(ids)}
+            mapping = renumbered.get(table, {})
+            for row in rows[table]:
+                row["id"] = mapping.get(row["id"], row["id"])
+        moved = {table: {row["id"] for row in batch} for table, batch in rows.items()}
+        for table in tables:
+            for fk in table.foreign_keys:
+                parent = fk.column.table
+                if parent not in moved:
+                    continue  # users, shared
+                mapping = renumbered.get(parent, {})
+                for row in rows[table]:
+                    value = mapping.get(row[fk.parent.name], row[fk.parent.name])
+                    # a reference outside the user's rows (a legacy shared
+                    # category) would point at another tenant's row here
+                    row[fk.parent.name] = value if value in moved[parent] else None
+
+        log = rows[change_log]
+        entities = {model.__table__: entity for model, entity in SYNC_ENTITIES.items()}
+        now = dt.datetime.utcnow()
+        for table, mapping in renumbered.items():
+            entity = entities.get(table)
+            if entity is None:
+                continue
+            log.extend(
+                {"user_id": user_id, "entity": entity, "entity_id": old, "op": "delete", "changed_at": now}
+                for old in mapping
+            )
+            log.extend(
+                {"user_id": user_id, "entity": entity, "entity_id": new, "op": "upsert", "changed_at": now}
+                for new in mapping.values()
+            )
+        if any("id" not in entry for entry in log) or self._taken(target, change_log, [e["id"] for e in log]):
+            # keep the log's order and place it after every cursor a client
+            # may hold, so pulls replay it instead of skipping it
+            start = max(
+                target.execute(select(func.coalesce(func.max(change_log.c.id), 0))).scalar(),
+                max((entry.get("id", 0) for entry in log), default=0),
+            ) + 1
+            for offset, entry in enumerate(log):
+                entry["id"] = start + offset
+
+        for table in tables:
+            if rows[table]:
+                target.execute(table.insert(), rows[table])
+        if not moved[Category.__table__]:
+            for name in get_default_categories():
+                target.add(Category(name=name, user_id=user_id))
+        target.commit()
+        for table in reversed(tables):
+            source.execute(table.delete().where(table.c.user_id == user_id))
+        source.commit()
+
+    @staticmethod
+    def _taken(session, table, ids: List[int], chunk: int = 500) -> bool:
+        for i in range(0, len(ids), chunk):
+            if session.execute(select(table.c.id).where(table.c.id.in_(ids[i : i + chunk])).limit(1)).first():
+                return True
+        return False
+
+    def shard_keys(self) -> List[str]:
+        keys = {path.stem for path in self.shard_dir.glob("*.db")} if self.shard_dir.exists() else set()
+        db = SessionLocal()
+        try:
+            keys.update(row.shard_key for row in db.query(TenantShard.shard_key).distinct())
+        finally:
+            db.close()
+        return sorted(keys)
+
+    def for_each_shard(self, func: Callable) -> Dict[str, object]:
+        results = {}
+        for key in self.shard_keys():
+            session = self.session_for_key(key)
+            try:
+                results[key] = func(session)
+            finally:
+                session.close()
+        return results
+
+
+router = ShardRouter()
+
+
+def tenant_session(user_id: int):
+    if SHARDING_ENABLED:
+        return router.session(user_id)
+    return SessionLocal()
+
+
+def for_each_shard(func: Callable) -> Dict[str, object]:
+    """Run ``func(session)`` against every shard (or the main database)."""
+    if SHARDING_ENABLED:
+        return router.for_each_shard(func)
+    session = SessionLocal()
+    try:
+        return {"main": func(session)}
+    finally:
+        session.close()
+
+
+def database_files() -> Dict[str, Path]:
+    """Every database file on disk, keyed by its path relative to the data
+    directory ("app.db", "shards/<key>.db")."""
+    files = {"app.db": DB_PATH}
+    if SHARD_DIR.exists():
+        for path in sorted(SHARD_DIR.glob("*.db")):
+            files[f"shards/{path.name}"] = path
+    return files
+
+
+def shard_summary() -> Dict:
+    def counts(session):
+        return {
+            "tenants": session.query(func.count(func.distinct(Product.user_id))).scalar(),
+            "products": session.query(func.count(Product.id)).scalar(),
+            "cooked_recipes": session.query(func.count(CookedRecipe.id)).scalar(),
+        }
+
+    shards = for_each_shard(counts)
+    totals = {
+        metric: sum(shard[metric] for shard in shards.values())
+        for metric in ("products", "cooked_recipes")
+    }
+    return {"sharding": SHARDING_ENABLED, "shards": shards, "totals": totals}
+
+
+def main():
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Tenant shard administration")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("summary", help="row counts per shard")
+    create = sub.add_parser("create", help="create an empty shard")
+    create.add_argument("key")
+    assign = sub.add_parser("assign", help="move a user (and their data) to a shard")
+    assign.add_argument("user_id", type=int)
+    assign.add_argument("key", nargs="?")
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == "summary":
+        print(json.dumps(shard_summary(), indent=2))
+    elif args.command == "create":
+        router.create_shard(args.key)
+        print(router.shard_path(args.key))
+    else:
+        print(router.assign(args.user_id, args.key))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""Compact binary snapshots of a user's data.
+
+A snapshot is a self-contained SQLite file holding the same sections as the
+JSON export. Each section is a table of typed columns. Repeated strings
+(units, locations, category names, statuses) are stored once in a
+``strings`` table and referenced by id. The file carries a format version
+(also in ``PRAGMA user_version``) and a SHA-256 over the stored rows in the
+``meta`` table, so a truncated or edited file is rejected on read. Readers
+open the file read-only with memory mapping and walk each table in rowid
+order, so sections can be consumed as streams:
+
+    python -m pantry_app.snapshot info export.pantry
+    python -m pantry_app.snapshot verify export.pantry
+"""
+import datetime as dt
+import hashlib
+import json
+import os
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+FORMAT = "pantry-snapshot"
+FORMAT_VERSION = 2
+# "PNTY"; lets `file`-style tools tell a snapshot from any other SQLite file.
+APPLICATION_ID = 0x504E5459
+CHUNK_ROWS = 5_000
+MMAP_BYTES = 256 * 1024 * 1024
+CONTENT_TYPE = "application/vnd.pantry.snapshot+sqlite3"
+
+TEXT, REAL, INT, DICT, JSON = "text", "real", "int", "dict", "json"
+# section -> [(field, kind, optional)]; optional fields are left out of the
+# decoded rows when they are NULL, matching the JSON export's shape.
+SECTIONS: Dict[str, List[Tuple[str, str, bool]]] = {
+    "categories": [("name", TEXT, False)],
+    "products": [
+        ("name", TEXT, False),
+        ("quantity", REAL, False),
+        ("unit", DICT, False),
+        ("low_stock_threshold", REAL, False),
+        ("location", DICT, False),
+        ("category", DICT, False),
+        ("notes", DICT, False),
+        ("lots", JSON, True),  # format 2
+    ],
+    "saved_recipes": [
+        ("name", TEXT, False),
+        ("ingredients", JSON, False),
+        ("instructions", TEXT, False),
+        ("tags", JSON, False),
+        ("servings", INT, False),
+    ],
+    "recipes": [
+        ("hash", TEXT, False),
+        ("name", TEXT, False),
+        ("ingredients", JSON, False),
+        ("instructions", TEXT, False),
+        ("tags", JSON, False),
+        ("servings", INT, False),
+    ],
+    "cooked_recipes": [
+        ("name", DICT, False),
+        ("recipe", DICT, True),
+        ("ingredients", JSON, True),
+        ("instructions", TEXT, True),
+        ("tags", JSON, True),
+        ("servings", INT, False),
+        ("cooked_at", TEXT, False),
+        ("rating", INT, False),
+    ],
+    "shopping_items": [
+        ("name", TEXT, False),
+        ("quantity", REAL, False),
+        ("unit", DICT, False),
+        ("status", DICT, False),
+    ],
+    "barcode_memory": [
+        ("barcode", TEXT, False),
+        ("name", TEXT, False),
+        ("category_name", DICT, False),
+    ],
+}
+SQL_TYPES = {TEXT: "TEXT", REAL: "REAL", INT: "INTEGER", DICT: "INTEGER", JSON: "TEXT"}
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+class _Strings(dict):
+    """String -> id, assigning the next id on first sight; None stays None."""
+
+    def __init__(self):
+        super().__init__({None: None})
+
+    def __missing__(self, value):
+        string_id = self[value] = len(self)
+        return string_id
+
+
+def _encode_column(kind: str, values: list, strings: _Strings) -> list:
+    if kind == DICT:
+        return [strings[value if value is None or value.__class__ is str else str(value)] for value in values]
+    if kind == REAL:
+        return [None if value is None else float(value) for value in values]
+    if kind == INT:
+        return [None if value is None else int(value) for value in values]
+    if kind == JSON:
+        dumps = json.JSONEncoder(separators=(",", ":")).encode
+        return [None if value is None else dumps(value) for value in values]
+    return [value if value is None or value.__class__ is str else str(value) for value in values]
+
+
+def _hash_chunk(hasher, section: str, rows: List[tuple]):
+    # Rows are hashed as stored (after type coercion and dictionary
+    # encoding), so the reader can check them without decoding.
+    hasher.update(section.encode())
+    hasher.update(repr(rows).encode())
+
+
+def write_snapshot(data: Dict, path) -> Dict:
+    """Write an export payload (``ExportImportService.export_all``) to
+    ``path`` and return the snapshot's metadata.
+
+    The file is built next to ``path`` and renamed into place when complete.
+    """
+    path = Path(path)
+    partial = path.with_name(path.name + ".partial")
+    if partial.exists():
+        partial.unlink()
+    conn = sqlite3.connect(str(partial))
+    hasher = hashlib.sha256()
+    strings = _Strings()
+    counts = {}
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(f"PRAGMA application_id={APPLICATION_ID}")
+        conn.execute(f"PRAGMA user_version={FORMAT_VERSION}")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("CREATE TABLE strings (id INTEGER PRIMARY KEY, value TEXT NOT NULL)")
+        for section, fields in SECTIONS.items():
+            ddl = ", ".join(f"{field} {SQL_TYPES[kind]}" for field, kind, _ in fields)
+            conn.execute(f"CREATE TABLE {section} ({ddl})")
+            insert = f"INSERT INTO {section} VALUES ({', '.join('?' * len(fields))})"
+            rows = data.get(section) or []
+            for start in range(0, len(rows), CHUNK_ROWS):
+                batch = rows[start : start + CHUNK_ROWS]
+                # Column at a time: one tight loop per field instead of a
+                # Python call per cell.
+                columns = [
+                    _encode_column(kind, [row.get(field) for row in batch], strings)
+                    for field, kind, _ in fields
+                ]
+                chunk = list(zip(*columns))
+                _hash_chunk(hasher, section, chunk)
+                conn.executemany(insert, chunk)
+            counts[section] = len(rows)
+        values = [(string_id, value) for value, string_id in strings.items() if value is not None]
+        for start in range(0, len(values), CHUNK_ROWS):
+            chunk = values[start : start + CHUNK_ROWS]
+            _hash_chunk(hasher, "strings", chunk)
+            conn.executemany("INSERT INTO strings VALUES (?, ?)", chunk)
+        meta = {
+            "format": FORMAT,
+            "format_version": FORMAT_VERSION,
+            "created_at": dt.datetime.utcnow().isoformat(timespec="seconds"),
+            "snapshot_at": data.get("snapshot_at"),
+            "chunk_rows": CHUNK_ROWS,
+            "counts": counts,
+            "strings": len(values),
+            "sha256": hasher.hexdigest(),
+        }
+        conn.executemany(
+            "INSERT INTO meta VALUES (?, ?)", [(key, json.dumps(value)) for key, value in meta.items()]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(partial, path)
+    meta["bytes"] = path.stat().st_size
+    return meta
+
+
+class SnapshotReader:
+    """Read-only access to a snapshot file.
+
+    ``rows(section)`` streams decoded dicts without checking the checksum;
+    call ``verify()`` first for files from elsewhere. ``load()`` builds the
+    whole payload for ``ExportImportService.import_data`` and verifies it in
+    the same pass.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            self.conn.execute(f"PRAGMA mmap_size={MMAP_BYTES}")
+            app_id = self.conn.execute("PRAGMA application_id").fetchone()[0]
+            if app_id != APPLICATION_ID:
+                raise SnapshotError("not a pantry snapshot")
+            self.meta = {
+                key: json.loads(value) for key, value in self.conn.execute("SELECT key, value FROM meta")
+            }
+            if self.meta.get("format") != FORMAT or self.meta.get("format_version", 0) > FORMAT_VERSION:
+                raise SnapshotError(f"unsupported snapshot format {self.meta.get('format_version')!r}")
+        except sqlite3.DatabaseError as exc:
+            self.conn.close()
+            raise SnapshotError(f"unreadable snapshot: {exc}") from exc
+        except SnapshotError:
+            self.conn.close()
+            raise
+        self._strings: Optional[Dict[Optional[int], Optional[str]]] = None
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _chunks(self, section: str, columns: str, hasher=None) -> Iterator[List[tuple]]:
+        try:
+            cursor = self.conn.execute(f"SELECT {columns} FROM {section} ORDER BY rowid")
+            size = self.meta.get("chunk_rows", CHUNK_ROWS)
+            while True:
+                chunk = cursor.fetchmany(size)
+                if not chunk:
+                    return
+                if hasher is not None:
+                    _hash_chunk(hasher, section, chunk)
+                yield chunk
+        except sqlite3.DatabaseError as exc:
+            raise SnapshotError(f"unreadable snapshot: {exc}") from exc
+
+    def _check(self, hasher):
+        for _ in self._chunks("strings", "id, value", hasher):
+            pass
+        if hasher.hexdigest() != self.meta.get("sha256"):
+            raise SnapshotError("snapshot checksum mismatch")
+
+    def _fields(self, section: str) -> List[Tuple[str, str, bool]]:
+        # Files from older formats lack columns added since; read what is there.
+        present = {row[1] for row in self.conn.execute(f"PRAGMA table_info({section})")}
+        return [field for field in SECTIONS[section] if field[0] in present]
+
+    def verify(self):
+        hasher = hashlib.sha256()
+        for section in SECTIONS:
+            fields = self._fields(section)
+            for _ in self._chunks(section, ", ".join(field for field, _, _ in fields), hasher):
+                pass
+        self._check(hasher)
+
+    def strings(self) -> Dict[Optional[int], Optional[str]]:
+        if self._strings is None:
+            table: Dict[Optional[int], Optional[str]] = {None: None}
+            for chunk in self._chunks("strings", "id, value"):
+                table.update(chunk)
+            self._strings = table
+        return self._strings
+
+    def rows(self, section: str, hasher=None) -> Iterator[Dict]:
+        fields = self._fields(section)
+        names = [field for field, _, _ in fields]
+        optional = [field for field, _, is_optional in fields if is_optional]
+        lookup = self.strings().__getitem__
+        loads = json.loads
+        for chunk in self._chunks(section, ", ".join(names), hasher):
+            columns = []
+            for (field, kind, _), values in zip(fields, zip(*chunk)):
+                if kind == DICT:
+                    values = map(lookup, values)
+                elif kind == JSON:
+                    values = [None if value is None else loads(value) for value in values]
+                columns.append(values)
+            for item in map(dict, map(zip, [names] * len(chunk), zip(*columns))):
+                for field in optional:
+                    if item[field] is None:
+                        del item[field]
+                yield item
+
+    def load(self, verify: bool = True) -> Dict:
+        hasher = hashlib.sha256() if verify else None
+        data = {section: list(self.rows(section, hasher)) for section in SECTIONS}
+        if verify:
+            self._check(hasher)
+        if self.meta.get("snapshot_at"):
+            data["snapshot_at"] = self.meta["snapshot_at"]
+        return data
+
+
+def read_snapshot(path, verify: bool = True) -> Dict:
+    with SnapshotReader(path) as reader:
+        return reader.load(verify=verify)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect pantry snapshot files")
+    parser.add_argument("command", choices=["info", "verify"])
+    parser.add_argument("path")
+    args = parser.parse_args()
+    try:
+        with SnapshotReader(args.path) as reader:
+            if args.command == "verify":
+                reader.verify()
+            print(json.dumps(reader.meta, indent=2))
+    except SnapshotError as exc:
+        raise SystemExit(f"{args.path}: {exc}")
+
+
+if __name__ == "__main__":
+    main()
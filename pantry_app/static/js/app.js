@@ -1,29 +1,129 @@
 (function() {
+  // Barcode lookups are cached per page and coalesced into one batch request
+  // so rapid scanning does not fire a request per keystroke or scan.
+  const barcodeCache = new Map();
+  const pending = new Map();
+  let flushTimer = null;
+
+  function flushLookups() {
+    flushTimer = null;
+    const batch = new Map(pending);
+    pending.clear();
+    fetch('/barcode/batch', {
+      method: 'POST',
+      headers: {'Content-Type': 'application/json'},
+      body: JSON.stringify({barcodes: Array.from(batch.keys())})
+    })
+      .then(resp => resp.json())
+      .then(data => {
+        batch.forEach((callbacks, code) => {
+          const result = (data.results && data.results[code]) || {found: false};
+          barcodeCache.set(code, result);
+          callbacks.forEach(cb => cb(result));
+        });
+      });
+  }
+
+  function lookupBarcode(code, callback) {
+    if (barcodeCache.has(code)) {
+      callback(barcodeCache.get(code));
+      return;
+    }
+    if (!pending.has(code)) pending.set(code, []);
+    pending.get(code).push(callback);
+    if (!flushTimer) flushTimer = setTimeout(flushLookups, 100);
+  }
+
   const barcodeInputs = document.querySelectorAll('input[name="barcode"]');
   barcodeInputs.forEach(input => {
     input.addEventListener('change', () => {
       const value = input.value.trim();
       if (value) {
-        const note = document.createElement('div');
-        note.className = 'small text-muted';
-        note.innerText = 'Barcode stored locally so future scans autofill name and category.';
-        input.parentElement.appendChild(note);
-        fetch(`/barcode/${value}`)
-          .then(resp => resp.json())
-          .then(data => {
-            if (data.found) {
-              const nameField = input.closest('form').querySelector('input[name="name"]');
-              if (nameField && !nameField.value) nameField.value = data.name;
-              if (data.category_name) {
-                const select = input.closest('form').querySelector('select[name="category_id"]');
-                if (select) {
-                  const option = Array.from(select.options).find(o => o.text === data.category_name);
-                  if (option) option.selected = true;
-                }
+        if (!input.parentElement.querySelector('.barcode-note')) {
+          const note = document.createElement('div');
+          note.className = 'small text-muted barcode-note';
+          note.innerText = 'Barcode stored locally so future scans autofill name and category.';
+          input.parentElement.appendChild(note);
+        }
+        lookupBarcode(value, data => {
+          if (data.found) {
+            const nameField = input.closest('form').querySelector('input[name="name"]');
+            if (nameField && !nameField.value) nameField.value = data.name;
+            if (data.category_name) {
+              const select = input.closest('form').querySelector('select[name="category_id"]');
+              if (select) {
+                const option = Array.from(select.options).find(o => o.text === data.category_name);
+                if (option) option.selected = true;
               }
             }
-          });
+          }
+        });
       }
     });
   });
 })();
+
+(function() {
+  // Live updates: rows shown on this page are patched from server-sent
+  // change events; anything the page cannot patch in place (new rows, bulk
+  // imports, a missed backlog) shows a reload notice instead.
+  const body = document.querySelector('tbody[data-live]');
+  if (!body || !window.EventSource) return;
+  const entity = body.dataset.live;
+  let notice = null;
+
+  function showReloadNotice() {
+    if (notice) return;
+    notice = document.createElement('div');
+    notice.className = 'alert alert-info d-flex justify-content-between align-items-center';
+    notice.innerHTML = '<span>This list changed on another device.</span>';
+    const button = document.createElement('button');
+    button.className = 'btn btn-sm btn-primary';
+    button.innerText = 'Reload';
+    button.addEventListener('click', () => window.location.reload());
+    notice.appendChild(button);
+    body.closest('.card').before(notice);
+  }
+
+  function setField(row, field, text) {
+    const cell = row.querySelector(`[data-field="${field}"]`);
+    if (cell) cell.textContent = text;
+  }
+
+  function patchProduct(row, data) {
+    const low = data.quantity <= data.low_stock_threshold;
+    setField(row, 'name', data.name);
+    setField(row, 'quantity', `${Number(data.quantity).toFixed(1)} ${data.unit}`);
+    setField(row, 'location', data.location);
+    row.classList.toggle('table-warning', low);
+    const badge = row.querySelector('[data-field="low"]');
+    if (badge) badge.innerHTML = low ? '<span class="badge text-bg-danger">Low</span>' : '';
+  }
+
+  function patchShoppingItem(row, data) {
+    setField(row, 'name', data.name);
+    setField(row, 'quantity', `${data.quantity} ${data.unit}`);
+    setField(row, 'status', data.status);
+    row.classList.toggle('table-success', data.status === 'bought');
+    const toggle = row.querySelector('input[name="status"]');
+    if (toggle) toggle.value = data.status === 'to_buy' ? 'bought' : 'to_buy';
+  }
+
+  const source = new EventSource('/events');
+  source.addEventListener('change', event => {
+    const message = JSON.parse(event.data);
+    (message.changes || []).forEach(change => {
+      if (change.entity !== entity) return;
+      const row = body.querySelector(`tr[data-id="${change.id}"]`);
+      if (change.op === 'delete') {
+        if (row) row.remove();
+      } else if (row && change.data) {
+        (entity === 'products' ? patchProduct : patchShoppingItem)(row, change.data);
+      } else {
+        showReloadNotice();
+      }
+    });
+  });
+  source.addEventListener('resync', showReloadNotice);
+  window.addEventListener('beforeunload', () => source.close());
+})();
@@ -1,5 +1,7 @@
+import datetime as dt
 import json
-from typing import Dict, List
+import re
+from typing import Dict, List, Optional
 
 METRIC_UNITS = ["g", "kg", "ml", "L", "units", "packs"]
 IMPERIAL_UNITS = ["oz", "lb", "fl oz", "cup", "units", "packs"]
@@ -9,6 +11,45 @@ UNIT_CONVERSION = {
     ("kg", "lb"): 2.20462,
     ("ml", "fl oz"): 0.033814,
     ("L", "cup"): 4.22675,
+    ("kg", "g"): 1000,
+    ("L", "ml"): 1000,
+    ("lb", "oz"): 16,
+    ("cup", "fl oz"): 8,
+}
+
+# Units that measure the same dimension, as (base unit, factor to base).
+# Used when UNIT_CONVERSION has no direct pair, e.g. kg -> oz.
+UNIT_BASES = {
+    "g": ("g", 1.0),
+    "kg": ("g", 1000.0),
+    "oz": ("g", 28.3495),
+    "lb": ("g", 453.592),
+    "ml": ("ml", 1.0),
+    "L": ("ml", 1000.0),
+    "fl oz": ("ml", 29.5735),
+    "cup": ("ml", 236.588),
+}
+
+UNIT_ALIASES = {
+    "gram": "g",
+    "grams": "g",
+    "kilogram": "kg",
+    "kilograms": "kg",
+    "l": "L",
+    "liter": "L",
+    "liters": "L",
+    "litre": "L",
+    "litres": "L",
+    "milliliter": "ml",
+    "milliliters": "ml",
+    "ounce": "oz",
+    "ounces": "oz",
+    "pound": "lb",
+    "pounds": "lb",
+    "lbs": "lb",
+    "cups": "cup",
+    "unit": "units",
+    "pack": "packs",
 }
 
 
@@ -22,9 +63,48 @@ def convert_quantity(amount: float, from_unit: str, to_unit: str) -> float:
     reverse_key = (to_unit, from_unit)
     if reverse_key in UNIT_CONVERSION:
         return amount / UNIT_CONVERSION[reverse_key]
+    if convertible(from_unit, to_unit):
+        return amount * UNIT_BASES[from_unit][1] / UNIT_BASES[to_unit][1]
     return amount
 
 
+def normalize_unit(unit: Optional[str]) -> str:
+    unit = (unit or "").strip()
+    if unit in UNIT_BASES:
+        return unit
+    return UNIT_ALIASES.get(unit.lower(), unit)
+
+
+def convertible(from_unit: str, to_unit: str) -> bool:
+    """True when amounts in the two units can be added after conversion."""
+    if from_unit == to_unit:
+        return True
+    from_base = UNIT_BASES.get(from_unit)
+    to_base = UNIT_BASES.get(to_unit)
+    return bool(from_base and to_base and from_base[0] == to_base[0])
+
+
+_NON_WORD = re.compile(r"[^\w\s]")
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """Matching key for item names: "Cherry  Tomatoes" -> "cherry tomato"."""
+    words = _NON_WORD.sub(" ", (name or "").lower()).split()
+    return " ".join([_singular(word) for word in words])
+
+
+def _singular(word: str) -> str:
+    if len(word) <= 3 or word.endswith("ss"):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "xes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
 def serialize_json(data) -> str:
     return json.dumps(data, ensure_ascii=False)
 
@@ -34,3 +114,11 @@ def parse_json(text: str, default):
         return json.loads(text)
     except Exception:
         return default
+
+
+def parse_date(text: Optional[str]) -> Optional[dt.date]:
+    """``YYYY-MM-DD`` (as sent by date inputs) or None."""
+    try:
+        return dt.date.fromisoformat((text or "").strip()[:10])
+    except ValueError:
+        return None